@@ -1,25 +1,26 @@
 from flask import Flask, jsonify, request
 from flask_cors import CORS
 import os
-from web3 import Web3
+import sys
+from pathlib import Path
+
+# Shared helpers live in the repository-level dvpn package
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.chain import get_client
+from dvpn.subscription_cache import SubscriptionCache
 
 app = Flask(__name__)
 CORS(app)
 
-# Connect to Sepolia testnet
-w3 = Web3(Web3.HTTPProvider('https://sepolia.infura.io/v3/YOUR_INFURA_KEY'))
+# Connect to Sepolia testnet over the shared keep-alive client
+w3 = get_client(os.getenv('ETH_RPC_URL', 'https://sepolia.infura.io/v3/YOUR_INFURA_KEY')).w3
 
-# Your subscription contract address and ABI
+# Your subscription contract address
 CONTRACT_ADDRESS = '0x516Fa3Ea215c372696e6D291F00f251f49904439'
-SUBSCRIPTION_ABI = [
-    {
-        "inputs": [{"internalType": "address", "name": "user", "type": "address"}],
-        "name": "hasActiveSubscription",
-        "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
-        "stateMutability": "view",
-        "type": "function"
-    }
-]
+
+# Subscription expiries are cached per address and invalidated from contract events
+subscription_cache = SubscriptionCache(w3, CONTRACT_ADDRESS)
+subscription_cache.start()
 
 @app.route('/verify-subscription', methods=['POST'])
 def verify_subscription():
@@ -30,11 +31,8 @@ def verify_subscription():
         if not eth_address:
             return jsonify({'error': 'eth_address is required'}), 400
             
-        # Initialize contract
-        contract = w3.eth.contract(address=CONTRACT_ADDRESS, abi=SUBSCRIPTION_ABI)
-        
         # Check subscription status
-        is_subscribed = contract.functions.hasActiveSubscription(eth_address).call()
+        is_subscribed = subscription_cache.is_active(eth_address)
         
         if is_subscribed:
             return jsonify({'status': 'active'}), 200
@@ -43,5 +41,9 @@ def verify_subscription():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/subscription-cache', methods=['GET'])
+def subscription_cache_stats():
+    return jsonify(subscription_cache.stats()), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=3006) 
\ No newline at end of file
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""Per-request cost of authenticating a bearer token in vpn_backend.
+
+Compares a full `jwt.decode` (HMAC check and claim validation) with
+AuthService.verify_token answering from its verified-claims cache:
+
+    python3 benchmarks/bench_auth.py --requests 100000 --users 1000
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import jwt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "vpn_backend"))
+os.environ.setdefault("JWT_SIGNING_KEYS", "bench:bench-secret")
+from services.auth_service import AuthService
+
+
+def run(label, verify, tokens, count):
+    started = time.perf_counter()
+    for i in range(count):
+        verify(tokens[i % len(tokens)])
+    elapsed = time.perf_counter() - started
+    print(f"  {label:<28} {elapsed / count * 1e6:8.2f} us/request")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark token verification")
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=1000, help="Distinct tokens in rotation")
+    args = parser.parse_args()
+
+    auth = AuthService()
+    tokens = [auth.generate_token({"address": f"0x{i:040x}"}) for i in range(args.users)]
+    secret = auth.signing_keys[auth.active_kid]
+
+    print(f"{args.requests} requests over {args.users} tokens")
+    run("jwt.decode", lambda token: jwt.decode(token, secret, algorithms=["HS256"]),
+        tokens, args.requests)
+    run("verify_token (cached)", auth.verify_token, tokens, args.requests)
+    print(f"  cache: {auth.stats()}")
+
+
+if __name__ == "__main__":
+    main()
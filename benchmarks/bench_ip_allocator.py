@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""Show that IPAllocator allocation time stays flat as the peer count grows.
+
+    python3 benchmarks/bench_ip_allocator.py --peers 60000
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.ip_allocator import IPAllocator
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peer IP allocation")
+    parser.add_argument("--peers", type=int, default=60000)
+    parser.add_argument("--network", default="10.0.0.0/16")
+    parser.add_argument("--bucket", type=int, default=10000)
+    args = parser.parse_args()
+
+    allocator = IPAllocator([args.network])
+    print(f"Allocating {args.peers} addresses from {args.network} "
+          f"(capacity {allocator.capacity()})")
+
+    allocated = []
+    started = time.perf_counter()
+    bucket_started = started
+    for n in range(1, args.peers + 1):
+        allocated.append(allocator.allocate())
+        if n % args.bucket == 0:
+            now = time.perf_counter()
+            print(f"  peers {n - args.bucket:>6}-{n:<6} "
+                  f"{(now - bucket_started) / args.bucket * 1e6:7.2f} us/alloc")
+            bucket_started = now
+    total = time.perf_counter() - started
+    print(f"Total: {total:.3f}s, {total / args.peers * 1e6:.2f} us/alloc")
+
+    # Steady-state churn with the pool nearly full
+    churn = min(args.bucket, len(allocated))
+    started = time.perf_counter()
+    for ip in allocated[:churn]:
+        allocator.release(ip)
+        allocator.allocate()
+    elapsed = time.perf_counter() - started
+    print(f"Release+allocate at {len(allocator)} peers: "
+          f"{elapsed / churn * 1e6:.2f} us/cycle")
+
+
+if __name__ == "__main__":
+    main()
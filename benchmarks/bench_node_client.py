@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Compare one-off `requests.get` calls with the pooled NodeClient.
+
+Starts a local keep-alive HTTP server (or uses --url) and times sequential
+status reads both ways:
+
+    python3 benchmarks/bench_node_client.py --requests 500
+    python3 benchmarks/bench_node_client.py --url https://NODE_IP:5000/health
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "vpn_backend"))
+from services.node_client import NodeClient
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep connections open between requests
+
+    def do_GET(self):
+        body = b'{"status": "connected"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def run(label, get, count):
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        get().raise_for_status()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(f"  {label:<22} mean {statistics.mean(latencies) * 1000:7.2f} ms  "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark node HTTP clients")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--url", help="Endpoint to read instead of a local server")
+    args = parser.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StatusHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}/peer-status"
+
+    client = NodeClient(verify=False)
+    print(f"{args.requests} sequential GET {url}")
+    run("requests.get", lambda: requests.get(url, verify=False, timeout=10), args.requests)
+    run("NodeClient", lambda: client.get(url), args.requests)
+    run("NodeClient (hedged)", lambda: client.get(url, hedge=True), args.requests)
+    print(f"  counters: {client.counters}")
+    client.close()
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""Compare a timer-wheel tick with scanning every peer for expired deadlines.
+
+    python3 benchmarks/bench_reaper.py --peers 50000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.timer_wheel import TimerWheel
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark reaper scheduling")
+    parser.add_argument("--peers", type=int, default=50000)
+    parser.add_argument("--tick", type=float, default=5)
+    parser.add_argument("--ticks", type=int, default=17280, help="Consecutive ticks (a day at 5s)")
+    parser.add_argument("--horizon", type=float, default=30 * 86400,
+                        help="Deadlines are spread over this many seconds")
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    start = time.time()
+    deadlines = {f"peer{i}": start + rng.uniform(0, args.horizon) for i in range(args.peers)}
+
+    wheel = TimerWheel(args.tick, 4096, start)
+    started = time.perf_counter()
+    for key, deadline in deadlines.items():
+        wheel.schedule(key, deadline)
+    print(f"Scheduled {args.peers} peers in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    fired = 0
+    started = time.perf_counter()
+    for n in range(1, args.ticks + 1):
+        fired += len(wheel.advance(start + n * args.tick))
+    wheel_tick = (time.perf_counter() - started) / args.ticks
+
+    scans = 50
+    started = time.perf_counter()
+    for n in range(1, scans + 1):
+        now = start + n * args.tick
+        [key for key, deadline in deadlines.items() if deadline <= now]
+    scan_tick = (time.perf_counter() - started) / scans
+
+    print(f"  timer wheel: {wheel_tick * 1e6:9.1f} us/tick ({fired} fired)")
+    print(f"  full scan:   {scan_tick * 1e6:9.1f} us/tick")
+
+
+if __name__ == "__main__":
+    main()
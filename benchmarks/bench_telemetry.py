@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Compare parsing `wg show dump` into per-peer dicts with the columnar PeerTable.
+
+    python3 benchmarks/bench_telemetry.py --peers 50000
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.telemetry import PeerTable
+from dvpn.wgctl import parse_dump
+
+
+def synthetic_dump(peers: int, now: int, seed: int) -> str:
+    lines = ["privkey\tpubkey\t51820\toff"]
+    for i in range(peers):
+        key = base64.b64encode(i.to_bytes(32, "big")).decode()
+        lines.append(f"{key}\t(none)\t198.51.100.{i % 250}:{40000 + i % 20000}\t"
+                     f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}/32\t"
+                     f"{now - i % 600}\t{(i + 1) * seed}\t{(i + 1) * seed * 3}\t25")
+    return "\n".join(lines) + "\n"
+
+
+def measure(label, func):
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    # Memory is measured on a second run; tracing would distort the timing
+    tracemalloc.start()
+    kept = func()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    print(f"  {label:<28} {elapsed * 1000:8.1f} ms  "
+          f"retained {retained / 2**20:6.1f} MiB  peak {peak / 2**20:6.1f} MiB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark peer telemetry parsing")
+    parser.add_argument("--peers", type=int, default=50000)
+    args = parser.parse_args()
+
+    now = int(time.time())
+    first, second = synthetic_dump(args.peers, now, 1000), synthetic_dump(args.peers, now, 1500)
+    print(f"{args.peers} peers, {len(first) / 2**20:.1f} MiB of dump output")
+
+    measure("parse_dump (dicts)", lambda: parse_dump(first))
+    previous = measure("PeerTable.from_dump", lambda: PeerTable.from_dump(first, now))
+    table = PeerTable.from_dump(second, now + 10)
+    measure("compute_rates", lambda: table.compute_rates(previous))
+    key = table.public_keys[os.getpid() % len(table)]
+    started = time.perf_counter()
+    for _ in range(10000):
+        table.get(key)
+    print(f"  {'single peer lookup':<28} {(time.perf_counter() - started) / 10000 * 1e6:8.2f} us")
+    print(f"  summary: {table.summary()}")
+
+
+if __name__ == "__main__":
+    main()
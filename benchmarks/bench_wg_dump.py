@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Compare rescanning `wg show dump` per new peer with a streamed dump and a kept index.
+
+The synthetic dump gives every peer an IPv4 and an IPv6 allowed IP:
+
+    python3 benchmarks/bench_wg_dump.py --peers 50000
+"""
+import argparse
+import base64
+import io
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.wgctl import iter_allowed_ips, parse_dump
+
+# generate_peer reads its pools and backend from the environment on import
+os.environ.setdefault("PEER_NETWORKS", "10.0.0.0/16,fd00::/112")
+os.environ.setdefault("WG_BACKEND", "fake")
+sys.path.append(str(Path(__file__).resolve().parent.parent / "wireguard-test"))
+from generate_peer import build_peer_index
+
+
+def synthetic_dump(peers: int) -> str:
+    lines = ["privkey\tpubkey\t51820\toff"]
+    for i in range(peers):
+        key = base64.b64encode(i.to_bytes(32, "big")).decode()
+        n = i + 2  # .0 is the network and .1 the server
+        lines.append(f"{key}\t(none)\t198.51.100.{i % 250}:{40000 + i % 20000}\t"
+                     f"10.0.{n >> 8 & 255}.{n & 255}/32,fd00::{n:x}/128\t"
+                     f"{1700000000 - i % 600}\t{i * 1000}\t{i * 3000}\t25")
+    return "\n".join(lines) + "\n"
+
+
+def measure(label, func, repeat: int = 1):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    elapsed = (time.perf_counter() - started) / repeat
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  {label:<34} {elapsed * 1000:9.2f} ms  peak {peak / 2**20:6.1f} MiB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dump parsing and address indexing")
+    parser.add_argument("--peers", type=int, default=50000)
+    parser.add_argument("--allocations", type=int, default=1000)
+    args = parser.parse_args()
+
+    dump = synthetic_dump(args.peers)
+    path = Path(f"/tmp/bench_wg_dump_{os.getpid()}.txt")
+    path.write_text(dump)
+    print(f"{args.peers} peers, {len(dump) / 2**20:.1f} MiB of dump output")
+
+    try:
+        measure("parse_dump (whole string)", lambda: parse_dump(dump))
+
+        def stream():
+            with open(path) as f:
+                return sum(len(ips) for _, ips in iter_allowed_ips(f))
+        measure("iter_allowed_ips (streamed file)", stream)
+
+        def build():
+            with open(path) as f:
+                return build_peer_index(iter_allowed_ips(f))
+        index = measure("build_peer_index (streamed file)", build)
+        print(f"  index: {len(index)} addresses in use")
+
+        # What the old code paid per new peer: a full rescan of the dump
+        measure("rescan per allocation", lambda: build_peer_index(
+            iter_allowed_ips(io.StringIO(dump))).allocate())
+        # The build moved the cursor past the addresses in use, so this is O(1) too
+        measure("first allocate from kept index", lambda: index.allocate(4))
+        started = time.perf_counter()
+        for _ in range(args.allocations):
+            index.allocate(4)
+        per_alloc = (time.perf_counter() - started) / args.allocations
+        print(f"  {'allocate from kept index':<34} {per_alloc * 1e6:9.2f} us")
+    finally:
+        path.unlink()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Measure /generate-peer throughput of a running node at increasing concurrency.
+
+Start the node first (WG_BACKEND=wg exercises real `wg` subprocesses), then:
+
+    python3 benchmarks/load_test_node.py --url http://localhost:8000 --requests 400
+
+If handlers block the event loop, requests/s stays flat as concurrency
+grows; with non-blocking handlers it scales until the disk or kernel
+becomes the bottleneck. Created peers are deleted again afterwards.
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+class NodeClient:
+    """A keep-alive HTTP connection per worker thread"""
+
+    def __init__(self, url: str):
+        self.url = urlparse(url)
+        self._local = threading.local()
+
+    def post(self, path: str, body: dict):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(
+                self.url.hostname, self.url.port or 80, timeout=30)
+        try:
+            conn.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        except (http.client.HTTPException, OSError):
+            self._local.conn = None
+            conn.close()
+            raise
+
+
+def run_level(client: NodeClient, concurrency: int, total: int, prefix: str):
+    user_ids = [f"{prefix}-{concurrency}-{i}" for i in range(total)]
+    latencies = []
+    errors = 0
+
+    def one(user_id):
+        started = time.perf_counter()
+        status = client.post("/generate-peer", {"user_id": user_id})
+        return status, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status, latency in pool.map(one, user_ids):
+            latencies.append(latency)
+            errors += status != 200
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+    print(f"  concurrency {concurrency:>3}: {total / elapsed:8.1f} req/s  "
+          f"p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  errors {errors}")
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda user_id: client.post("/delete-peer", {"user_id": user_id}),
+                      user_ids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /generate-peer")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per level")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    args = parser.parse_args()
+
+    client = NodeClient(args.url)
+    prefix = f"loadtest-{uuid.uuid4().hex[:8]}"
+    print(f"{args.requests} requests per level against {args.url}")
+    for level in (int(c) for c in args.concurrency.split(",")):
+        run_level(client, level, args.requests, prefix)
+
+
+if __name__ == "__main__":
+    main()
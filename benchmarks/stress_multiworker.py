@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""Hammer peer creation from many processes and check no IP or key is handed out twice.
+
+Local mode (default) runs N worker processes against one peer store in a
+temporary directory, using the same PeerStore/IPAllocator transaction the
+node's /generate-peer uses:
+
+    python3 benchmarks/stress_multiworker.py --workers 8 --peers 500
+
+HTTP mode hammers a node started with WORKERS=N (and WG_BACKEND=fake on a
+test machine):
+
+    python3 benchmarks/stress_multiworker.py --url http://localhost:8000 --peers 2000
+"""
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import tempfile
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.ip_allocator import IPAllocator
+from dvpn.keys import generate_keypair, public_key_from_private
+from dvpn.peer_store import PeerStore
+
+
+def open_store(directory: Path, network: str):
+    store = PeerStore(directory / "peers.json", compact_every=200,
+                      lock_path=directory / "peers.lock")
+    allocator = IPAllocator([network])
+    allocator.follow(store)
+    store.load()
+    return store, allocator
+
+
+def local_worker(args):
+    directory, network, worker, peers, delete_ratio = args
+    store, allocator = open_store(Path(directory), network)
+    rng = random.Random(worker)
+    created = []
+    for i in range(peers):
+        user_id = f"w{worker}-{i}"
+        _, public_key = generate_keypair()
+        with store.transaction():
+            ip = str(allocator.allocate())
+            store.put(user_id, {"public_key": public_key, "ip": ip})
+        created.append(user_id)
+        if rng.random() < delete_ratio:
+            store.remove(created.pop(rng.randrange(len(created))))
+    store.close()
+    return len(created)
+
+
+def duplicates(values):
+    return [value for value, count in Counter(values).items() if count > 1]
+
+
+def run_local(args):
+    directory = Path(tempfile.mkdtemp(prefix="peer-stress-"))
+    jobs = [(str(directory), args.network, w, args.peers, args.delete_ratio)
+            for w in range(args.workers)]
+    with multiprocessing.Pool(args.workers) as pool:
+        expected = sum(pool.map(local_worker, jobs))
+
+    store = PeerStore(directory / "peers.json").load()
+    peers = [peer for _, peer in store.items()]
+    return expected, [peer["ip"] for peer in peers], [peer["public_key"] for peer in peers]
+
+
+def run_http(args):
+    def create(i):
+        request = urllib.request.Request(
+            f"{args.url}/generate-peer",
+            data=json.dumps({"user_id": f"stress-{i}"}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            config = json.load(response)["config"]
+        fields = dict(line.split(" = ", 1) for line in config.splitlines() if " = " in line)
+        return fields["Address"].split("/")[0], public_key_from_private(fields["PrivateKey"])
+
+    with ThreadPoolExecutor(max_workers=args.workers * 8) as pool:
+        results = list(pool.map(create, range(args.peers)))
+    return len(results), [ip for ip, _ in results], [key for _, key in results]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-worker peer creation stress test")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--peers", type=int, default=500, help="Peers per worker (local) or total (HTTP)")
+    parser.add_argument("--network", default="10.0.0.0/16")
+    parser.add_argument("--delete-ratio", type=float, default=0.2)
+    parser.add_argument("--url", help="Hammer a running node instead of local processes")
+    args = parser.parse_args()
+
+    expected, ips, keys = run_http(args) if args.url else run_local(args)
+    dup_ips, dup_keys = duplicates(ips), duplicates(keys)
+    print(f"{len(ips)} peers (expected {expected}), "
+          f"{len(dup_ips)} duplicate IPs, {len(dup_keys)} duplicate keys")
+    if dup_ips or dup_keys or len(ips) != expected:
+        print(f"FAILED: duplicate IPs {dup_ips[:5]}, duplicate keys {dup_keys[:5]}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Shared helpers for the dVPN node APIs and backend services."""
@@ -0,0 +1,83 @@
+"""Lazy peer activation: keep only recently active peers on the interface."""
+import heapq
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .telemetry import CONNECTED_WINDOW, PeerTable
+
+# (public_key, last_active) of a peer chosen for eviction
+Eviction = Tuple[str, float]
+
+
+class ActivationPolicy:
+    """Decides which stored peers need installing and which installed peers can go.
+
+    A peer's last activity is the newer of its latest handshake and the
+    `last_active` time kept on its peer record (set when it is activated and
+    when it is evicted); a peer with neither counts from the time it was
+    first seen installed, so one that was just added gets a full
+    `idle_timeout` to make its first handshake. Peers idle longer than
+    `idle_timeout` are evicted; above `max_active` installed peers the least
+    recently active ones that are not connected go as well.
+    """
+
+    def __init__(self, max_active: int = 0, idle_timeout: float = 900,
+                 clock: Callable[[], float] = time.time):
+        self.max_active = max_active
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._first_seen: Dict[str, float] = {}
+        self.evictions = 0
+        self.activations = 0
+
+    def last_active(self, table: Optional[PeerTable], peer: Dict) -> float:
+        i = table.index.get(peer["public_key"]) if table is not None else None
+        handshake = table.latest_handshake[i] if i is not None else 0
+        last = max(handshake, peer.get("last_active") or 0)
+        return last or self._first_seen.get(peer["public_key"], 0)
+
+    def is_warm(self, table: Optional[PeerTable], peer: Dict) -> bool:
+        """True if the peer is installed and safely clear of eviction.
+
+        Only peers active within the first half of the idle timeout qualify,
+        which leaves the client the other half to connect.
+        """
+        if table is None or peer["public_key"] not in table.index:
+            return False
+        return self.clock() - self.last_active(table, peer) < self.idle_timeout / 2
+
+    def select(self, table: PeerTable,
+               lookup: Callable[[str], Optional[Tuple[str, Dict]]]) -> List[Eviction]:
+        """Peers in `table` to remove from the interface.
+
+        `lookup` maps a public key to its (user_id, peer) record; interface
+        peers the store does not know about are left alone.
+        """
+        now = self.clock()
+        first_seen = self._first_seen
+        self._first_seen = {key: first_seen.get(key, now) for key in table.public_keys}
+
+        active, idle = [], []
+        for key in table.public_keys:
+            found = lookup(key)
+            if found is None:
+                continue
+            last = self.last_active(table, found[1])
+            (idle if now - last >= self.idle_timeout else active).append((last, key))
+
+        evict = [(key, last) for last, key in idle]
+        excess = len(active) - self.max_active
+        if self.max_active and excess > 0:
+            candidates = [(last, key) for last, key in active if now - last >= CONNECTED_WINDOW]
+            evict.extend((key, last) for last, key in heapq.nsmallest(excess, candidates))
+        return evict
+
+    def evicted(self, public_keys: List[str]):
+        for key in public_keys:
+            self._first_seen.pop(key, None)
+        self.evictions += len(public_keys)
+
+    def stats(self) -> Dict:
+        return {"max_active": self.max_active, "idle_timeout": self.idle_timeout,
+                "installed": len(self._first_seen), "activations": self.activations,
+                "evictions": self.evictions}
@@ -0,0 +1,247 @@
+"""Shared Ethereum JSON-RPC client with pooled connections, retries and a circuit breaker."""
+import logging
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+
+from .abi import SUBSCRIPTION_ABI
+
+try:
+    from web3 import AsyncHTTPProvider, AsyncWeb3
+except ImportError:  # pragma: no cover - older web3 releases
+    AsyncWeb3 = None
+
+logger = logging.getLogger(__name__)
+
+# Transport failures worth retrying; JSON-RPC errors and reverts are not
+RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    ConnectionError, TimeoutError)
+# Rate limiting and server errors from the endpoint are retried as well
+RETRYABLE_STATUS = 429
+
+
+def _http_status(error: BaseException) -> Optional[int]:
+    """Status code of an HTTP error from requests (`response.status_code`) or aiohttp (`status`)"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) if response is not None else None
+    return status if status is not None else getattr(error, "status", None)
+
+
+def is_retryable(error: BaseException, retryable=RETRYABLE_ERRORS) -> bool:
+    if isinstance(error, retryable):
+        return True
+    status = _http_status(error)
+    return isinstance(status, int) and (status == RETRYABLE_STATUS or status >= 500)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an RPC endpoint that keeps failing"""
+
+
+class CircuitBreaker:
+    """Stops calls after `failure_threshold` consecutive failures for `reset_timeout` seconds.
+
+    Once the timeout passes a single trial call is let through (half-open);
+    its success closes the circuit again, its failure re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def before_call(self):
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_in_flight:
+                raise CircuitOpenError("RPC endpoint circuit is open")
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+def make_session(pool_size: int = 20) -> requests.Session:
+    """A keep-alive session whose pool can hold `pool_size` connections per host"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _backoff(attempt: int, base: float, cap: float = 5.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def _retry_delay(error: BaseException, attempt: int, base: float, cap: float = 5.0) -> float:
+    """The endpoint's Retry-After when it sent one (capped), otherwise backoff"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    try:
+        return min(cap, float(headers.get("Retry-After")))
+    except (TypeError, ValueError):
+        return _backoff(attempt, base, cap)
+
+
+def retry_middleware(breaker: CircuitBreaker, retries: int, backoff: float):
+    """web3 middleware retrying transport failures behind a circuit breaker.
+
+    Every attempt records its outcome, whatever it raised, so a half-open
+    trial call always closes or re-opens the circuit.
+    """
+    def middleware(make_request, w3):
+        def request(method, params):
+            attempt = 0
+            while True:
+                breaker.before_call()
+                outcome = breaker.record_failure
+                try:
+                    response = make_request(method, params)
+                    outcome = breaker.record_success
+                except Exception as e:
+                    if attempt >= retries or not is_retryable(e):
+                        raise
+                    delay = _retry_delay(e, attempt, backoff)
+                    logger.debug("RPC %s failed (%s), retrying in %.2fs", method, e, delay)
+                else:
+                    return response
+                finally:
+                    outcome()
+                time.sleep(delay)
+                attempt += 1
+        return request
+    return middleware
+
+
+def async_retry_middleware(breaker: CircuitBreaker, retries: int, backoff: float):
+    """Async counterpart of `retry_middleware`"""
+    import asyncio
+
+    retryable = RETRYABLE_ERRORS + (asyncio.TimeoutError,)
+    try:
+        import aiohttp
+        retryable += (aiohttp.ClientConnectionError,)
+    except ImportError:
+        pass
+
+    async def middleware(make_request, w3):
+        async def request(method, params):
+            attempt = 0
+            while True:
+                breaker.before_call()
+                outcome = breaker.record_failure
+                try:
+                    response = await make_request(method, params)
+                    outcome = breaker.record_success
+                except Exception as e:
+                    if attempt >= retries or not is_retryable(e, retryable):
+                        raise
+                    delay = _retry_delay(e, attempt, backoff)
+                else:
+                    return response
+                finally:
+                    outcome()
+                await asyncio.sleep(delay)
+                attempt += 1
+        return request
+    return middleware
+
+
+class ChainClient:
+    """One Web3 connection per RPC endpoint, shared by everything in the process.
+
+    The HTTP provider runs on a pooled keep-alive session, so calls after
+    the first skip the TCP/TLS handshake. Contract objects are built once
+    per (address, ABI) and reused.
+    """
+
+    def __init__(self, rpc_url: str, pool_size: int = 20, timeout: float = 10,
+                 retries: int = 3, backoff: float = 0.25,
+                 failure_threshold: int = 5, reset_timeout: float = 30):
+        self.rpc_url = rpc_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.session = make_session(pool_size)
+        provider = Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": timeout},
+                                     session=self.session)
+        # Retries happen in retry_middleware; web3's own retry layer would multiply them
+        provider.middlewares = ()
+        self.w3 = Web3(provider)
+        self.w3.middleware_onion.add(retry_middleware(self.breaker, retries, backoff),
+                                     name="retry")
+        self._async_w3 = None
+        self._contracts: Dict[Tuple[str, int], object] = {}
+        self._lock = threading.Lock()
+
+    def contract(self, address: str, abi=SUBSCRIPTION_ABI):
+        """A cached contract object bound to the shared provider"""
+        address = Web3.to_checksum_address(address)
+        key = (address, id(abi))
+        with self._lock:
+            contract = self._contracts.get(key)
+            if contract is None:
+                contract = self.w3.eth.contract(address=address, abi=abi)
+                self._contracts[key] = contract
+            return contract
+
+    @property
+    def async_w3(self):
+        """An AsyncWeb3 instance for the same endpoint, created on first use"""
+        if AsyncWeb3 is None:
+            raise RuntimeError("This web3 release has no AsyncWeb3 support")
+        with self._lock:
+            if self._async_w3 is None:
+                provider = AsyncHTTPProvider(self.rpc_url,
+                                             request_kwargs={"timeout": self.timeout})
+                provider.middlewares = ()
+                self._async_w3 = AsyncWeb3(provider)
+                self._async_w3.middleware_onion.add(
+                    async_retry_middleware(self.breaker, self.retries, self.backoff),
+                    name="retry")
+            return self._async_w3
+
+
+_clients: Dict[str, ChainClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(rpc_url: str, **kwargs) -> ChainClient:
+    """Return the process-wide client for `rpc_url`, creating it on first use"""
+    with _clients_lock:
+        client = _clients.get(rpc_url)
+        if client is None:
+            client = ChainClient(rpc_url, **kwargs)
+            _clients[rpc_url] = client
+        return client
@@ -0,0 +1,120 @@
+"""Bounded in-memory cache of rendered client configs, optionally persisted to disk."""
+import collections
+import io
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+from dvpn.peer_store import write_atomic
+
+try:
+    import qrcode
+except ImportError:  # QR rendering is optional
+    qrcode = None
+
+
+def _filename(key: str) -> str:
+    return re.sub(r"[^A-Za-z0-9._-]", "_", key)
+
+
+class ConfigCache:
+    """LRU of rendered configs (as bytes) keyed by peer, with their QR codes.
+
+    Configs are encoded once when stored and served as-is afterwards. With
+    `directory` set each config is also written there as `<key>.conf`, so an
+    entry evicted from memory can still be streamed from disk with sendfile.
+    QR PNGs are rendered on first request and share the same LRU.
+    """
+
+    def __init__(self, max_entries: int = 1024, directory=None):
+        self.max_entries = max_entries
+        self.directory = Path(directory) if directory else None
+        self._entries: "collections.OrderedDict[tuple, bytes]" = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, entry_key: tuple) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(entry_key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(entry_key)
+            self.hits += 1
+            return data
+
+    def _set(self, entry_key: tuple, data: bytes):
+        with self._lock:
+            self._entries[entry_key] = data
+            self._entries.move_to_end(entry_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def path(self, key: str) -> Optional[Path]:
+        """On-disk copy of a config, if persistence is enabled and it exists"""
+        if self.directory is None:
+            return None
+        path = self.directory / f"{_filename(key)}.conf"
+        return path if path.exists() else None
+
+    def put(self, key: str, config: Union[str, bytes]) -> bytes:
+        """Store a rendered config, replacing any previous one and its QR code"""
+        data = config.encode() if isinstance(config, str) else config
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.directory / f"{_filename(key)}.conf", data)
+        with self._lock:
+            self._entries.pop((key, "qr"), None)
+        self._set((key, "conf"), data)
+        return data
+
+    def get(self, key: str, load: bool = True) -> Optional[bytes]:
+        """Config bytes from memory, falling back to (and re-caching) the disk copy"""
+        data = self._get((key, "conf"))
+        if data is None and load:
+            path = self.path(key)
+            if path is not None:
+                data = path.read_bytes()
+                self._set((key, "conf"), data)
+        return data
+
+    def qr_png(self, key: str) -> Optional[bytes]:
+        """PNG QR code of a config for the mobile apps; None if the config is unknown"""
+        data = self._get((key, "qr"))
+        if data is not None:
+            return data
+        if qrcode is None:
+            raise RuntimeError("QR rendering needs the qrcode package (pip install qrcode[pil])")
+        config = self.get(key)
+        if config is None:
+            return None
+        buffer = io.BytesIO()
+        qrcode.make(config.decode()).save(buffer, format="PNG")
+        data = buffer.getvalue()
+        self._set((key, "qr"), data)
+        return data
+
+    def invalidate(self, key: str, delete: bool = False):
+        """Drop a peer's cached config and QR code, and optionally its disk copy"""
+        with self._lock:
+            self._entries.pop((key, "conf"), None)
+            self._entries.pop((key, "qr"), None)
+        if delete:
+            path = self.path(key)
+            if path is not None:
+                os.unlink(path)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "persisted": self.directory is not None,
+            }
@@ -0,0 +1,165 @@
+"""Constant-time peer address allocation over configurable CIDR pools."""
+import collections
+import ipaddress
+import socket
+from typing import Deque, Iterable, List, Optional, Set, Union
+
+Address = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+def parse_address(ip: Union[str, Address]) -> Address:
+    """`ipaddress.ip_address`, but quicker: addresses pass through unchanged and
+    strings are parsed by `inet_pton` rather than in Python"""
+    if isinstance(ip, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return ip
+    try:
+        if ":" in ip:
+            return ipaddress.IPv6Address(socket.inet_pton(socket.AF_INET6, ip))
+        return ipaddress.IPv4Address(socket.inet_pton(socket.AF_INET, ip))
+    except (OSError, TypeError):
+        # Scoped IPv6, integers, or invalid input (which raises the usual ValueError)
+        return ipaddress.ip_address(ip)
+
+
+class AddressPoolExhausted(Exception):
+    """Raised when every pool has run out of free addresses"""
+
+
+class IPAllocator:
+    """Hands out host addresses from one or more IPv4/IPv6 networks.
+
+    Each pool is consumed through a bump pointer, and released addresses go
+    onto a FIFO free-list (so a just-deleted address is the last to be
+    reused). Both allocate and release are O(1); addresses already taken
+    when the pointer reaches them are skipped, which is amortised O(1)
+    since each one is skipped at most once.
+
+    The network address, the first host (the server's own address) and,
+    for IPv4, the broadcast address of every pool are never handed out.
+    """
+
+    def __init__(self, networks: Iterable[str], reserved: Iterable[str] = ()):
+        self.pools: List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]] = [
+            ipaddress.ip_network(n.strip(), strict=False) for n in networks if n.strip()
+        ]
+        if not self.pools:
+            raise ValueError("At least one peer network is required")
+
+        self._reserved: Set[Address] = {parse_address(ip) for ip in reserved}
+        for pool in self.pools:
+            self._reserved.add(pool.network_address)
+            if pool.num_addresses > 2:
+                self._reserved.add(pool.network_address + 1)
+            if pool.version == 4 and pool.num_addresses > 2:
+                self._reserved.add(pool.broadcast_address)
+
+        # Next never-allocated offset into each pool
+        self._cursors = [0] * len(self.pools)
+        self._free: Deque[Address] = collections.deque()
+        self._used: Set[Address] = set()
+
+    @classmethod
+    def from_env_value(cls, value: str, reserved: Iterable[str] = ()) -> "IPAllocator":
+        """Build an allocator from a comma-separated list of CIDRs"""
+        return cls(value.split(","), reserved=reserved)
+
+    def allocate(self, version: Optional[int] = None) -> Address:
+        """Return a free address, optionally restricted to IPv4 or IPv6"""
+        for _ in range(len(self._free)):
+            ip = self._free.popleft()
+            if ip in self._used:
+                continue
+            if version is not None and ip.version != version:
+                self._free.append(ip)
+                continue
+            self._used.add(ip)
+            return ip
+
+        for i, pool in enumerate(self.pools):
+            if version is not None and pool.version != version:
+                continue
+            base = pool.network_address
+            size = pool.num_addresses
+            cursor = self._cursors[i]
+            while cursor < size:
+                ip = base + cursor
+                cursor += 1
+                if ip in self._used or ip in self._reserved:
+                    continue
+                self._cursors[i] = cursor
+                self._used.add(ip)
+                return ip
+            self._cursors[i] = cursor
+
+        raise AddressPoolExhausted("No available IP addresses")
+
+    def mark_used(self, ip: Union[str, Address]) -> bool:
+        """Record an address as taken (used when rebuilding from the peer store)"""
+        ip = parse_address(ip)
+        if ip in self._used or ip in self._reserved or not self.contains(ip):
+            return False
+        self._used.add(ip)
+        return True
+
+    def skip_used(self):
+        """Move every pool's cursor past the taken addresses at its front.
+
+        After marking many addresses used (rebuilding from a dump or a store)
+        the first allocate would otherwise walk over all of them; calling this
+        once the index is built keeps that walk off the request path.
+        """
+        for i, pool in enumerate(self.pools):
+            base, size, cursor = pool.network_address, pool.num_addresses, self._cursors[i]
+            while cursor < size and (base + cursor in self._used or base + cursor in self._reserved):
+                cursor += 1
+            self._cursors[i] = cursor
+
+    def release(self, ip: Union[str, Address]) -> bool:
+        """Return an address to the free-list"""
+        ip = parse_address(ip)
+        if ip not in self._used:
+            return False
+        self._used.discard(ip)
+        self._free.append(ip)
+        return True
+
+    def follow(self, store):
+        """Keep allocations in step with a PeerStore, including changes replayed
+        from other processes. Allocate inside `store.transaction()` so the
+        address and the record are committed together."""
+        def on_change(user_id, old, new):
+            old_ip = old.get("ip") if old else None
+            new_ip = new.get("ip") if new else None
+            if old_ip and old_ip != new_ip:
+                self.release(old_ip)
+            if new_ip:
+                self.mark_used(new_ip)
+        store.subscribe(on_change)
+
+    def contains(self, ip: Union[str, Address]) -> bool:
+        ip = parse_address(ip)
+        return any(ip in pool for pool in self.pools)
+
+    def is_used(self, ip: Union[str, Address]) -> bool:
+        return parse_address(ip) in self._used
+
+    def prefixlen(self, ip: Union[str, Address]) -> int:
+        """Prefix length of the pool an address belongs to"""
+        ip = parse_address(ip)
+        for pool in self.pools:
+            if ip in pool:
+                return pool.prefixlen
+        return ip.max_prefixlen
+
+    def capacity(self) -> int:
+        reserved = sum(1 for ip in self._reserved if self.contains(ip))
+        return sum(pool.num_addresses for pool in self.pools) - reserved
+
+    def __len__(self) -> int:
+        return len(self._used)
+
+
+def host_prefix(ip: Union[str, Address]) -> str:
+    """The single-host CIDR for an address, e.g. `10.0.0.2/32` or `fd00::2/128`"""
+    ip = parse_address(ip)
+    return f"{ip}/{ip.max_prefixlen}"
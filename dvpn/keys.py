@@ -0,0 +1,195 @@
+"""In-process WireGuard key generation and a pre-generated keypair pool."""
+import base64
+import collections
+import logging
+import os
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Tuple
+
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+except ImportError:  # pragma: no cover - exercised only without cryptography
+    X25519PrivateKey = None
+
+logger = logging.getLogger(__name__)
+
+Keypair = Tuple[str, str]
+
+# Curve25519 field prime and the (A - 2) / 4 constant from RFC 7748
+_P = 2 ** 255 - 19
+_A24 = 121665
+
+
+def _clamp(scalar: bytes) -> bytes:
+    """Clamp a 32-byte scalar the same way `wg genkey` does"""
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+
+def _x25519_base(scalar: bytes) -> bytes:
+    """Pure-Python X25519 scalar multiplication by the base point (RFC 7748)"""
+    k = int.from_bytes(_clamp(scalar), "little")
+    x1 = 9
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in reversed(range(255)):
+        k_t = (k >> t) & 1
+        swap ^= k_t
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = k_t
+
+        a = x2 + z2
+        aa = a * a
+        b = x2 - z2
+        bb = b * b
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a
+        cb = c * b
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def public_key_from_private(private_key: str) -> str:
+    """Derive the base64 public key for a base64 private key (`wg pubkey`)"""
+    raw = base64.b64decode(private_key)
+    if X25519PrivateKey is not None:
+        public = X25519PrivateKey.from_private_bytes(raw).public_key().public_bytes(
+            serialization.Encoding.Raw, serialization.PublicFormat.Raw
+        )
+    else:
+        public = _x25519_base(raw)
+    return base64.b64encode(public).decode()
+
+
+def generate_keypair() -> Keypair:
+    """Generate a WireGuard (private_key, public_key) pair without forking `wg`"""
+    private_key = base64.b64encode(_clamp(os.urandom(32))).decode()
+    return private_key, public_key_from_private(private_key)
+
+
+class KeyPool:
+    """Bounded pool of ready keypairs, refilled by a background thread.
+
+    `get()` pops a keypair in O(1). When the pool drops to `low_water` the
+    refill thread is woken to top it back up to `size`; if the pool is ever
+    empty the caller generates a keypair inline instead of waiting.
+    """
+
+    def __init__(self, size: int = 64, low_water: int = 16,
+                 generator: Callable[[], Keypair] = generate_keypair):
+        if size < 1:
+            raise ValueError("Key pool size must be at least 1")
+        self.size = size
+        self.low_water = min(max(low_water, 0), size - 1)
+        self._generator = generator
+        self._keys: Deque[Keypair] = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        self.hits = 0
+        self.misses = 0
+        self.refills = 0
+        self.last_refill_seconds = 0.0
+        self.last_refill_count = 0
+
+    def start(self):
+        """Start the refill thread and request an initial fill"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="keypool-refill", daemon=True)
+        self._thread.start()
+        self._wakeup.set()
+
+    def stop(self):
+        """Stop the refill thread"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def get(self) -> Keypair:
+        """Take a keypair from the pool, generating one inline if it is empty"""
+        with self._lock:
+            keypair = self._keys.popleft() if self._keys else None
+            depth = len(self._keys)
+            if keypair is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if depth <= self.low_water:
+            self._wakeup.set()
+        return keypair if keypair is not None else self._generator()
+
+    def get_many(self, count: int) -> List[Keypair]:
+        """Take `count` keypairs, generating inline whatever the pool cannot cover"""
+        with self._lock:
+            taken = [self._keys.popleft() for _ in range(min(count, len(self._keys)))]
+            self.hits += len(taken)
+            self.misses += count - len(taken)
+        self._wakeup.set()
+        return taken + [self._generator() for _ in range(count - len(taken))]
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._keys)
+
+    def stats(self) -> Dict:
+        """Pool depth, configuration and refill timings"""
+        with self._lock:
+            return {
+                "depth": len(self._keys),
+                "size": self.size,
+                "low_water": self.low_water,
+                "hits": self.hits,
+                "misses": self.misses,
+                "refills": self.refills,
+                "last_refill_seconds": self.last_refill_seconds,
+                "last_refill_count": self.last_refill_count,
+            }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                self._refill()
+            except Exception:
+                logger.exception("Key pool refill failed")
+                # Avoid spinning if the generator keeps failing
+                self._stopped.wait(1)
+
+    def _refill(self):
+        started = time.perf_counter()
+        added = 0
+        while not self._stopped.is_set():
+            with self._lock:
+                if len(self._keys) >= self.size:
+                    break
+            keypair = self._generator()
+            with self._lock:
+                self._keys.append(keypair)
+            added += 1
+        if added:
+            with self._lock:
+                self.refills += 1
+                self.last_refill_count = added
+                self.last_refill_seconds = time.perf_counter() - started
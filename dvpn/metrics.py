@@ -0,0 +1,125 @@
+"""Prometheus metrics for the node and backend APIs (Flask and FastAPI)."""
+import asyncio
+import contextlib
+import functools
+import os
+import time
+
+try:
+    import prometheus_client
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Histogram
+except ImportError:  # metrics are optional; the timers below become no-ops
+    prometheus_client = None
+
+# Stage timings range from microseconds (IP allocation) to seconds (RPC calls)
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                 0.25, 0.5, 1, 2.5, 5, 10)
+
+if prometheus_client is not None:
+    STAGE_SECONDS = Histogram("dvpn_stage_seconds", "Time spent in each request stage",
+                              ["stage"], buckets=STAGE_BUCKETS)
+    STAGE_ERRORS = Counter("dvpn_stage_errors_total", "Failed request stages",
+                           ["stage", "error"])
+    REQUEST_SECONDS = Histogram("dvpn_http_request_seconds", "HTTP request latency",
+                                ["method", "handler", "status"], buckets=STAGE_BUCKETS)
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a block as `name`, counting exceptions raised from it by type"""
+    if prometheus_client is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        STAGE_ERRORS.labels(name, type(e).__name__).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+def timed(name: str):
+    """Decorator form of `stage` for plain and async functions"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with stage(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def observe_request(method: str, handler: str, status: int, seconds: float):
+    if prometheus_client is not None:
+        REQUEST_SECONDS.labels(method, handler, str(status)).observe(seconds)
+
+
+def render():
+    """Exposition body and content type; aggregates worker processes when
+    PROMETHEUS_MULTIPROC_DIR is set"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import CollectorRegistry, multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def instrument_flask(app):
+    """Time every request and serve /metrics on a Flask app"""
+    from flask import Response, g, jsonify, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None:
+            observe_request(request.method, request.endpoint or "unmatched",
+                            response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        if prometheus_client is None:
+            return jsonify({"error": "prometheus_client is not installed"}), 501
+        body, content_type = render()
+        return Response(body, content_type=content_type)
+
+    return app
+
+
+def instrument_fastapi(app):
+    """Time every request and serve /metrics on a FastAPI app"""
+    from fastapi.responses import JSONResponse, Response
+
+    @app.middleware("http")
+    async def _record_request(request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        # Routing fills in the endpoint, which keeps the label set bounded
+        endpoint = request.scope.get("endpoint")
+        observe_request(request.method, getattr(endpoint, "__name__", "unmatched"),
+                        response.status_code, time.perf_counter() - started)
+        return response
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        if prometheus_client is None:
+            return JSONResponse({"detail": "prometheus_client is not installed"}, status_code=501)
+        body, content_type = render()
+        return Response(body, media_type=content_type)
+
+    return app
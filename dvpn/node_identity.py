@@ -0,0 +1,164 @@
+"""Resolve and cache the node's public endpoint address."""
+import ipaddress
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+GCP_METADATA_URL = ("http://metadata.google.internal/computeMetadata/v1/instance/"
+                    "network-interfaces/0/access-configs/0/external-ip")
+EXTERNAL_IP_URLS = ["https://api.ipify.org", "https://ifconfig.me/ip"]
+
+
+def _valid_public_ip(value: Optional[str]) -> Optional[str]:
+    try:
+        ip = ipaddress.ip_address((value or "").strip())
+    except ValueError:
+        return None
+    return str(ip) if ip.is_global else None
+
+
+def _http_get(url: str, timeout: float, headers=None) -> str:
+    req = urllib.request.Request(url, headers=headers or {})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return response.read().decode().strip()
+
+
+def from_local_interface(timeout: float = 1.0) -> Optional[str]:
+    """Address of the interface holding the default route, if it is public"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.settimeout(timeout)
+        # connect() on UDP sends nothing; it only selects the outgoing interface
+        s.connect(("8.8.8.8", 53))
+        return _valid_public_ip(s.getsockname()[0])
+
+
+def from_gcp_metadata(timeout: float = 1.0) -> Optional[str]:
+    """External IP from the Google Cloud metadata server"""
+    return _valid_public_ip(_http_get(GCP_METADATA_URL, timeout, {"Metadata-Flavor": "Google"}))
+
+
+def from_external_service(timeout: float = 3.0) -> Optional[str]:
+    """External IP as seen by a public echo service"""
+    for url in EXTERNAL_IP_URLS:
+        try:
+            ip = _valid_public_ip(_http_get(url, timeout))
+            if ip:
+                return ip
+        except Exception as e:
+            logger.debug("Public IP lookup via %s failed: %s", url, e)
+    return None
+
+
+class NodeIdentity:
+    """The node's public endpoint, resolved once and refreshed in the background.
+
+    Resolution order: the `env_var` override, the local default-route
+    interface, the cloud metadata server, then an external echo service.
+    The result is kept for `ttl` seconds and, when `cache_path` is given,
+    persisted so short-lived processes (the CLI scripts) share it too.
+    """
+
+    def __init__(self, env_var: str = "SERVER_ENDPOINT", ttl: float = 3600,
+                 cache_path=None, resolvers: Optional[List[Tuple[str, Callable]]] = None):
+        self.env_var = env_var
+        self.ttl = ttl
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.resolvers = resolvers if resolvers is not None else [
+            ("interface", from_local_interface),
+            ("metadata", from_gcp_metadata),
+            ("external", from_external_service),
+        ]
+        self._address: Optional[str] = None
+        self._source: Optional[str] = None
+        self._resolved_at = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def get(self) -> Optional[str]:
+        """Return the cached endpoint, resolving it if missing or stale"""
+        override = os.getenv(self.env_var)
+        if override:
+            return override
+        with self._lock:
+            if self._address and time.time() - self._resolved_at < self.ttl:
+                return self._address
+        if self._load_cache():
+            return self._address
+        return self.refresh()
+
+    def refresh(self) -> Optional[str]:
+        """Re-run the resolvers; keeps the previous address if all of them fail"""
+        for source, resolver in self.resolvers:
+            try:
+                address = resolver()
+            except Exception as e:
+                logger.debug("Endpoint resolver %s failed: %s", source, e)
+                continue
+            if address:
+                with self._lock:
+                    self._address, self._source = address, source
+                    self._resolved_at = time.time()
+                self._save_cache()
+                return address
+        logger.warning("Could not resolve the node's public IP")
+        with self._lock:
+            return self._address
+
+    def info(self):
+        with self._lock:
+            return {"address": self._address, "source": self._source,
+                    "resolved_at": self._resolved_at}
+
+    def start(self):
+        """Resolve now and keep refreshing every `ttl` seconds in the background"""
+        if self._thread is not None or os.getenv(self.env_var):
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="node-identity", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        self.refresh()
+        while not self._stopped.wait(self.ttl):
+            self.refresh()
+
+    def _load_cache(self) -> bool:
+        if not self.cache_path or not self.cache_path.exists():
+            return False
+        try:
+            with open(self.cache_path, "r") as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if time.time() - cached.get("resolved_at", 0) >= self.ttl or not cached.get("address"):
+            return False
+        with self._lock:
+            self._address = cached["address"]
+            self._source = cached.get("source")
+            self._resolved_at = cached["resolved_at"]
+        return True
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.cache_path, "w") as f:
+                json.dump(self.info(), f)
+        except OSError as e:
+            logger.debug("Could not write endpoint cache %s: %s", self.cache_path, e)
@@ -0,0 +1,339 @@
+"""Indexed peer store persisted as a JSON snapshot plus an append-only journal."""
+import contextlib
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# listener(user_id, old_peer, new_peer); either side is None for inserts/removals
+Listener = Callable[[str, Optional[Dict], Optional[Dict]], None]
+
+
+def _fsync_dir(path: Path):
+    """Flush a directory entry so a rename survives a crash"""
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def write_atomic(path: Path, data: bytes, mode: int = 0o600):
+    """Replace `path` with `data` via an fsync'd temporary file and rename.
+
+    The file is created with `mode`; the default keeps the client private keys
+    in peer records and configs readable by the owner only.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    fd = os.open(str(tmp_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    os.fchmod(fd, mode)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_dir(path.parent)
+
+
+class PeerStore:
+    """Peer records keyed by user_id with secondary indexes on public key and IP.
+
+    The snapshot file keeps the historical `peers.json` layout
+    (`{user_id: peer}`). Every change is appended to a journal and fsync'd,
+    so a request costs O(1) I/O; once the journal reaches `compact_every`
+    entries it is folded into a new snapshot written atomically. Loading
+    reads the snapshot and replays the journal on top of it.
+
+    With `lock_path` set the store is safe to share between processes:
+    every mutation (and every `transaction()`) holds an exclusive flock on
+    that file and first replays whatever other processes appended to the
+    journal since this one last looked. Subscribed listeners see every
+    change, local or replayed.
+    """
+
+    def __init__(self, snapshot_path, journal_path=None, compact_every: int = 1000,
+                 fsync: bool = True, lock_path=None):
+        self.snapshot_path = Path(snapshot_path)
+        self.journal_path = Path(journal_path) if journal_path else \
+            self.snapshot_path.with_suffix(".journal")
+        self.lock_path = Path(lock_path) if lock_path and fcntl is not None else None
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        self._peers: Dict[str, Dict] = {}
+        self._by_public_key: Dict[str, str] = {}
+        self._by_ip: Dict[str, str] = {}
+        self._listeners: List[Listener] = []
+        self._lock = threading.RLock()
+        self._journal = None
+        self._journal_entries = 0
+        self._journal_offset = 0
+        self._lock_file = None
+        self._lock_depth = 0
+
+    def subscribe(self, listener: Listener):
+        """Call `listener(user_id, old, new)` for every change to the store"""
+        with self._lock:
+            self._listeners.append(listener)
+
+    def _notify(self, user_id: str, old: Optional[Dict], new: Optional[Dict]):
+        for listener in self._listeners:
+            listener(user_id, old, new)
+
+    # Loading and persistence
+
+    def load(self):
+        """Load the snapshot, replay the journal and open it for appending"""
+        with self.transaction(sync=False):
+            self._load_locked()
+        return self
+
+    def _load_locked(self):
+        previous = dict(self._peers)
+        self._peers.clear()
+        self._by_public_key.clear()
+        self._by_ip.clear()
+
+        # Open the journal first so a concurrent compaction shows up as a new inode
+        self._open_journal()
+        if self.snapshot_path.exists():
+            with open(self.snapshot_path, "r") as f:
+                for user_id, peer in (json.load(f) or {}).items():
+                    self._index(user_id, peer)
+
+        self._journal_offset = 0
+        self._journal_entries = self._replay(notify=False)
+
+        # A reload has no ordering, so report every removal before any addition:
+        # an address freed by one peer may already belong to another
+        changed = [user_id for user_id in previous.keys() | self._peers.keys()
+                   if previous.get(user_id) != self._peers.get(user_id)]
+        for user_id in changed:
+            if user_id in previous:
+                self._notify(user_id, previous[user_id], None)
+        for user_id in changed:
+            if user_id in self._peers:
+                self._notify(user_id, None, self._peers[user_id])
+
+    def _replay(self, notify: bool) -> int:
+        """Apply journal entries from the current offset onwards"""
+        applied = 0
+        good_offset = self._journal_offset
+        with open(self.journal_path, "rb") as f:
+            f.seek(good_offset)
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("unterminated entry")
+                    entry = json.loads(line) if line.strip() else None
+                except ValueError:
+                    # A torn final write from a crash; everything before it is intact
+                    logger.warning("Discarding corrupt journal tail in %s at byte %d",
+                                   self.journal_path, good_offset)
+                    break
+                if entry is not None:
+                    self._apply(entry, notify)
+                    applied += 1
+                good_offset += len(line)
+        if good_offset != self.journal_path.stat().st_size:
+            # Drop the torn tail so new entries do not get appended onto it
+            os.truncate(self.journal_path, good_offset)
+        self._journal_offset = good_offset
+        return applied
+
+    def _apply(self, entry: Dict, notify: bool = False):
+        user_id = entry["user_id"]
+        old = self._peers.get(user_id)
+        if entry["op"] == "put":
+            self._index(user_id, entry["peer"])
+        elif entry["op"] == "del":
+            self._unindex(user_id)
+        if notify and old != self._peers.get(user_id):
+            self._notify(user_id, old, self._peers.get(user_id))
+
+    def _sync(self):
+        """Catch up with changes other processes made (called under the file lock)"""
+        if self._journal_replaced():
+            self._load_locked()
+        else:
+            self._journal_entries += self._replay(notify=True)
+
+    def _journal_replaced(self) -> bool:
+        # Compaction swaps in a new journal file. Our open handle pins the old
+        # inode, so it cannot be reused and a different inode means a new snapshot.
+        if self._journal is None:
+            return True
+        try:
+            current = os.stat(self.journal_path)
+        except FileNotFoundError:
+            return True
+        return current.st_ino != os.fstat(self._journal.fileno()).st_ino
+
+    def _open_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+        # Owner-only, like the snapshot: records carry client private keys
+        fd = os.open(str(self.journal_path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        os.fchmod(fd, 0o600)
+        self._journal = os.fdopen(fd, "a")
+
+    def _append(self, *entries: Dict):
+        if self._journal is None:
+            self._open_journal()
+        self._journal.write("".join(json.dumps(entry, separators=(",", ":")) + "\n"
+                                    for entry in entries))
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._journal_entries += len(entries)
+        self._journal_offset = os.fstat(self._journal.fileno()).st_size
+
+    def _maybe_compact(self):
+        if self.compact_every and self._journal_entries >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Write a fresh snapshot and truncate the journal"""
+        with self.transaction():
+            data = json.dumps(self._peers).encode()
+            write_atomic(self.snapshot_path, data)
+            # Replaying a stale journal over the new snapshot is harmless, so a
+            # crash between the two renames loses nothing
+            write_atomic(self.journal_path, b"")
+            self._open_journal()
+            self._journal_entries = 0
+            self._journal_offset = 0
+
+    def close(self):
+        """Compact and close the journal"""
+        with self._lock:
+            if self._journal is None:
+                return
+            self.compact()
+            self._journal.close()
+            self._journal = None
+
+    # Cross-process locking
+
+    @contextlib.contextmanager
+    def transaction(self, sync: bool = True):
+        """Hold the store exclusively (across processes when `lock_path` is set).
+
+        On entry the in-memory state is brought up to date with the journal,
+        so reads and allocations made inside the block see every committed
+        change from every process.
+        """
+        with self._lock:
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and self.lock_path is not None:
+                    self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+                    self._lock_file = open(self.lock_path, "a")
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+                    if sync:
+                        self._sync()
+                yield self
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0 and self._lock_file is not None:
+                    fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+                    self._lock_file.close()
+                    self._lock_file = None
+
+    def refresh(self):
+        """Pick up changes committed by other processes"""
+        with self.transaction():
+            pass
+
+    # Indexes
+
+    def _index(self, user_id: str, peer: Dict):
+        self._unindex(user_id)
+        self._peers[user_id] = peer
+        if peer.get("public_key"):
+            self._by_public_key[peer["public_key"]] = user_id
+        if peer.get("ip"):
+            self._by_ip[peer["ip"]] = user_id
+
+    def _unindex(self, user_id: str) -> Optional[Dict]:
+        peer = self._peers.pop(user_id, None)
+        if peer is not None:
+            if self._by_public_key.get(peer.get("public_key")) == user_id:
+                del self._by_public_key[peer["public_key"]]
+            if self._by_ip.get(peer.get("ip")) == user_id:
+                del self._by_ip[peer["ip"]]
+        return peer
+
+    # Public API
+
+    def put(self, user_id: str, peer: Dict):
+        """Insert or replace the peer for `user_id`"""
+        self.put_many([(user_id, peer)])
+
+    def put_many(self, items: Iterable[Tuple[str, Dict]]):
+        """Insert or replace several peers with a single journal write and fsync"""
+        items = list(items)
+        if not items:
+            return
+        with self.transaction():
+            self._append(*({"op": "put", "user_id": user_id, "peer": peer}
+                           for user_id, peer in items))
+            for user_id, peer in items:
+                old = self._peers.get(user_id)
+                self._index(user_id, peer)
+                self._notify(user_id, old, peer)
+            self._maybe_compact()
+
+    def remove(self, user_id: str) -> Optional[Dict]:
+        """Remove and return the peer for `user_id`, if any"""
+        with self.transaction():
+            if user_id not in self._peers:
+                return None
+            self._append({"op": "del", "user_id": user_id})
+            peer = self._unindex(user_id)
+            self._notify(user_id, peer, None)
+            self._maybe_compact()
+            return peer
+
+    def get(self, user_id: str) -> Optional[Dict]:
+        with self._lock:
+            return self._peers.get(user_id)
+
+    def get_by_public_key(self, public_key: str) -> Optional[Tuple[str, Dict]]:
+        with self._lock:
+            user_id = self._by_public_key.get(public_key)
+            return (user_id, self._peers[user_id]) if user_id is not None else None
+
+    def get_by_ip(self, ip: str) -> Optional[Tuple[str, Dict]]:
+        with self._lock:
+            user_id = self._by_ip.get(ip)
+            return (user_id, self._peers[user_id]) if user_id is not None else None
+
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        """Iterate over a point-in-time copy of (user_id, peer) pairs"""
+        with self._lock:
+            return iter(list(self._peers.items()))
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return user_id in self._peers
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._peers)
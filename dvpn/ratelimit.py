@@ -0,0 +1,294 @@
+"""Token-bucket rate limiting and a concurrency cap for expensive endpoints."""
+import contextlib
+import functools
+import ipaddress
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional
+
+
+class RateLimited(Exception):
+    """Raised when a request is refused; `retry_after` is in seconds"""
+
+    def __init__(self, retry_after: float, reason: str = "rate"):
+        super().__init__(f"Too many requests ({reason}), retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+        self.reason = reason
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class MemoryRateLimiter:
+    """Token buckets of `burst` tokens refilled at `rate` per second, one per key.
+
+    Only the `max_keys` most recently used keys are kept; a key that falls
+    out simply starts again with a full bucket.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, cost: float = 1) -> float:
+        """Take `cost` tokens; returns 0 if allowed, else seconds until it would be"""
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key: str, cost: float = 1):
+        """Give back tokens taken by `acquire` for a request that was refused after all"""
+        now = self.clock()
+        with self._lock:
+            entry = self._buckets.get(key)
+            if entry is None:
+                return
+            tokens, updated = entry
+            self._buckets[key] = (min(self.burst, tokens + (now - updated) * self.rate + cost), now)
+
+
+class SQLiteRateLimiter:
+    """The same buckets in a SQLite file, shared by every worker process on a host.
+
+    Each acquire is one short IMMEDIATE transaction; buckets that have had
+    time to refill completely are pruned now and then.
+    """
+
+    def __init__(self, path, rate: float, burst: float, table: str = "buckets",
+                 prune_every: int = 1000, clock: Callable[[], float] = time.time):
+        self.path = str(path)
+        self.table = table
+        self.rate = rate
+        self.burst = burst
+        self.prune_every = prune_every
+        self.clock = clock
+        self._local = threading.local()
+        self._calls = 0
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                         "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def acquire(self, key: str, cost: float = 1) -> float:
+        """Take `cost` tokens; returns 0 if allowed, else seconds until it would be"""
+        conn = self._conn
+        now = self.clock()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(f"SELECT tokens, updated FROM {self.table} WHERE key = ?",
+                               (key,)).fetchone()
+            tokens, updated = row if row is not None else (self.burst, now)
+            tokens = min(self.burst, tokens + max(now - updated, 0) * self.rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.rate
+            conn.execute(f"INSERT OR REPLACE INTO {self.table} (key, tokens, updated) "
+                         "VALUES (?, ?, ?)", (key, tokens, now))
+            self._calls += 1
+            if self.prune_every and self._calls % self.prune_every == 0:
+                conn.execute(f"DELETE FROM {self.table} WHERE updated < ?",
+                             (now - self.burst / self.rate,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def refund(self, key: str, cost: float = 1):
+        """Give back tokens taken by `acquire` for a request that was refused after all"""
+        now = self.clock()
+        # A single statement, so atomic without an explicit transaction
+        self._conn.execute(
+            f"UPDATE {self.table} SET tokens = MIN(?, tokens + MAX(? - updated, 0) * ? + ?), "
+            "updated = ? WHERE key = ?", (self.burst, now, self.rate, cost, now, key))
+
+
+class Admission:
+    """Rate limits per user and per client address in front of a cap on requests in flight.
+
+    `limiters` maps a kind of key ("user", "ip") to its limiter; kinds
+    without one are not limited, and addresses in `trusted_ips` (addresses
+    or CIDRs, e.g. a backend that proxies many users) skip the "ip" bucket.
+    Rate limits are checked first, so a client that is flooding is turned
+    away without taking a slot; a refused request is not charged to any
+    bucket. A `cost` above a bucket's burst takes the whole burst. When all
+    `max_in_flight` slots are busy the request is refused at once rather
+    than queued, which keeps latency bounded for the requests that are
+    admitted. The cap is per process.
+    """
+
+    def __init__(self, limiters: Optional[Dict[str, object]] = None, max_in_flight: int = 0,
+                 busy_retry_after: float = 1, trusted_ips: Iterable[str] = ()):
+        self.limiters = limiters or {}
+        self.max_in_flight = max_in_flight
+        self.busy_retry_after = busy_retry_after
+        self.trusted_ips = [ipaddress.ip_network(n.strip(), strict=False)
+                            for n in trusted_ips if n.strip()]
+        self.in_flight = 0
+        self.rejected = {"rate": 0, "busy": 0}
+        self._lock = threading.Lock()
+
+    def is_trusted(self, ip: Optional[str]) -> bool:
+        if not ip or not self.trusted_ips:
+            return False
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_ips)
+
+    def _charge(self, cost: float, keys: Dict[str, Optional[str]]) -> list:
+        """Take `cost` from every applicable bucket, or refund them all and raise RateLimited"""
+        taken = []
+        for kind, key in keys.items():
+            limiter = self.limiters.get(kind)
+            if limiter is None or not key or (kind == "ip" and self.is_trusted(key)):
+                continue
+            bucket, charge = f"{kind}:{key}", min(cost, limiter.burst)
+            wait = limiter.acquire(bucket, charge)
+            if wait > 0:
+                self._refund(taken)
+                with self._lock:
+                    self.rejected["rate"] += 1
+                raise RateLimited(wait, "rate")
+            taken.append((limiter, bucket, charge))
+        return taken
+
+    @staticmethod
+    def _refund(taken: list):
+        for limiter, bucket, charge in taken:
+            limiter.refund(bucket, charge)
+
+    def limit(self, cost: float = 1, **keys: Optional[str]):
+        """Apply the rate limits alone, without a slot (e.g. a user key only known once
+        the request has been authenticated); raises RateLimited"""
+        self._charge(cost, keys)
+
+    def acquire(self, cost: float = 1, **keys: Optional[str]):
+        """Take a slot, or raise RateLimited; every successful call needs a `release()`"""
+        taken = self._charge(cost, keys)
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.rejected["busy"] += 1
+                busy = True
+            else:
+                self.in_flight += 1
+                busy = False
+        if busy:
+            self._refund(taken)
+            raise RateLimited(self.busy_retry_after, "busy")
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    @contextlib.contextmanager
+    def admit(self, cost: float = 1, **keys: Optional[str]):
+        """Hold a slot for the duration of the block, or raise RateLimited"""
+        self.acquire(cost, **keys)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"in_flight": self.in_flight, "max_in_flight": self.max_in_flight,
+                    "rejected": dict(self.rejected)}
+
+
+def _limiter(kind: str, per_minute: float, burst: float, db: Optional[str]):
+    if per_minute <= 0:
+        return None
+    if db:
+        return SQLiteRateLimiter(db, per_minute / 60, burst, table=f"{kind}_buckets")
+    return MemoryRateLimiter(per_minute / 60, burst)
+
+
+def admission_from_env() -> Admission:
+    """Admission for peer creation, configured from the environment:
+
+    RATE_LIMIT_PER_MINUTE / RATE_LIMIT_BURST per user or address,
+    RATE_LIMIT_IP_PER_MINUTE / RATE_LIMIT_IP_BURST per client address,
+    RATE_LIMIT_TRUSTED_IPS for addresses exempt from the per-address limit,
+    RATE_LIMIT_DB to share the buckets between workers through SQLite and
+    MAX_CONCURRENT_PEER_REQUESTS for the cap (0 disables any of them).
+    """
+    db = os.getenv("RATE_LIMIT_DB")
+    limiters = {
+        "user": _limiter("user", float(os.getenv("RATE_LIMIT_PER_MINUTE", "6")),
+                         float(os.getenv("RATE_LIMIT_BURST", "3")), db),
+        # Looser, since many users can share an address (NAT, a proxy)
+        "ip": _limiter("ip", float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "60")),
+                       float(os.getenv("RATE_LIMIT_IP_BURST", "20")), db),
+    }
+    return Admission({kind: limiter for kind, limiter in limiters.items() if limiter is not None},
+                     int(os.getenv("MAX_CONCURRENT_PEER_REQUESTS", "32")),
+                     trusted_ips=os.getenv("RATE_LIMIT_TRUSTED_IPS", "").split(","))
+
+
+def flask_rate_limited(error: RateLimited):
+    """The 429 response, with Retry-After, for a refused Flask request"""
+    from flask import jsonify
+
+    response = jsonify({"error": str(error)})
+    response.headers["Retry-After"] = error.retry_after_header
+    return response, 429
+
+
+def flask_admitted(admission: Admission, user_key: Callable[[], Optional[str]] = lambda: None):
+    """Decorator for Flask views: admit by `user_key()` and client address, else 429.
+
+    Only use `user_key` for an authenticated identity; otherwise anyone can drain
+    another user's bucket. Apply `admission.limit(user=...)` once it is verified.
+    """
+    from flask import request
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                admission.acquire(user=user_key(), ip=request.remote_addr)
+            except RateLimited as e:
+                return flask_rate_limited(e)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.release()
+        return wrapper
+    return decorator
@@ -0,0 +1,174 @@
+"""Removal of expired and idle peers, scheduled on a timer wheel."""
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from .timer_wheel import TimerWheel
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# (user_id, peer, reason) where reason is "expired" or "idle"
+Reaped = Tuple[str, Dict, str]
+
+
+def leader_lock(path):
+    """Take a non-blocking exclusive lock so only one worker process runs a job.
+
+    Returns the open lock file (keep a reference for as long as the job runs),
+    or None when another process already holds it.
+    """
+    if fcntl is None:
+        return open(path, "a")
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(path, "a")
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+class PeerReaper:
+    """Finds peers whose subscription expired or who have been idle too long.
+
+    Every peer gets an expiry timer (from its stored `expires_at`) and, when
+    `idle_timeout` is set, an idle timer on a TimerWheel kept in step with
+    the store through its change notifications. `collect()` only looks at
+    timers that fell due:
+
+    - an expired peer is re-checked with `refresh_expiry` (renewals emit no
+      event) and its record updated if the subscription was extended;
+    - an idle timer compares against `last_handshake(public_key)`, which
+      returns the handshake time, 0 for never, or None when unknown (no
+      telemetry yet), in which case the check is simply postponed.
+
+    The caller removes what `collect()` returns in one batch.
+    """
+
+    def __init__(self, store, idle_timeout: float = 0,
+                 last_handshake: Optional[Callable[[str], Optional[float]]] = None,
+                 refresh_expiry: Optional[Callable[[List[str]], Dict[str, Optional[float]]]] = None,
+                 tick: float = 5, slots: int = 4096, retry_after: float = 300,
+                 clock: Callable[[], float] = time.time):
+        self.store = store
+        self.idle_timeout = idle_timeout
+        self.last_handshake = last_handshake
+        self.refresh_expiry = refresh_expiry
+        self.retry_after = retry_after
+        self.clock = clock
+        self.wheel = TimerWheel(tick, slots, clock())
+        # Guards the wheel only; never held while calling into the store, whose
+        # listeners (running under the store lock) take it too
+        self._lock = threading.Lock()
+        self.reaped = {"expired": 0, "idle": 0}
+        store.subscribe(self._on_change)
+        for user_id, peer in store.items():
+            self._schedule(user_id, peer)
+
+    def _on_change(self, user_id: str, old: Optional[Dict], new: Optional[Dict]):
+        if new is None:
+            with self._lock:
+                self.wheel.cancel((user_id, "expiry"))
+                self.wheel.cancel((user_id, "idle"))
+        else:
+            self._schedule(user_id, new, old)
+
+    def _schedule(self, user_id: str, peer: Dict, old: Optional[Dict] = None):
+        expires_at = peer.get("expires_at")
+        with self._lock:
+            if expires_at:
+                self.wheel.schedule((user_id, "expiry"), expires_at)
+            else:
+                self.wheel.cancel((user_id, "expiry"))
+            # A changed record (e.g. only a new expiry) keeps its running idle timer
+            if self.idle_timeout and (old is None or self.wheel.deadline((user_id, "idle")) is None):
+                self.wheel.schedule((user_id, "idle"), self.clock() + self.idle_timeout)
+
+    def _reschedule(self, key, deadline: float):
+        with self._lock:
+            self.wheel.schedule(key, deadline)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self.wheel)
+
+    def collect(self, now: Optional[float] = None) -> List[Reaped]:
+        """Advance the wheel and return the peers that should be removed"""
+        now = self.clock() if now is None else now
+        expired, reaped = [], []
+        with self._lock:
+            due = self.wheel.advance(now)
+        for user_id, kind in due:
+            peer = self.store.get(user_id)
+            if peer is None:
+                continue
+            if kind == "expiry":
+                if peer.get("expires_at") and peer["expires_at"] <= now:
+                    expired.append((user_id, peer))
+                continue
+            if self._idle(user_id, peer, now):
+                reaped.append((user_id, peer, "idle"))
+
+        reaped.extend(self._confirm_expired(expired, now))
+        # A peer can be both expired and idle; report it once
+        unique = {user_id: (user_id, peer, reason) for user_id, peer, reason in reaped}
+        for _, _, reason in unique.values():
+            self.reaped[reason] += 1
+        return list(unique.values())
+
+    def _idle(self, user_id: str, peer: Dict, now: float) -> bool:
+        handshake = self.last_handshake(peer.get("public_key")) if self.last_handshake else None
+        if handshake is None:
+            self._reschedule((user_id, "idle"), now + self.idle_timeout)
+            return False
+        if handshake and now - handshake < self.idle_timeout:
+            self._reschedule((user_id, "idle"), handshake + self.idle_timeout)
+            return False
+        return True
+
+    def _confirm_expired(self, expired: List[Tuple[str, Dict]], now: float) -> Iterable[Reaped]:
+        if not expired:
+            return []
+        if self.refresh_expiry is None:
+            return [(user_id, peer, "expired") for user_id, peer in expired]
+        try:
+            fresh = self.refresh_expiry([user_id for user_id, _ in expired])
+        except Exception as e:
+            logger.warning("Expiry refresh failed, retrying later: %s", e)
+            fresh = {}
+
+        confirmed, renewed = [], []
+        for user_id, peer in expired:
+            expires_at = fresh.get(user_id)
+            if expires_at is None:
+                # Unknown: keep the peer and look again later
+                self._reschedule((user_id, "expiry"), now + self.retry_after)
+            elif expires_at > now:
+                renewed.append((user_id, dict(peer, expires_at=expires_at)))
+            else:
+                confirmed.append((user_id, peer, "expired"))
+        if renewed:
+            # Storing the new expiry reschedules the timers via _on_change
+            self.store.put_many(renewed)
+        return confirmed
+
+    def defer(self, user_ids: Iterable[str], delay: Optional[float] = None):
+        """Re-arm the timers of peers whose removal failed"""
+        deadline = self.clock() + (self.retry_after if delay is None else delay)
+        with self._lock:
+            for user_id in user_ids:
+                self.wheel.schedule((user_id, "expiry"), deadline)
+                if self.idle_timeout:
+                    self.wheel.schedule((user_id, "idle"), deadline)
+
+    def stats(self) -> Dict:
+        return {"scheduled": len(self), "idle_timeout": self.idle_timeout,
+                "reaped": dict(self.reaped)}
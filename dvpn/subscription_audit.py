@@ -0,0 +1,137 @@
+"""Bulk subscription checks and revocation of peers whose subscription lapsed."""
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+
+from .abi import MULTICALL3_ABI, MULTICALL3_ADDRESS, SUBSCRIPTION_ABI
+
+try:
+    from web3 import Web3
+    from web3.exceptions import ContractLogicError
+except ImportError:  # pragma: no cover - web3 is required by every caller
+    Web3 = None
+    ContractLogicError = Exception
+
+logger = logging.getLogger(__name__)
+
+ETH_ADDRESS_RE = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+
+def is_eth_address(value: str) -> bool:
+    return bool(ETH_ADDRESS_RE.match(value or ""))
+
+
+def check_subscriptions(w3, contract_address: str, addresses: Iterable[str],
+                        batch_size: int = 500, max_workers: int = 4,
+                        multicall_address: Optional[str] = MULTICALL3_ADDRESS
+                        ) -> Dict[str, Optional[bool]]:
+    """Check `hasActiveSubscription` for many addresses.
+
+    Addresses are split into batches of `batch_size`. When a Multicall3
+    contract is deployed at `multicall_address` each batch is a single
+    `aggregate3` eth_call; otherwise (e.g. a bare Hardhat/anvil chain) the
+    batch falls back to one call per address. At most `max_workers`
+    batches are in flight at once. The result maps each address to
+    True/False, or None when its call failed.
+    """
+    words = _call_many(w3, contract_address, addresses, "hasActiveSubscription", None,
+                       batch_size, max_workers, multicall_address)
+    return {address: None if word is None else word != 0 for address, word in words.items()}
+
+
+def fetch_expiries(w3, contract_address: str, addresses: Iterable[str],
+                   batch_size: int = 500, max_workers: int = 4,
+                   multicall_address: Optional[str] = MULTICALL3_ADDRESS,
+                   clock: Callable[[], float] = time.time) -> Dict[str, Optional[float]]:
+    """Subscription expiry timestamps from `getRemainingTime`, batched like
+    `check_subscriptions`. 0 means no active subscription, None a failed call."""
+    # getRemainingTime reverts for addresses that never subscribed
+    words = _call_many(w3, contract_address, addresses, "getRemainingTime", 0,
+                       batch_size, max_workers, multicall_address)
+    now = clock()
+    return {address: None if word is None else (now + word if word > 0 else 0)
+            for address, word in words.items()}
+
+
+def _call_many(w3, contract_address, addresses, fn_name, reverted, batch_size,
+               max_workers, multicall_address) -> Dict[str, Optional[int]]:
+    """Call a one-argument view of the subscription contract for many addresses,
+    returning each result as an integer (`reverted` for reverts, None on failure)"""
+    contract = w3.eth.contract(address=Web3.to_checksum_address(contract_address),
+                               abi=SUBSCRIPTION_ABI)
+    addresses = list(dict.fromkeys(addresses))
+    batches = [addresses[i:i + batch_size] for i in range(0, len(addresses), batch_size)]
+    if not batches:
+        return {}
+
+    multicall = None
+    if multicall_address:
+        multicall_address = Web3.to_checksum_address(multicall_address)
+        if w3.eth.get_code(multicall_address):
+            multicall = w3.eth.contract(address=multicall_address, abi=MULTICALL3_ABI)
+        else:
+            logger.info("No Multicall3 at %s, checking addresses individually", multicall_address)
+
+    def run(batch: List[str]) -> Dict[str, Optional[int]]:
+        if multicall is not None:
+            return _multicall_batch(multicall, contract, batch, fn_name, reverted)
+        return _single_call_batch(contract, batch, fn_name, reverted)
+
+    results: Dict[str, Optional[int]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for batch_result in pool.map(run, batches):
+            results.update(batch_result)
+    return results
+
+
+def _multicall_batch(multicall, contract, batch: List[str], fn_name: str,
+                     reverted: Optional[int]) -> Dict[str, Optional[int]]:
+    calls = [
+        (contract.address, True,
+         contract.encodeABI(fn_name=fn_name, args=[Web3.to_checksum_address(address)]))
+        for address in batch
+    ]
+    try:
+        returned = multicall.functions.aggregate3(calls).call()
+    except Exception as e:
+        logger.warning("Multicall batch of %d failed: %s", len(batch), e)
+        return {address: None for address in batch}
+
+    results = {}
+    for address, (success, data) in zip(batch, returned):
+        # bools and uint256 are both ABI-encoded as one 32-byte word
+        if not success:
+            results[address] = reverted
+        else:
+            results[address] = int.from_bytes(data[-32:], "big") if len(data) >= 32 else None
+    return results
+
+
+def _single_call_batch(contract, batch: List[str], fn_name: str,
+                       reverted: Optional[int]) -> Dict[str, Optional[int]]:
+    results = {}
+    for address in batch:
+        try:
+            results[address] = int(getattr(contract.functions, fn_name)(
+                Web3.to_checksum_address(address)
+            ).call())
+        except ContractLogicError:
+            results[address] = reverted
+        except Exception as e:
+            logger.warning("%s for %s failed: %s", fn_name, address, e)
+            results[address] = None
+    return results
+
+
+def find_lapsed_peers(peers: Iterable, check: Callable[[List[str]], Dict[str, Optional[bool]]]
+                      ) -> List[str]:
+    """User ids from (user_id, peer) pairs whose subscription is definitely inactive.
+
+    Peers whose user_id is not an Ethereum address, and addresses whose
+    check failed, are left alone.
+    """
+    user_ids = [user_id for user_id, _ in peers if is_eth_address(user_id)]
+    results = check(user_ids)
+    return [user_id for user_id in user_ids if results.get(user_id) is False]
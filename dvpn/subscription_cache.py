@@ -0,0 +1,157 @@
+"""Per-address subscription cache invalidated by on-chain Transfer events."""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from .abi import SUBSCRIPTION_ABI, TRANSFER_TOPIC
+
+try:
+    from web3 import Web3
+    from web3.exceptions import ContractLogicError
+except ImportError:  # pragma: no cover - web3 is required by every caller
+    Web3 = None
+    ContractLogicError = Exception
+
+logger = logging.getLogger(__name__)
+
+
+class SubscriptionCache:
+    """Answers "is this address subscribed?" locally until the subscription expires.
+
+    A miss reads `getRemainingTime` once and keeps the absolute expiry, so
+    active subscribers are answered from memory until it passes (capped at
+    `max_ttl`). Addresses without a subscription are cached for only
+    `negative_ttl` seconds. `start()` runs a log follower that drops the
+    entries of both sides of every Transfer event (subscribe mints,
+    cancel burns, transfers move the NFT). `renewSubscription` emits no
+    event, but it can only push the expiry later, so a cached positive
+    entry stays correct and is simply re-read when it lapses.
+    """
+
+    def __init__(self, w3, contract_address: str, negative_ttl: float = 60,
+                 max_ttl: float = 6 * 3600, poll_interval: float = 15,
+                 max_block_range: int = 2000, clock: Callable[[], float] = time.time):
+        self.w3 = w3
+        self.contract = w3.eth.contract(
+            address=Web3.to_checksum_address(contract_address),
+            abi=SUBSCRIPTION_ABI
+        )
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.poll_interval = poll_interval
+        self.max_block_range = max_block_range
+        self._clock = clock
+
+        # address -> (active, valid_until)
+        self._entries: Dict[str, Tuple[bool, float]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._next_block: Optional[int] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def is_active(self, address: str) -> bool:
+        """Whether `address` currently holds an active subscription"""
+        key = address.lower()
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry[1]:
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        remaining = self._remaining_time(address)
+        now = self._clock()
+        if remaining > 0:
+            entry = (True, now + min(remaining, self.max_ttl))
+        else:
+            entry = (False, now + self.negative_ttl)
+        with self._lock:
+            self._entries[key] = entry
+        return entry[0]
+
+    def expiry(self, address: str) -> Optional[float]:
+        """Cached expiry timestamp for an active subscription, if known"""
+        with self._lock:
+            entry = self._entries.get(address.lower())
+        return entry[1] if entry and entry[0] else None
+
+    def _remaining_time(self, address: str) -> int:
+        try:
+            return self.contract.functions.getRemainingTime(
+                Web3.to_checksum_address(address)
+            ).call()
+        except ContractLogicError:
+            # getRemainingTime reverts with "No subscription found"
+            return 0
+
+    def invalidate(self, address: str):
+        with self._lock:
+            if self._entries.pop(address.lower(), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "next_block": self._next_block,
+            }
+
+    # Log follower
+
+    def start(self):
+        """Follow Transfer events in a background thread"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="subscription-logs", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll_logs()
+            except Exception as e:
+                logger.warning("Subscription log poll failed: %s", e)
+            self._stopped.wait(self.poll_interval)
+
+    def poll_logs(self):
+        """Invalidate entries touched by Transfer events since the last poll"""
+        latest = self.w3.eth.block_number
+        if self._next_block is None:
+            # Nothing is cached from before we started following
+            self._next_block = latest + 1
+            return
+        while self._next_block <= latest:
+            to_block = min(self._next_block + self.max_block_range - 1, latest)
+            logs = self.w3.eth.get_logs({
+                "address": self.contract.address,
+                "topics": [TRANSFER_TOPIC],
+                "fromBlock": self._next_block,
+                "toBlock": to_block,
+            })
+            for log in logs:
+                for topic in log["topics"][1:3]:
+                    # Indexed addresses are left-padded to 32 bytes
+                    self.invalidate("0x" + bytes(topic)[-20:].hex())
+            self._next_block = to_block + 1
@@ -0,0 +1,202 @@
+"""Per-peer traffic telemetry sampled from the WireGuard interface."""
+import logging
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# A peer whose last handshake is older than this is reported as disconnected
+# (WireGuard re-handshakes every 2 minutes while traffic flows)
+CONNECTED_WINDOW = 180
+
+
+class PeerTable:
+    """Columnar snapshot of an interface's peers.
+
+    One list/array per field instead of one dict per peer keeps a snapshot of
+    tens of thousands of peers compact, and rows are found through a single
+    public key -> row index.
+    """
+
+    def __init__(self, timestamp: float):
+        self.timestamp = timestamp
+        self.public_keys: List[str] = []
+        self.endpoints: List[Optional[str]] = []
+        self.latest_handshake = array("q")
+        self.rx_bytes = array("q")
+        self.tx_bytes = array("q")
+        self.rx_rate = array("d")
+        self.tx_rate = array("d")
+        self.index: Dict[str, int] = {}
+
+    def _append(self, public_key, endpoint, latest_handshake, rx_bytes, tx_bytes):
+        self.index[public_key] = len(self.public_keys)
+        self.public_keys.append(public_key)
+        self.endpoints.append(endpoint)
+        self.latest_handshake.append(latest_handshake)
+        self.rx_bytes.append(rx_bytes)
+        self.tx_bytes.append(tx_bytes)
+
+    @classmethod
+    def from_dump(cls, output: str, timestamp: float) -> "PeerTable":
+        """Parse `wg show <interface> dump` straight into columns"""
+        table = cls(timestamp)
+        keys, endpoints, handshakes, rx, tx = [], [], [], [], []
+        # The first line describes the interface itself
+        for line in output.split("\n")[1:]:
+            fields = line.split("\t")
+            if len(fields) < 8:
+                continue
+            keys.append(fields[0])
+            endpoints.append(None if fields[2] == "(none)" else fields[2])
+            handshakes.append(fields[4])
+            rx.append(fields[5])
+            tx.append(fields[6])
+        table.public_keys, table.endpoints = keys, endpoints
+        table.latest_handshake = array("q", map(int, handshakes))
+        table.rx_bytes = array("q", map(int, rx))
+        table.tx_bytes = array("q", map(int, tx))
+        table.index = {key: i for i, key in enumerate(keys)}
+        return table
+
+    @classmethod
+    def from_peers(cls, peers: Iterable[Dict], timestamp: float) -> "PeerTable":
+        """Build a table from backend `list_peers()` dicts"""
+        table = cls(timestamp)
+        for peer in peers:
+            table._append(peer["public_key"], peer.get("endpoint"), peer["latest_handshake"],
+                          peer["rx_bytes"], peer["tx_bytes"])
+        return table
+
+    def compute_rates(self, previous: Optional["PeerTable"]):
+        """Bytes per second since `previous`; counters that went backwards count as reset"""
+        count = len(self.public_keys)
+        rx_rate, tx_rate = array("d", bytes(8 * count)), array("d", bytes(8 * count))
+        elapsed = self.timestamp - previous.timestamp if previous is not None else 0
+        if elapsed > 0:
+            index, prev_rx, prev_tx = previous.index, previous.rx_bytes, previous.tx_bytes
+            rx, tx = self.rx_bytes, self.tx_bytes
+            for i, public_key in enumerate(self.public_keys):
+                j = index.get(public_key)
+                if j is not None:
+                    rx_rate[i] = max(rx[i] - prev_rx[j], 0) / elapsed
+                    tx_rate[i] = max(tx[i] - prev_tx[j], 0) / elapsed
+        self.rx_rate, self.tx_rate = rx_rate, tx_rate
+
+    def __len__(self) -> int:
+        return len(self.public_keys)
+
+    def row(self, i: int) -> Dict:
+        handshake = self.latest_handshake[i]
+        age = self.timestamp - handshake if handshake else None
+        return {
+            "public_key": self.public_keys[i],
+            "endpoint": self.endpoints[i],
+            "latest_handshake": handshake,
+            "handshake_age": age,
+            "connected": age is not None and age < CONNECTED_WINDOW,
+            "rx_bytes": self.rx_bytes[i],
+            "tx_bytes": self.tx_bytes[i],
+            "rx_rate": self.rx_rate[i] if i < len(self.rx_rate) else 0.0,
+            "tx_rate": self.tx_rate[i] if i < len(self.tx_rate) else 0.0,
+        }
+
+    def get(self, public_key: str) -> Optional[Dict]:
+        i = self.index.get(public_key)
+        return self.row(i) if i is not None else None
+
+    def rows(self) -> Iterable[Dict]:
+        return (self.row(i) for i in range(len(self.public_keys)))
+
+    def summary(self) -> Dict:
+        connected = sum(1 for handshake in self.latest_handshake
+                        if handshake and self.timestamp - handshake < CONNECTED_WINDOW)
+        return {
+            "sampled_at": self.timestamp,
+            "peers": len(self.public_keys),
+            "connected": connected,
+            "rx_bytes": sum(self.rx_bytes),
+            "tx_bytes": sum(self.tx_bytes),
+            "rx_rate": sum(self.rx_rate),
+            "tx_rate": sum(self.tx_rate),
+        }
+
+
+class TelemetryCollector:
+    """Samples the interface every `interval` seconds into a PeerTable.
+
+    Requests read the latest snapshot, so serving peer status never runs
+    `wg` itself. Backends with a raw `dump()` are parsed directly into
+    columns; others go through `list_peers()`.
+    """
+
+    def __init__(self, backend, interval: float = 10, clock=time.time):
+        self.backend = backend
+        self.interval = interval
+        self.clock = clock
+        self._table: Optional[PeerTable] = None
+        self.last_poll_seconds = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def poll(self) -> PeerTable:
+        """Take a sample now and make it the current snapshot"""
+        started = time.perf_counter()
+        dump = getattr(self.backend, "dump", None)
+        if dump is not None:
+            table = PeerTable.from_dump(dump(), self.clock())
+        else:
+            table = PeerTable.from_peers(self.backend.list_peers(), self.clock())
+        table.compute_rates(self._table)
+        with self._lock:
+            self._table = table
+            self.last_poll_seconds = time.perf_counter() - started
+        return table
+
+    def snapshot(self) -> Optional[PeerTable]:
+        with self._lock:
+            return self._table
+
+    def peer_status(self, public_key: Optional[str]) -> Dict:
+        """Telemetry for a peer with a `status` of connected, idle, absent or unknown"""
+        table = self.snapshot()
+        row = table.get(public_key) if table is not None and public_key else None
+        if row is None:
+            # absent: sampled, but the interface has no such peer
+            return {"status": "unknown" if table is None or not public_key else "absent"}
+        row["status"] = "connected" if row["connected"] else "idle"
+        return row
+
+    def stats(self) -> Dict:
+        table = self.snapshot()
+        summary = table.summary() if table is not None else {"sampled_at": None, "peers": 0}
+        summary.update(interval=self.interval, poll_seconds=self.last_poll_seconds,
+                       errors=self.errors)
+        return summary
+
+    def start(self):
+        """Sample in the background every `interval` seconds"""
+        if self._thread is not None or not self.interval:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="peer-telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                self.errors += 1
+                logger.warning("Peer telemetry sample failed: %s", e)
+            self._stopped.wait(self.interval)
@@ -0,0 +1,59 @@
+"""Hashed timing wheel for scheduling many per-peer deadlines."""
+import math
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class TimerWheel:
+    """Deadlines hashed into `slots` buckets of `tick` seconds each.
+
+    Scheduling and cancelling are O(1); advancing the clock only visits the
+    buckets whose time has come, so a tick costs the handful of timers in
+    that bucket rather than a scan of every peer. Deadlines further out
+    than one revolution simply stay in their bucket for extra rounds.
+    Rescheduling a key supersedes its previous deadline.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 3600, start: float = 0.0):
+        self.tick = tick
+        self._slots: List[List[Tuple[int, Hashable, float]]] = [[] for _ in range(slots)]
+        self._deadlines: Dict[Hashable, float] = {}
+        # Index of the last tick whose bucket has been processed
+        self._current = int(start // tick)
+
+    def schedule(self, key: Hashable, deadline: float):
+        """Fire `key` at `deadline` (on the next tick if it is already past)"""
+        self._deadlines[key] = deadline
+        # Rounding up means a timer fires at most one tick late, never early
+        tick = max(math.ceil(deadline / self.tick), self._current + 1)
+        self._slots[tick % len(self._slots)].append((tick, key, deadline))
+
+    def cancel(self, key: Hashable):
+        self._deadlines.pop(key, None)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        return self._deadlines.get(key)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """Move the clock to `now` and return the keys that fell due"""
+        target = int(now // self.tick)
+        # After a long stall every bucket is due once; there is no point in lapping
+        steps = min(target - self._current, len(self._slots))
+        due = []
+        for step in range(1, steps + 1):
+            index = (self._current + step) % len(self._slots)
+            pending = []
+            for entry in self._slots[index]:
+                tick, key, deadline = entry
+                if self._deadlines.get(key) != deadline:
+                    continue  # cancelled or rescheduled
+                if tick > target:
+                    pending.append(entry)  # a later round
+                else:
+                    del self._deadlines[key]
+                    due.append(key)
+            self._slots[index] = pending
+        self._current = max(self._current, target)
+        return due
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
@@ -0,0 +1,381 @@
+"""WireGuard peer control: netlink, `wg` subprocess and in-memory backends."""
+import abc
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from pyroute2 import WireGuard as _NetlinkWireGuard
+    from pyroute2.netlink import NLM_F_ACK, NLM_F_REQUEST
+    from pyroute2.netlink.generic.wireguard import WG_CMD_SET_DEVICE, WG_GENL_VERSION, wgmsg
+except ImportError:
+    _NetlinkWireGuard = None
+
+logger = logging.getLogger(__name__)
+
+# (public_key, [allowed_ip, ...])
+PeerSpec = Tuple[str, Sequence[str]]
+
+
+class WireGuardError(Exception):
+    """Raised when the kernel (or `wg`) rejects a peer change"""
+
+
+def iter_dump(lines: Iterable[str]) -> Iterator[Dict]:
+    """Parse `wg show <interface> dump` one line at a time.
+
+    `lines` may be the `wg` process's stdout, so peers are yielded as the
+    dump arrives instead of after all of it has been read into memory.
+    """
+    lines = iter(lines)
+    # The first line describes the interface itself
+    next(lines, None)
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 8:
+            continue
+        allowed_ips = [] if fields[3] == "(none)" else fields[3].split(",")
+        yield {
+            "public_key": fields[0],
+            "endpoint": None if fields[2] == "(none)" else fields[2],
+            "allowed_ips": allowed_ips,
+            "latest_handshake": int(fields[4]),
+            "rx_bytes": int(fields[5]),
+            "tx_bytes": int(fields[6]),
+        }
+
+
+def iter_allowed_ips(lines: Iterable[str]) -> Iterator[Tuple[str, List[str]]]:
+    """(public_key, allowed_ips) for each peer line of a dump, as it is read.
+
+    Only the two fields needed are sliced out of each line; the rest of the
+    line is never split. Peers can have several allowed IPs, IPv4 or IPv6.
+    """
+    lines = iter(lines)
+    next(lines, None)
+    for line in lines:
+        key_end = line.find("\t")
+        psk_end = line.find("\t", key_end + 1)
+        endpoint_end = line.find("\t", psk_end + 1)
+        ips_end = line.find("\t", endpoint_end + 1)
+        if min(key_end, psk_end, endpoint_end, ips_end) < 0:
+            continue
+        field = line[endpoint_end + 1:ips_end]
+        yield line[:key_end], [] if field == "(none)" else field.split(",")
+
+
+def parse_dump(output: str) -> List[Dict]:
+    """Parse the peer lines of `wg show <interface> dump`"""
+    return list(iter_dump(output.splitlines()))
+
+
+class WireGuardBackend(abc.ABC):
+    """Applies peer changes to one WireGuard interface.
+
+    Subclasses implement the batch operations; a batch is applied in as
+    few kernel round trips as the backend allows.
+    """
+
+    name = "abstract"
+
+    def __init__(self, interface: str = "wg0"):
+        self.interface = interface
+
+    @abc.abstractmethod
+    def add_peers(self, peers: Iterable[PeerSpec]):
+        """Add peers, or replace the allowed IPs of existing ones"""
+
+    @abc.abstractmethod
+    def remove_peers(self, public_keys: Iterable[str]):
+        """Remove peers; unknown keys are ignored"""
+
+    @abc.abstractmethod
+    def list_peers(self) -> List[Dict]:
+        """Peers on the interface, as returned by `parse_dump`"""
+
+    def allowed_ips(self) -> Iterator[Tuple[str, List[str]]]:
+        """(public_key, allowed_ips) for every peer on the interface"""
+        for peer in self.list_peers():
+            yield peer["public_key"], peer["allowed_ips"]
+
+    def add_peer(self, public_key: str, allowed_ips: Sequence[str]):
+        self.add_peers([(public_key, allowed_ips)])
+
+    def remove_peer(self, public_key: str):
+        self.remove_peers([public_key])
+
+    # Async variants; by default the blocking call runs on `executor`
+
+    async def add_peers_async(self, peers: Iterable[PeerSpec], executor=None):
+        await asyncio.get_event_loop().run_in_executor(executor, self.add_peers, list(peers))
+
+    async def remove_peers_async(self, public_keys: Iterable[str], executor=None):
+        await asyncio.get_event_loop().run_in_executor(executor, self.remove_peers,
+                                                       list(public_keys))
+
+    async def list_peers_async(self, executor=None) -> List[Dict]:
+        return await asyncio.get_event_loop().run_in_executor(executor, self.list_peers)
+
+
+class CommandBackend(WireGuardBackend):
+    """Drives `wg set`, folding a whole batch into as few invocations as possible"""
+
+    name = "wg"
+
+    def __init__(self, interface: str = "wg0", wg_path: str = "wg", chunk_size: int = 500):
+        super().__init__(interface)
+        self.wg_path = wg_path
+        self.chunk_size = chunk_size
+
+    def _run(self, args: List[str]) -> str:
+        result = subprocess.run([self.wg_path] + args, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise WireGuardError(result.stderr.strip() or f"wg exited with {result.returncode}")
+        return result.stdout
+
+    async def _run_async(self, args: List[str]) -> str:
+        process = await asyncio.create_subprocess_exec(
+            self.wg_path, *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise WireGuardError(stderr.decode().strip() or f"wg exited with {process.returncode}")
+        return stdout.decode()
+
+    def _add_commands(self, peers: Iterable[PeerSpec]) -> List[List[str]]:
+        peers = list(peers)
+        commands = []
+        for i in range(0, len(peers), self.chunk_size):
+            args = ["set", self.interface]
+            for public_key, allowed_ips in peers[i:i + self.chunk_size]:
+                args += ["peer", public_key, "allowed-ips", ",".join(allowed_ips)]
+            commands.append(args)
+        return commands
+
+    def _remove_commands(self, public_keys: Iterable[str]) -> List[List[str]]:
+        public_keys = list(public_keys)
+        commands = []
+        for i in range(0, len(public_keys), self.chunk_size):
+            args = ["set", self.interface]
+            for public_key in public_keys[i:i + self.chunk_size]:
+                args += ["peer", public_key, "remove"]
+            commands.append(args)
+        return commands
+
+    def add_peers(self, peers: Iterable[PeerSpec]):
+        for args in self._add_commands(peers):
+            self._run(args)
+
+    def remove_peers(self, public_keys: Iterable[str]):
+        for args in self._remove_commands(public_keys):
+            self._run(args)
+
+    def dump(self) -> str:
+        """Raw `wg show <interface> dump` output"""
+        return self._run(["show", self.interface, "dump"])
+
+    def list_peers(self) -> List[Dict]:
+        return parse_dump(self.dump())
+
+    def allowed_ips(self) -> Iterator[Tuple[str, List[str]]]:
+        """Streamed from the `wg show dump` pipe, never holding the whole output"""
+        with subprocess.Popen([self.wg_path, "show", self.interface, "dump"],
+                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                              text=True) as process:
+            yield from iter_allowed_ips(process.stdout)
+            stderr = process.stderr.read()
+        if process.returncode != 0:
+            raise WireGuardError(stderr.strip() or f"wg exited with {process.returncode}")
+
+    async def add_peers_async(self, peers: Iterable[PeerSpec], executor=None):
+        for args in self._add_commands(peers):
+            await self._run_async(args)
+
+    async def remove_peers_async(self, public_keys: Iterable[str], executor=None):
+        for args in self._remove_commands(public_keys):
+            await self._run_async(args)
+
+    async def list_peers_async(self, executor=None) -> List[Dict]:
+        return parse_dump(await self._run_async(["show", self.interface, "dump"]))
+
+
+# Kernel WGPEER_A_FLAGS values (include/uapi/linux/wireguard.h)
+WGPEER_F_REMOVE_ME = 1 << 0
+WGPEER_F_REPLACE_ALLOWEDIPS = 1 << 1
+
+
+def _netlink_allowed_ip(cidr: str) -> Dict:
+    address, _, mask = cidr.partition("/")
+    family = socket.AF_INET6 if ":" in address else socket.AF_INET
+    if not mask:
+        mask = "128" if family == socket.AF_INET6 else "32"
+    return {"attrs": [["WGALLOWEDIP_A_FAMILY", family],
+                      ["WGALLOWEDIP_A_IPADDR", socket.inet_pton(family, address)],
+                      ["WGALLOWEDIP_A_CIDR_MASK", int(mask)]]}
+
+
+def _netlink_peer(public_key: str, allowed_ips: Optional[Sequence[str]] = None) -> Dict:
+    """A WGDEVICE_A_PEERS entry; without `allowed_ips` the peer is removed"""
+    if allowed_ips is None:
+        return {"attrs": [["WGPEER_A_PUBLIC_KEY", public_key],
+                          ["WGPEER_A_FLAGS", WGPEER_F_REMOVE_ME]]}
+    return {"attrs": [["WGPEER_A_PUBLIC_KEY", public_key],
+                      ["WGPEER_A_FLAGS", WGPEER_F_REPLACE_ALLOWEDIPS],
+                      ["WGPEER_A_ALLOWEDIPS", [_netlink_allowed_ip(ip) for ip in allowed_ips]]]}
+
+
+class NetlinkBackend(WireGuardBackend):
+    """Talks to the kernel over generic netlink (pyroute2), without forking.
+
+    A batch goes out as one WG_CMD_SET_DEVICE message per `chunk_size`
+    peers, like `wg setconf` does, rather than a message per peer (pyroute2's
+    `WireGuard.set` only takes a single peer). Reads still go through
+    `wg show dump`, which is a single call anyway.
+    """
+
+    name = "netlink"
+
+    def __init__(self, interface: str = "wg0", chunk_size: int = 128):
+        super().__init__(interface)
+        if _NetlinkWireGuard is None:
+            raise WireGuardError("pyroute2 is not installed")
+        self.chunk_size = chunk_size
+        self._wg = _NetlinkWireGuard()
+        self._lock = threading.Lock()
+        self._reader = CommandBackend(interface)
+
+    def _set_peers(self, entries: List[Dict]):
+        """Send WGDEVICE_A_PEERS entries to the kernel, `chunk_size` per message"""
+        with self._lock:
+            for i in range(0, len(entries), self.chunk_size):
+                msg = wgmsg()
+                msg["cmd"] = WG_CMD_SET_DEVICE
+                msg["version"] = WG_GENL_VERSION
+                msg["attrs"].append(["WGDEVICE_A_IFNAME", self.interface])
+                msg["attrs"].append(["WGDEVICE_A_PEERS", entries[i:i + self.chunk_size]])
+                msg["header"]["type"] = self._wg.prid
+                msg["header"]["flags"] = NLM_F_REQUEST | NLM_F_ACK
+                msg["header"]["pid"] = self._wg.pid
+                try:
+                    msg.encode()
+                    self._wg.sendto(msg.data, (0, 0))
+                    error = self._wg.get()[0]["header"].get("error")
+                except Exception as e:
+                    raise WireGuardError(f"netlink set {self.interface}: {e}") from e
+                if error is not None:
+                    raise WireGuardError(f"netlink set {self.interface}: {error}")
+
+    def add_peers(self, peers: Iterable[PeerSpec]):
+        self._set_peers([_netlink_peer(public_key, list(allowed_ips))
+                         for public_key, allowed_ips in peers])
+
+    def remove_peers(self, public_keys: Iterable[str]):
+        self._set_peers([_netlink_peer(public_key) for public_key in public_keys])
+
+    def dump(self) -> str:
+        return self._reader.dump()
+
+    def list_peers(self) -> List[Dict]:
+        return self._reader.list_peers()
+
+    def allowed_ips(self) -> Iterator[Tuple[str, List[str]]]:
+        return self._reader.allowed_ips()
+
+
+class FakeBackend(WireGuardBackend):
+    """In-memory interface for development machines and tests"""
+
+    name = "fake"
+
+    def __init__(self, interface: str = "wg0"):
+        super().__init__(interface)
+        self.peers: Dict[str, List[str]] = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def add_peers(self, peers: Iterable[PeerSpec]):
+        with self._lock:
+            self.calls += 1
+            for public_key, allowed_ips in peers:
+                # Like the kernel, an allowed IP moves to the peer that claims it last
+                for other in self.peers.values():
+                    other[:] = [ip for ip in other if ip not in allowed_ips]
+                self.peers[public_key] = list(allowed_ips)
+
+    def remove_peers(self, public_keys: Iterable[str]):
+        with self._lock:
+            self.calls += 1
+            for public_key in public_keys:
+                self.peers.pop(public_key, None)
+
+    def list_peers(self) -> List[Dict]:
+        with self._lock:
+            return [{"public_key": public_key, "endpoint": None, "allowed_ips": list(ips),
+                     "latest_handshake": 0, "rx_bytes": 0, "tx_bytes": 0}
+                    for public_key, ips in self.peers.items()]
+
+
+class AsyncWireGuard:
+    """Event-loop friendly access to a backend.
+
+    Kernel mutations for one interface are serialised by an asyncio lock
+    shared by every wrapper of that interface; blocking backends run on
+    `executor`, the `wg` backend uses asyncio subprocesses.
+    """
+
+    _locks: Dict[str, asyncio.Lock] = {}
+
+    def __init__(self, backend: WireGuardBackend, executor=None):
+        self.backend = backend
+        self.executor = executor
+
+    @property
+    def interface(self) -> str:
+        return self.backend.interface
+
+    def _lock(self) -> asyncio.Lock:
+        lock = self._locks.get(self.backend.interface)
+        if lock is None:
+            lock = self._locks[self.backend.interface] = asyncio.Lock()
+        return lock
+
+    async def add_peers(self, peers: Iterable[PeerSpec]):
+        async with self._lock():
+            await self.backend.add_peers_async(list(peers), self.executor)
+
+    async def remove_peers(self, public_keys: Iterable[str]):
+        async with self._lock():
+            await self.backend.remove_peers_async(list(public_keys), self.executor)
+
+    async def add_peer(self, public_key: str, allowed_ips: Sequence[str]):
+        await self.add_peers([(public_key, allowed_ips)])
+
+    async def remove_peer(self, public_key: str):
+        await self.remove_peers([public_key])
+
+    async def list_peers(self) -> List[Dict]:
+        return await self.backend.list_peers_async(self.executor)
+
+
+def create_backend(interface: str = "wg0", kind: Optional[str] = None) -> WireGuardBackend:
+    """Pick a backend: `netlink`, `wg`, `fake`, or `auto` (netlink when available)"""
+    kind = (kind or os.getenv("WG_BACKEND", "auto")).lower()
+    if kind == "fake":
+        return FakeBackend(interface)
+    if kind == "wg":
+        return CommandBackend(interface)
+    if kind == "netlink":
+        return NetlinkBackend(interface)
+    if kind != "auto":
+        raise ValueError(f"Unknown WireGuard backend: {kind}")
+    if _NetlinkWireGuard is not None:
+        try:
+            return NetlinkBackend(interface)
+        except Exception as e:
+            logger.warning("Netlink WireGuard backend unavailable (%s), using wg", e)
+    return CommandBackend(interface)
@@ -45,6 +45,50 @@ remove_client() {
     echo "Client $CLIENT_NAME removed successfully"
 }
 
+# Function to add many clients with a single `wg set` call
+# Each line of the file: <client_pubkey> <client_ip> <client_name>
+add_clients_batch() {
+    local BATCH_FILE="$1"
+    local WG_ARGS=()
+
+    while read -r CLIENT_PUBKEY CLIENT_IP CLIENT_NAME; do
+        [ -z "$CLIENT_PUBKEY" ] && continue
+        cat > "$WG_CLIENTS_DIR/$CLIENT_NAME.conf" << EOF
+[Peer]
+PublicKey = $CLIENT_PUBKEY
+AllowedIPs = $CLIENT_IP/32
+EOF
+        WG_ARGS+=(peer "$CLIENT_PUBKEY" allowed-ips "$CLIENT_IP/32")
+    done < "$BATCH_FILE"
+
+    if [ "${#WG_ARGS[@]}" -gt 0 ]; then
+        wg set wg0 "${WG_ARGS[@]}"
+        wg-quick save wg0
+    fi
+
+    echo "Added $(( ${#WG_ARGS[@]} / 4 )) clients"
+}
+
+# Function to remove many clients with a single `wg set` call
+# Each line of the file: <client_pubkey> <client_name>
+remove_clients_batch() {
+    local BATCH_FILE="$1"
+    local WG_ARGS=()
+
+    while read -r CLIENT_PUBKEY CLIENT_NAME; do
+        [ -z "$CLIENT_PUBKEY" ] && continue
+        rm -f "${WG_CLIENTS_DIR:?}/${CLIENT_NAME:?}.conf"
+        WG_ARGS+=(peer "$CLIENT_PUBKEY" remove)
+    done < "$BATCH_FILE"
+
+    if [ "${#WG_ARGS[@]}" -gt 0 ]; then
+        wg set wg0 "${WG_ARGS[@]}"
+        wg-quick save wg0
+    fi
+
+    echo "Removed $(( ${#WG_ARGS[@]} / 3 )) clients"
+}
+
 # Function to list all clients
 list_clients() {
     echo "Current WireGuard Peers:"
@@ -75,13 +119,29 @@ case "$1" in
         fi
         remove_client "$2" "$3"
         ;;
+    "add-batch")
+        if [ "$#" -ne 2 ]; then
+            echo "Usage: $0 add-batch <file>"
+            exit 1
+        fi
+        add_clients_batch "$2"
+        ;;
+    "remove-batch")
+        if [ "$#" -ne 2 ]; then
+            echo "Usage: $0 remove-batch <file>"
+            exit 1
+        fi
+        remove_clients_batch "$2"
+        ;;
     "list")
         list_clients
         ;;
     *)
-        echo "Usage: $0 {add|remove|list}"
+        echo "Usage: $0 {add|remove|add-batch|remove-batch|list}"
         echo "add <client_pubkey> <client_ip> <client_name>"
         echo "remove <client_pubkey> <client_name>"
+        echo "add-batch <file>      (lines: <client_pubkey> <client_ip> <client_name>)"
+        echo "remove-batch <file>   (lines: <client_pubkey> <client_name>)"
         echo "list"
         exit 1
         ;;
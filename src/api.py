@@ -1,5 +1,8 @@
-from flask import Flask, jsonify, request, send_file
+from flask import Flask, Response, jsonify, request, send_file
+import hashlib
+import hmac
 import os
+import secrets
 from pathlib import Path
 from utils import (
     get_public_ip,
@@ -8,11 +11,23 @@ from utils import (
     verify_subscription,
     save_peer_config,
     create_peer_config,
-    run_command
+    load_peer_index,
+    release_ip,
+    node_identity,
+    wg_backend,
+    config_cache,
+    peer_index,
+    telemetry
 )
+from dvpn.metrics import instrument_flask, stage
+from dvpn.ratelimit import RateLimited, admission_from_env, flask_admitted, flask_rate_limited
+from dvpn.wgctl import WireGuardError
 
 app = Flask(__name__)
 
+# Request latency histograms and GET /metrics
+instrument_flask(app)
+
 # Configuration
 BACKEND_URL = os.getenv('BACKEND_URL', 'http://localhost:8000')
 
@@ -24,7 +39,46 @@ except Exception as e:
     print(f"Failed to load server public key: {e}")
     SERVER_PUBLIC_KEY = None
 
+# Load the peer allocation index once; it is updated incrementally afterwards
+try:
+    load_peer_index()
+except Exception as e:
+    print(f"Failed to load peer index: {e}")
+
+# Resolve the public endpoint now rather than on the first request
+node_identity.start()
+
+# Peer status requests are answered from the latest sample, never by running `wg`
+telemetry.start()
+
+# Per-address token buckets and a cap on peer generations in flight. Requests the
+# backend proxies all come from its address: list it in RATE_LIMIT_TRUSTED_IPS.
+admission = admission_from_env()
+
+CONFIG_MIMETYPE = 'application/x-wireguard-config'
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _config_response(data, token=None):
+    headers = {'Content-Disposition': 'attachment; filename=wg0-client.conf'}
+    if token:
+        headers['X-Config-Token'] = token
+    return Response(data, mimetype=CONFIG_MIMETYPE, headers=headers)
+
+def _authorized(eth_address):
+    """Re-downloads need the token handed out when the config was generated.
+
+    Only the header is accepted: a query string ends up in access and proxy logs.
+    """
+    token = request.headers.get('X-Config-Token')
+    entry = peer_index.get(eth_address)
+    if not token or not entry or not entry.get('token_hash'):
+        return False
+    return hmac.compare_digest(entry['token_hash'], _token_hash(token))
+
 @app.route('/generate-peer', methods=['POST'])
+@flask_admitted(admission)
 def generate_peer():
     try:
         # Check if we have the server public key
@@ -42,17 +96,29 @@ def generate_peer():
         if not verify_subscription(eth_address, BACKEND_URL):
             return jsonify({'error': 'Invalid or expired subscription'}), 401
 
+        # Per-address limit only now, so nobody can spend another address's requests
+        try:
+            admission.limit(user=eth_address)
+        except RateLimited as e:
+            return flask_rate_limited(e)
+
         # Generate peer keys
         private_key, public_key = generate_wireguard_keys()
         if not private_key or not public_key:
             return jsonify({'error': 'Failed to generate keys'}), 500
 
+        # A peer this address had before is replaced, and taken off wg0 afterwards
+        previous = peer_index.get(eth_address)
+
         # Get next available IP
         peer_ip = get_next_available_ip()
+        if not peer_ip:
+            return jsonify({'error': 'No available IP addresses'}), 500
 
         # Get server public IP
         server_ip = get_public_ip()
         if not server_ip:
+            release_ip(peer_ip)
             return jsonify({'error': 'Failed to get server IP'}), 500
 
         # Create peer configuration
@@ -64,25 +130,102 @@ def generate_peer():
             server_ip
         )
 
-        # Save peer configuration
-        config_path = save_peer_config(config, eth_address)
-
-        # Add peer to WireGuard
-        cmd = f"wg set wg0 peer {public_key} allowed-ips {peer_ip}/32"
-        output, error = run_command(cmd)
-        if error:
-            return jsonify({'error': f'Failed to add peer: {error}'}), 500
-
-        # Return configuration file
-        return send_file(
-            config_path,
-            mimetype='application/x-wireguard-config',
-            as_attachment=True,
-            download_name='wg0-client.conf'
-        )
+        # Add peer to WireGuard before anything refers to it
+        try:
+            with stage('kernel_apply'):
+                wg_backend.add_peer(public_key, [f"{peer_ip}/32"])
+        except WireGuardError as e:
+            release_ip(peer_ip)
+            return jsonify({'error': f'Failed to add peer: {e}'}), 500
+
+        # Save peer configuration; the token authorises later re-downloads
+        token = secrets.token_urlsafe(24)
+        config_data = save_peer_config(config, eth_address, peer_ip, public_key, _token_hash(token))
+        if config_data is None:
+            try:
+                wg_backend.remove_peer(public_key)
+            except WireGuardError as e:
+                print(f"Failed to remove peer {public_key}: {e}")
+            release_ip(peer_ip)
+            return jsonify({'error': 'Failed to save peer configuration'}), 500
+
+        # The old key would otherwise stay on wg0 with nothing pointing at it
+        old_key = previous.get('public_key') if previous else None
+        if old_key and old_key != public_key:
+            try:
+                wg_backend.remove_peer(old_key)
+            except WireGuardError as e:
+                print(f"Failed to remove replaced peer {old_key}: {e}")
+
+        # Return configuration file straight from the rendered bytes
+        return _config_response(config_data, token)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/peer-config/<eth_address>', methods=['GET'])
+def download_peer_config(eth_address):
+    if not _authorized(eth_address):
+        return jsonify({'error': 'Invalid or missing config token'}), 403
+
+    # Served from memory when cached, otherwise streamed from disk (sendfile where supported)
+    data = config_cache.get(eth_address, load=False)
+    if data is not None:
+        return _config_response(data)
+    config_path = config_cache.path(eth_address)
+    if config_path is None:
+        return jsonify({'error': 'Config not found'}), 404
+    return send_file(
+        config_path,
+        mimetype=CONFIG_MIMETYPE,
+        as_attachment=True,
+        download_name='wg0-client.conf'
+    )
+
+@app.route('/peer-config/<eth_address>/qr', methods=['GET'])
+def download_peer_qr(eth_address):
+    if not _authorized(eth_address):
+        return jsonify({'error': 'Invalid or missing config token'}), 403
+    try:
+        png = config_cache.qr_png(eth_address)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 501
+    if png is None:
+        return jsonify({'error': 'Config not found'}), 404
+    return Response(png, mimetype='image/png')
+
+def _peer_status_entry(eth_address, entry):
+    return {'eth_address': eth_address, 'ip': entry.get('ip'),
+            **telemetry.peer_status(entry.get('public_key'))}
+
+@app.route('/peer-status', methods=['GET'])
+def peer_status():
+    eth_address = request.args.get('user_address') or request.args.get('eth_address')
+    if not eth_address:
+        return jsonify({'error': 'user_address is required'}), 400
+    entry = peer_index.get(eth_address)
+    if entry is None:
+        return jsonify({'error': 'Peer not found'}), 404
+    return jsonify(_peer_status_entry(eth_address, entry))
+
+@app.route('/peers/stats', methods=['GET'])
+def peers_stats():
+    peers = [_peer_status_entry(eth_address, entry) for eth_address, entry in peer_index.items()
+             if not eth_address.startswith('wg:')]
+    if request.args.get('connected_only') == 'true':
+        peers = [peer for peer in peers if peer['status'] == 'connected']
+    return jsonify({'summary': telemetry.stats(), 'peers': peers})
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    # Load figures let the backend's node directory spread users across nodes
+    summary = telemetry.stats()
+    load = {'peers': summary.get('peers', 0), 'connected': summary.get('connected', 0)}
+    return jsonify({'status': 'healthy', 'load': load})
+
+@app.route('/config-cache', methods=['GET'])
+def config_cache_stats():
+    return jsonify(config_cache.stats())
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000) 
\ No newline at end of file
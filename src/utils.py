@@ -1,5 +1,7 @@
 import os
+import sys
 import subprocess
+import threading
 import requests
 from pathlib import Path
 import json
@@ -7,17 +9,56 @@ from web3 import Web3
 from eth_account import Account
 import secrets
 
+# Shared helpers live in the repository-level dvpn package
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.chain import get_client
+from dvpn.config_cache import ConfigCache
+from dvpn.ip_allocator import IPAllocator
+from dvpn.keys import public_key_from_private
+from dvpn.metrics import stage
+from dvpn.node_identity import NodeIdentity
+from dvpn.peer_store import PeerStore
+from dvpn.subscription_cache import SubscriptionCache
+from dvpn.telemetry import TelemetryCollector
+from dvpn.wgctl import create_backend
+
 # Constants
 WG_CONFIG_DIR = '/etc/wireguard'
 PEERS_DIR = os.path.join(WG_CONFIG_DIR, 'peers')
 NETWORK_RANGE = '10.8.0.0/24'  # WireGuard network range
-SUBSCRIPTION_CONTRACT_ADDRESS = '0x103F744c4d064223AA0c6986d2465396F4F3e394'  # Your contract address
+SUBSCRIPTION_CONTRACT_ADDRESS = os.getenv('SUBSCRIPTION_CONTRACT_ADDRESS', '0x516Fa3Ea215c372696e6D291F00f251f49904439')  # VPNSubscription (V4)
+ETH_RPC_URL = os.getenv('ETH_RPC_URL', 'https://eth-mainnet.g.alchemy.com/v2/your-api-key')
+PEER_INDEX_FILE = os.path.join(PEERS_DIR, 'index.json')
+WG_INTERFACE = 'wg0'
+CONFIG_CACHE_SIZE = int(os.getenv('CONFIG_CACHE_SIZE', '1024'))
+PERSIST_PEER_CONFIGS = os.getenv('PERSIST_PEER_CONFIGS', '1') == '1'
+
+# Kernel peer control (netlink when available, `wg set` otherwise)
+wg_backend = create_backend(WG_INTERFACE)
+
+# Allocation index: eth_address -> {ip, public_key}, persisted next to the peer configs
+peer_index = PeerStore(PEER_INDEX_FILE)
+ip_allocator = IPAllocator([NETWORK_RANGE])
+_index_lock = threading.Lock()
+
+# Rendered peer configs kept as bytes for re-downloads, written to PEERS_DIR unless disabled
+config_cache = ConfigCache(CONFIG_CACHE_SIZE, PEERS_DIR if PERSIST_PEER_CONFIGS else None)
+
+# Public endpoint, resolved once and refreshed in the background (SERVER_ENDPOINT overrides)
+node_identity = NodeIdentity(ttl=int(os.getenv('PUBLIC_IP_TTL', '3600')))
+
+# Per-peer handshake and transfer counters, sampled from `wg show dump` in the background
+telemetry = TelemetryCollector(wg_backend, interval=float(os.getenv('TELEMETRY_INTERVAL', '10')))
+
+# Subscription lookups, created on first use and shared by every request
+_subscription_cache = None
+_subscription_cache_lock = threading.Lock()
 
 def get_public_ip():
-    """Get the server's public IP address"""
+    """Get the server's public IP address (cached, see node_identity)"""
     try:
-        response = requests.get('https://api.ipify.org?format=json')
-        return response.json()['ip']
+        with stage('public_ip_lookup'):
+            return node_identity.get()
     except Exception as e:
         print(f"Error getting public IP: {e}")
         return None
@@ -25,72 +66,151 @@ def get_public_ip():
 def generate_wireguard_keys():
     """Generate a new WireGuard key pair"""
     try:
-        # Generate private key
-        private_key = subprocess.check_output(['wg', 'genkey']).decode('utf-8').strip()
-        
-        # Generate public key from private key
-        public_key = subprocess.run(['wg', 'pubkey'], 
-                                  input=private_key.encode(), 
-                                  capture_output=True, 
-                                  text=True).stdout.strip()
-        
+        with stage('keygen'):
+            # Generate private key
+            private_key = subprocess.check_output(['wg', 'genkey']).decode('utf-8').strip()
+
+            # Generate public key from private key
+            public_key = subprocess.run(['wg', 'pubkey'],
+                                      input=private_key.encode(),
+                                      capture_output=True,
+                                      text=True).stdout.strip()
+
         return private_key, public_key
     except Exception as e:
         print(f"Error generating WireGuard keys: {e}")
         return None, None
 
+def _config_value(config, name):
+    """Read a `Name = value` entry from a rendered WireGuard config"""
+    for line in config.split('\n'):
+        key, _, value = line.partition('=')
+        if key.strip() == name:
+            return value.strip()
+    return None
+
+def _parse_address(config):
+    """Extract the peer address from a rendered WireGuard config"""
+    address = _config_value(config, 'Address')
+    return address.split('/')[0] if address else None
+
+def _rebuild_allocator():
+    global ip_allocator
+    ip_allocator = IPAllocator([NETWORK_RANGE])
+    for _, peer in peer_index.items():
+        ip_allocator.mark_used(peer['ip'])
+
+def _disk_peer_names():
+    """Owners of the peer configs on disk (a directory listing, no file opens)"""
+    return {name[:-len('.conf')] for name in os.listdir(PEERS_DIR) if name.endswith('.conf')}
+
+def _kernel_allowed_ips():
+    """Map of public key -> allowed IPs currently configured on the interface"""
+    return {peer['public_key']: [ip.split('/')[0] for ip in peer['allowed_ips']]
+            for peer in wg_backend.list_peers()}
+
+def load_peer_index():
+    """Load the allocation index once at startup, reconciling it if it has drifted"""
+    with _index_lock:
+        os.makedirs(PEERS_DIR, exist_ok=True)
+        peer_index.load()
+        drift = None
+        if PERSIST_PEER_CONFIGS and \
+                set(k for k, _ in peer_index.items() if not k.startswith('wg:')) != _disk_peer_names():
+            drift = 'disk'
+        else:
+            try:
+                indexed_ips = {peer['ip'] for _, peer in peer_index.items()}
+                if any(ip not in indexed_ips for ips in _kernel_allowed_ips().values() for ip in ips):
+                    drift = 'wg'
+            except Exception as e:
+                print(f"Skipping kernel drift check: {e}")
+        if drift:
+            print(f"Peer index out of sync with {drift}, rebuilding")
+            _reconcile_locked(drift)
+        else:
+            _rebuild_allocator()
+
+def reconcile_peer_index(source='disk'):
+    """Rebuild the allocation index from peer configs on disk or from `wg show`"""
+    with _index_lock:
+        _reconcile_locked(source)
+
+def _reconcile_locked(source):
+    if source == 'disk':
+        entries = {}
+        for name in _disk_peer_names():
+            with open(os.path.join(PEERS_DIR, f"{name}.conf"), 'r') as f:
+                config = f.read()
+            ip = _parse_address(config)
+            if not ip:
+                continue
+            entry = {'ip': ip}
+            private_key = _config_value(config, 'PrivateKey')
+            if private_key:
+                try:
+                    entry['public_key'] = public_key_from_private(private_key)
+                except Exception:
+                    pass
+            entries[name] = entry
+        for owner, _ in peer_index.items():
+            if owner not in entries and not owner.startswith('wg:'):
+                peer_index.remove(owner)
+        for owner, entry in entries.items():
+            previous = peer_index.get(owner)
+            if previous and previous.get('public_key') == entry.get('public_key') \
+                    and 'token_hash' in previous:
+                # Same peer, so its download token still applies
+                entry['token_hash'] = previous['token_hash']
+            if previous != entry:
+                peer_index.put(owner, entry)
+    elif source == 'wg':
+        for public_key, ips in _kernel_allowed_ips().items():
+            if not ips:
+                continue
+            known = peer_index.get_by_public_key(public_key)
+            if known is not None:
+                owner, entry = known
+                if entry.get('ip') != ips[0]:
+                    peer_index.put(owner, {**entry, 'ip': ips[0]})
+            elif peer_index.get_by_ip(ips[0]) is None:
+                # Unknown kernel peer: keep its address out of circulation
+                peer_index.put(f"wg:{public_key}", {'ip': ips[0], 'public_key': public_key})
+    else:
+        raise ValueError(f"Unknown reconcile source: {source}")
+    peer_index.compact()
+    _rebuild_allocator()
+
 def get_next_available_ip():
     """Get the next available IP address for a new peer"""
     try:
-        # Create peers directory if it doesn't exist
-        os.makedirs(PEERS_DIR, exist_ok=True)
-        
-        # List existing peer configs
-        existing_ips = set()
-        for peer_file in os.listdir(PEERS_DIR):
-            if peer_file.endswith('.conf'):
-                with open(os.path.join(PEERS_DIR, peer_file), 'r') as f:
-                    content = f.read()
-                    # Extract IP from config
-                    for line in content.split('\n'):
-                        if 'Address' in line:
-                            ip = line.split('=')[1].strip().split('/')[0]
-                            existing_ips.add(ip)
-        
-        # Generate next available IP
-        base_ip = NETWORK_RANGE.split('/')[0]  # e.g., '10.8.0.0'
-        base_parts = [int(x) for x in base_ip.split('.')]
-        
-        # Start from .2 (as .1 is typically the server)
-        for i in range(2, 255):
-            candidate_ip = f"{base_parts[0]}.{base_parts[1]}.{base_parts[2]}.{i}"
-            if candidate_ip not in existing_ips:
-                return candidate_ip
-                
-        raise Exception("No available IP addresses")
+        with _index_lock, stage('ip_allocation'):
+            return str(ip_allocator.allocate())
     except Exception as e:
         print(f"Error getting next available IP: {e}")
         return None
 
-def verify_subscription(eth_address):
+def release_ip(peer_ip):
+    """Return an address taken by get_next_available_ip() that ended up unused"""
+    with _index_lock:
+        if peer_index.get_by_ip(peer_ip) is None:
+            ip_allocator.release(peer_ip)
+
+def get_subscription_cache():
+    """Return the shared subscription cache, starting its log follower on first use"""
+    global _subscription_cache
+    with _subscription_cache_lock:
+        if _subscription_cache is None:
+            w3 = get_client(ETH_RPC_URL).w3
+            _subscription_cache = SubscriptionCache(w3, SUBSCRIPTION_CONTRACT_ADDRESS)
+            _subscription_cache.start()
+        return _subscription_cache
+
+def verify_subscription(eth_address, backend_url=None):
     """Verify if the user has an active subscription"""
     try:
-        # Initialize Web3 with your Ethereum node
-        w3 = Web3(Web3.HTTPProvider('https://eth-mainnet.g.alchemy.com/v2/your-api-key'))
-        
-        # Load the contract ABI (you'll need to provide this)
-        with open('subscription_abi.json', 'r') as f:
-            contract_abi = json.load(f)
-        
-        # Create contract instance
-        contract = w3.eth.contract(
-            address=SUBSCRIPTION_CONTRACT_ADDRESS,
-            abi=contract_abi
-        )
-        
-        # Check subscription status
-        has_subscription = contract.functions.hasActiveSubscription(eth_address).call()
-        return has_subscription
+        with stage('subscription_check'):
+            return get_subscription_cache().is_active(eth_address)
     except Exception as e:
         print(f"Error verifying subscription: {e}")
         # For testing, return True. In production, handle this properly
@@ -110,20 +230,42 @@ Endpoint = {server_ip}:51820
 PersistentKeepalive = 25
 """
 
-def save_peer_config(config, eth_address):
-    """Save peer configuration to a file"""
+def save_peer_config(config, eth_address, peer_ip=None, public_key=None, token_hash=None):
+    """Cache (and persist) a peer configuration, record it in the allocation index
+    and return the config bytes"""
+    previous_config = None
     try:
-        # Create peers directory if it doesn't exist
-        os.makedirs(PEERS_DIR, exist_ok=True)
-        
-        # Create config file
-        config_path = os.path.join(PEERS_DIR, f"{eth_address}.conf")
-        with open(config_path, 'w') as f:
-            f.write(config)
+        # Kept so a failed save can put the old config back
+        previous_config = config_cache.get(eth_address)
+
+        # Encoded once; re-downloads are served from these bytes or the file on disk
+        data = config_cache.put(eth_address, config)
+
+        # Keep the allocation index in step with the file we just wrote
+        peer_ip = peer_ip or _parse_address(config)
+        with _index_lock:
+            previous = peer_index.get(eth_address)
+            ip_allocator.mark_used(peer_ip)
+            entry = {'ip': peer_ip}
+            if public_key:
+                entry['public_key'] = public_key
+            if token_hash:
+                entry['token_hash'] = token_hash
+            with stage('peer_store_commit'):
+                peer_index.put(eth_address, entry)
+            if previous and previous.get('ip') != peer_ip:
+                ip_allocator.release(previous['ip'])
         
-        return config_path
+        return data
     except Exception as e:
         print(f"Error saving peer config: {e}")
+        try:
+            if previous_config is not None:
+                config_cache.put(eth_address, previous_config)
+            else:
+                config_cache.invalidate(eth_address, delete=True)
+        except Exception as restore_error:
+            print(f"Error restoring peer config: {restore_error}")
         return None
 
 def run_command(cmd):
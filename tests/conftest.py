@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# The shared dvpn package lives at the repository root
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
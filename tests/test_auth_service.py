@@ -0,0 +1,135 @@
+import time
+
+import pytest
+
+jwt = pytest.importorskip("jwt")
+pytest.importorskip("eth_account")
+
+from vpn_backend.services.auth_service import AuthService
+
+# At least 32 bytes, as PyJWT expects for HS256
+NEW_KEY = "new-secret".ljust(32, "-")
+OLD_KEY = "old-secret".ljust(32, "-")
+LEGACY_KEY = "legacy-secret".ljust(32, "-")
+
+
+@pytest.fixture
+def auth(monkeypatch):
+    monkeypatch.delenv("JWT_SECRET_KEY", raising=False)
+    monkeypatch.delenv("JWT_ACTIVE_KID", raising=False)
+    monkeypatch.setenv("JWT_SIGNING_KEYS", f"k2:{NEW_KEY},k1:{OLD_KEY}")
+    return AuthService()
+
+
+def signed(claims, key, kid=None):
+    claims = dict(claims, exp=time.time() + 60)
+    return jwt.encode(claims, key, algorithm="HS256", headers={"kid": kid} if kid else None)
+
+
+def test_tokens_are_signed_with_the_active_key(auth):
+    token = auth.generate_token({"address": "0xabc"})
+    assert jwt.get_unverified_header(token)["kid"] == "k2"
+    assert auth.verify_token(token)["address"] == "0xabc"
+    # The second verification is served from the cache
+    assert auth.verify_token(token)["address"] == "0xabc"
+    assert (auth.hits, auth.misses) == (1, 1)
+
+
+def test_older_keys_verify_until_retired(auth):
+    token = signed({"address": "0xold"}, OLD_KEY, "k1")
+    assert auth.verify_token(token)["address"] == "0xold"
+    auth.retire_key("k1")
+    with pytest.raises(Exception, match="Invalid token"):
+        auth.verify_token(token)
+
+
+@pytest.mark.parametrize("token", [
+    signed({"address": "0xbad"}, "guess".ljust(32, "-"), "k2"),
+    signed({"address": "0xbad"}, NEW_KEY, "unknown"),
+    "garbage",
+])
+def test_bad_tokens_are_rejected(auth, token):
+    with pytest.raises(Exception, match="Invalid token"):
+        auth.verify_token(token)
+
+
+def test_kid_less_tokens_need_an_explicit_legacy_secret(auth, monkeypatch):
+    forged = signed({"address": "0xevil"}, "your-secret-key".ljust(32, "-"))
+    with pytest.raises(Exception, match="Invalid token"):
+        auth.verify_token(forged)
+
+    monkeypatch.setenv("JWT_SECRET_KEY", LEGACY_KEY)
+    legacy = AuthService()
+    assert legacy.verify_token(signed({"address": "0xleg"}, LEGACY_KEY))["address"] == "0xleg"
+    with pytest.raises(Exception, match="Invalid token"):
+        legacy.verify_token(forged)
+
+
+def test_unknown_active_kid_fails_at_startup(monkeypatch):
+    monkeypatch.setenv("JWT_SIGNING_KEYS", f"k1:{OLD_KEY}")
+    monkeypatch.setenv("JWT_ACTIVE_KID", "k9")
+    with pytest.raises(ValueError):
+        AuthService()
+
+
+def test_unconfigured_service_uses_a_random_key(monkeypatch):
+    for name in ("JWT_SIGNING_KEYS", "JWT_SECRET_KEY", "JWT_ACTIVE_KID"):
+        monkeypatch.delenv(name, raising=False)
+    first, second = AuthService(), AuthService()
+    token = first.generate_token({"address": "0xabc"})
+    assert first.verify_token(token)["address"] == "0xabc"
+    with pytest.raises(Exception):
+        second.verify_token(token)
+
+
+def test_revoked_tokens_stay_rejected(auth):
+    token = auth.generate_token({"address": "0xabc"})
+    auth.verify_token(token)
+    auth.revoke_token(token)
+    with pytest.raises(Exception, match="revoked"):
+        auth.verify_token(token)
+
+
+def test_cached_claims_still_expire(auth):
+    token = jwt.encode({"address": "0xs", "exp": time.time() + 1}, NEW_KEY,
+                       algorithm="HS256", headers={"kid": "k2"})
+    auth.verify_token(token)
+    time.sleep(1.1)
+    with pytest.raises(Exception, match="expired"):
+        auth.verify_token(token)
+
+
+def sign(account, message):
+    from eth_account.messages import encode_defunct
+    return account.sign_message(encode_defunct(text=message)).signature.hex()
+
+
+def test_login_challenge_round_trip(auth):
+    from eth_account import Account
+    account = Account.create()
+    message = auth.create_challenge(account.address)
+    assert auth.verify_login(message, sign(account, message)) == account.address
+    with pytest.raises(Exception, match="already used"):
+        auth.verify_login(message, sign(account, message))
+
+
+def test_bad_signature_does_not_burn_the_challenge(auth):
+    from eth_account import Account
+    account, other = Account.create(), Account.create()
+    message = auth.create_challenge(account.address)
+    with pytest.raises(Exception, match="does not match"):
+        auth.verify_login(message, sign(other, message))
+    with pytest.raises(Exception, match="Invalid signature"):
+        auth.verify_login(message, "0x00")
+    assert auth.verify_login(message, sign(account, message)) == account.address
+
+
+def test_one_outstanding_challenge_per_address(auth):
+    from eth_account import Account
+    account = Account.create()
+    first = auth.create_challenge(account.address)
+    second = auth.create_challenge(account.address.lower())
+    with pytest.raises(Exception, match="already used"):
+        auth.verify_login(first, sign(account, first))
+    assert auth.verify_login(second, sign(account, second)) == account.address
+    assert auth._challenges == {} and auth._challenge_nonces == {}
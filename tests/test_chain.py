@@ -0,0 +1,130 @@
+import pytest
+
+requests = pytest.importorskip("requests")
+pytest.importorskip("web3")
+
+from dvpn import chain
+from dvpn.chain import CircuitBreaker, CircuitOpenError, retry_middleware
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(chain.time, "monotonic", clock)
+    monkeypatch.setattr(chain.time, "sleep", lambda seconds: None)
+    return clock
+
+
+def http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.exceptions.HTTPError(f"HTTP {status}", response=response)
+
+
+def scripted(*outcomes):
+    """make_request returning or raising each outcome in turn"""
+    calls = []
+
+    def make_request(method, params):
+        outcome = outcomes[len(calls)]
+        calls.append(method)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    return make_request, calls
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_half_open_allows_one_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == "half-open"
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+
+
+def test_unexpected_error_in_trial_does_not_wedge_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.now += 30
+    make_request, calls = scripted(ValueError("bad payload"), {"result": "0x1"})
+    request = retry_middleware(breaker, retries=3, backoff=0)(make_request, None)
+
+    with pytest.raises(ValueError):
+        request("eth_blockNumber", [])
+    # Not retried, counted as a failure, and the next trial is allowed in time
+    assert calls == ["eth_blockNumber"]
+    assert breaker.state == "open"
+    clock.now += 30
+    assert request("eth_blockNumber", []) == {"result": "0x1"}
+    assert breaker.state == "closed"
+
+
+@pytest.mark.parametrize("status", [429, 502, 503])
+def test_rate_limits_and_server_errors_are_retried(clock, status):
+    breaker = CircuitBreaker(failure_threshold=10)
+    make_request, calls = scripted(http_error(status), http_error(status), {"result": "0x1"})
+    request = retry_middleware(breaker, retries=3, backoff=0)(make_request, None)
+    assert request("eth_call", []) == {"result": "0x1"}
+    assert len(calls) == 3
+    assert breaker.state == "closed"
+
+
+def test_client_errors_are_not_retried(clock):
+    breaker = CircuitBreaker(failure_threshold=10)
+    make_request, calls = scripted(http_error(400), {"result": "0x1"})
+    request = retry_middleware(breaker, retries=3, backoff=0)(make_request, None)
+    with pytest.raises(requests.exceptions.HTTPError):
+        request("eth_call", [])
+    assert len(calls) == 1
+
+
+def test_retries_are_bounded(clock):
+    breaker = CircuitBreaker(failure_threshold=10)
+    errors = [requests.exceptions.ConnectionError("refused")] * 3
+    make_request, calls = scripted(*errors)
+    request = retry_middleware(breaker, retries=2, backoff=0)(make_request, None)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        request("eth_call", [])
+    assert len(calls) == 3
+
+
+def test_retry_after_is_honoured(clock, monkeypatch):
+    slept = []
+    monkeypatch.setattr(chain.time, "sleep", slept.append)
+    breaker = CircuitBreaker(failure_threshold=10)
+    make_request, _ = scripted(http_error(429, {"Retry-After": "2"}), {"result": "0x1"})
+    retry_middleware(breaker, retries=1, backoff=0)(make_request, None)("eth_call", [])
+    assert slept == [2.0]
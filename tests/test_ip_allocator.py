@@ -0,0 +1,68 @@
+import ipaddress
+
+import pytest
+
+from dvpn.ip_allocator import AddressPoolExhausted, IPAllocator, host_prefix, parse_address
+
+
+def test_reserved_addresses_are_never_handed_out():
+    allocator = IPAllocator(["10.0.0.0/29"], reserved=["10.0.0.4"])
+    # .0 network, .1 server, .4 reserved, .7 broadcast
+    assert [str(allocator.allocate()) for _ in range(4)] == [
+        "10.0.0.2", "10.0.0.3", "10.0.0.5", "10.0.0.6"]
+    with pytest.raises(AddressPoolExhausted):
+        allocator.allocate()
+    assert allocator.capacity() == 4
+
+
+def test_released_addresses_are_reused_oldest_first():
+    allocator = IPAllocator(["10.0.0.0/24"])
+    a, b, c = (allocator.allocate() for _ in range(3))
+    assert allocator.release(b)
+    assert allocator.release(a)
+    assert not allocator.release(a)
+    assert allocator.allocate() == b
+    assert allocator.allocate() == a
+    assert allocator.allocate() == c + 1
+
+
+def test_cursor_skips_addresses_marked_used():
+    allocator = IPAllocator(["10.0.0.0/24"])
+    assert allocator.mark_used("10.0.0.2")
+    assert allocator.mark_used("10.0.0.3")
+    assert not allocator.mark_used("10.0.0.1")
+    assert not allocator.mark_used("192.168.0.2")
+    assert str(allocator.allocate()) == "10.0.0.4"
+    assert len(allocator) == 3
+
+
+def test_dual_stack_pools():
+    allocator = IPAllocator.from_env_value("10.0.0.0/30, fd00::/64")
+    assert str(allocator.allocate(6)) == "fd00::2"
+    assert str(allocator.allocate()) == "10.0.0.2"
+    # The IPv4 pool is full, so unrestricted allocations move on to IPv6
+    assert str(allocator.allocate()) == "fd00::3"
+    with pytest.raises(AddressPoolExhausted):
+        allocator.allocate(4)
+    assert allocator.prefixlen("fd00::3") == 64
+    assert allocator.prefixlen("10.0.0.2") == 30
+    assert host_prefix("10.0.0.2") == "10.0.0.2/32"
+    assert host_prefix("fd00::3") == "fd00::3/128"
+
+
+def test_parse_address_matches_ipaddress():
+    for value in ["10.0.0.2", "fd00::2", "::ffff:10.0.0.2"]:
+        assert parse_address(value) == ipaddress.ip_address(value)
+    address = ipaddress.ip_address("10.0.0.2")
+    assert parse_address(address) is address
+    with pytest.raises(ValueError):
+        parse_address("10.0.0.256")
+
+
+def test_skip_used_stops_at_the_first_free_address():
+    allocator = IPAllocator(["10.0.0.0/24"])
+    for n in [2, 3, 4, 6]:
+        allocator.mark_used(f"10.0.0.{n}")
+    allocator.skip_used()
+    assert allocator._cursors == [5]
+    assert [str(allocator.allocate()) for _ in range(2)] == ["10.0.0.5", "10.0.0.7"]
@@ -0,0 +1,156 @@
+import json
+import multiprocessing
+from collections import Counter
+
+import pytest
+
+from dvpn.ip_allocator import IPAllocator
+from dvpn.peer_store import PeerStore
+
+
+def peer(n):
+    return {"public_key": f"KEY{n}", "ip": f"10.0.0.{n}"}
+
+
+def test_journal_survives_a_restart(tmp_path):
+    store = PeerStore(tmp_path / "peers.json", fsync=False).load()
+    store.put("alice", peer(2))
+    store.put_many([("bob", peer(3)), ("carol", peer(4))])
+    store.remove("bob")
+    store.put("alice", peer(5))
+    # Nothing compacted yet: only the journal holds the changes
+    assert not (tmp_path / "peers.json").exists()
+    assert len((tmp_path / "peers.journal").read_text().splitlines()) == 5
+
+    reloaded = PeerStore(tmp_path / "peers.json").load()
+    assert dict(reloaded.items()) == {"alice": peer(5), "carol": peer(4)}
+    assert reloaded.get_by_public_key("KEY5") == ("alice", peer(5))
+    assert reloaded.get_by_ip("10.0.0.2") is None
+    assert reloaded.get_by_ip("10.0.0.3") is None
+
+
+def test_compaction_folds_the_journal_into_the_snapshot(tmp_path):
+    store = PeerStore(tmp_path / "peers.json", compact_every=3, fsync=False).load()
+    store.put("alice", peer(2))
+    store.put("bob", peer(3))
+    store.put("carol", peer(4))
+    assert json.loads((tmp_path / "peers.json").read_text()) == {
+        "alice": peer(2), "bob": peer(3), "carol": peer(4)}
+    assert (tmp_path / "peers.journal").read_text() == ""
+
+    store.remove("alice")
+    store.close()
+    # close() compacts too, keeping the historical peers.json layout
+    assert json.loads((tmp_path / "peers.json").read_text()) == {"bob": peer(3), "carol": peer(4)}
+
+
+def test_stale_journal_over_a_new_snapshot_is_harmless(tmp_path):
+    store = PeerStore(tmp_path / "peers.json", fsync=False).load()
+    store.put("alice", peer(2))
+    store.remove("alice")
+    store.put("bob", peer(3))
+    journal = (tmp_path / "peers.journal").read_text()
+    store.compact()
+    # A crash between the snapshot and journal renames leaves the old journal behind
+    (tmp_path / "peers.journal").write_text(journal)
+    assert dict(PeerStore(tmp_path / "peers.json").load().items()) == {"bob": peer(3)}
+
+
+def test_torn_journal_tail_is_discarded(tmp_path):
+    store = PeerStore(tmp_path / "peers.json", fsync=False).load()
+    store.put("alice", peer(2))
+    store._journal.close()
+    with open(tmp_path / "peers.journal", "a") as f:
+        f.write('{"op":"put","user_id":"bob","pe')
+
+    reloaded = PeerStore(tmp_path / "peers.json").load()
+    assert dict(reloaded.items()) == {"alice": peer(2)}
+    # New entries are not appended onto the torn one
+    reloaded.put("carol", peer(4))
+    assert dict(PeerStore(tmp_path / "peers.json").load().items()) == {
+        "alice": peer(2), "carol": peer(4)}
+
+
+def test_listeners_see_changes_from_another_process(tmp_path):
+    def open_store():
+        return PeerStore(tmp_path / "peers.json", compact_every=2, fsync=False,
+                         lock_path=tmp_path / "peers.lock").load()
+
+    first, second = open_store(), open_store()
+    seen = []
+    second.subscribe(lambda user_id, old, new: seen.append((user_id, old, new)))
+
+    first.put("alice", peer(2))
+    second.refresh()
+    assert seen == [("alice", None, peer(2))]
+
+    # The second put compacts, swapping in a new journal the other store must notice
+    first.put("bob", peer(3))
+    first.remove("alice")
+    second.refresh()
+    assert dict(second.items()) == {"bob": peer(3)}
+    assert seen[1:] == [("alice", peer(2), None), ("bob", None, peer(3))]
+
+
+def test_allocator_follows_the_store(tmp_path):
+    PeerStore(tmp_path / "peers.json", fsync=False).load().put("alice", peer(5))
+    store = PeerStore(tmp_path / "peers.json", fsync=False)
+    allocator = IPAllocator(["10.0.0.0/29"])
+    allocator.follow(store)
+    store.load()
+    assert allocator.is_used("10.0.0.5")
+
+    store.put("alice", peer(6))
+    assert not allocator.is_used("10.0.0.5")
+    assert allocator.is_used("10.0.0.6")
+    store.remove("alice")
+    assert len(allocator) == 0
+
+
+NETWORK = "10.0.0.0/16"
+
+
+def worker(directory, worker_id, peers):
+    store = PeerStore(directory / "peers.json", compact_every=50, fsync=False,
+                      lock_path=directory / "peers.lock")
+    allocator = IPAllocator([NETWORK])
+    allocator.follow(store)
+    store.load()
+    for i in range(peers):
+        with store.transaction():
+            ip = str(allocator.allocate())
+            store.put(f"w{worker_id}-{i}", {"public_key": f"KEY-{worker_id}-{i}", "ip": ip})
+        # Free an address now and then so reuse races with the other workers too
+        if i % 5 == 4:
+            store.remove(f"w{worker_id}-{i - 1}")
+    store.close()
+
+
+def test_workers_never_share_an_address(tmp_path):
+    if "fork" not in multiprocessing.get_all_start_methods():
+        pytest.skip("needs fork to share the test's worker function")
+    context = multiprocessing.get_context("fork")
+    workers, peers = 6, 60
+    processes = [context.Process(target=worker, args=(tmp_path, w, peers))
+                 for w in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    store = PeerStore(tmp_path / "peers.json").load()
+    ips = [record["ip"] for _, record in store.items()]
+    assert len(ips) == workers * (peers - peers // 5)
+    assert [ip for ip, count in Counter(ips).items() if count > 1] == []
+
+
+def test_files_holding_private_keys_are_owner_only(tmp_path):
+    journal = tmp_path / "peers.journal"
+    journal.write_text("")
+    journal.chmod(0o644)
+    store = PeerStore(tmp_path / "peers.json", fsync=False).load()
+    store.put("alice", dict(peer(2), private_key="secret"))
+    store.compact()
+    assert (tmp_path / "peers.json").stat().st_mode & 0o777 == 0o600
+    assert journal.stat().st_mode & 0o777 == 0o600
@@ -0,0 +1,109 @@
+import pytest
+
+from dvpn.ratelimit import Admission, MemoryRateLimiter, RateLimited, SQLiteRateLimiter
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_limiter(request, tmp_path):
+    clock = Clock()
+
+    def make(rate, burst, table="buckets"):
+        if request.param == "memory":
+            return MemoryRateLimiter(rate, burst, clock=clock)
+        return SQLiteRateLimiter(tmp_path / "ratelimit.db", rate, burst, table=table, clock=clock)
+    make.clock = clock
+    return make
+
+
+def test_bucket_refills_at_rate(make_limiter):
+    limiter = make_limiter(rate=1, burst=2)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") == pytest.approx(1)
+    # Other keys have buckets of their own
+    assert limiter.acquire("b") == 0
+    make_limiter.clock.now += 1
+    assert limiter.acquire("a") == 0
+
+
+def test_refund_restores_tokens_up_to_burst(make_limiter):
+    limiter = make_limiter(rate=1, burst=2)
+    limiter.acquire("a", 2)
+    limiter.refund("a", 1)
+    assert limiter.acquire("a") == 0
+    assert limiter.acquire("a") > 0
+    limiter.refund("a", 5)
+    assert limiter.acquire("a", 2) == 0
+    assert limiter.acquire("a") > 0
+
+
+def test_rejected_request_is_not_charged(make_limiter):
+    users = make_limiter(rate=0.1, burst=5, table="user_buckets")
+    ips = make_limiter(rate=0.1, burst=1, table="ip_buckets")
+    admission = Admission({"user": users, "ip": ips})
+    admission.acquire(user="alice", ip="198.51.100.1")
+    admission.release()
+    for _ in range(3):
+        with pytest.raises(RateLimited):
+            admission.acquire(user="alice", ip="198.51.100.1")
+    # The refusals by the ip bucket left alice's own bucket untouched
+    for n in range(2, 6):
+        admission.acquire(user="alice", ip=f"198.51.100.{n}")
+        admission.release()
+    with pytest.raises(RateLimited):
+        admission.acquire(user="alice", ip="198.51.100.6")
+    assert admission.stats()["rejected"] == {"rate": 4, "busy": 0}
+
+
+def test_busy_refusal_refunds_the_buckets():
+    users = MemoryRateLimiter(rate=0.1, burst=1, clock=Clock())
+    admission = Admission({"user": users}, max_in_flight=1)
+    admission.acquire(user="alice")
+    with pytest.raises(RateLimited) as refused:
+        admission.acquire(user="bob")
+    assert refused.value.reason == "busy"
+    admission.release()
+    admission.acquire(user="bob")
+    assert admission.in_flight == 1
+
+
+def test_trusted_addresses_skip_the_ip_bucket():
+    ips = MemoryRateLimiter(rate=0.1, burst=1, clock=Clock())
+    admission = Admission({"ip": ips}, trusted_ips=["10.8.0.0/24", " 198.51.100.7", ""])
+    for _ in range(5):
+        with admission.admit(ip="10.8.0.5"):
+            pass
+        with admission.admit(ip="198.51.100.7"):
+            pass
+    with admission.admit(ip="198.51.100.8"):
+        pass
+    with pytest.raises(RateLimited):
+        admission.acquire(ip="198.51.100.8")
+    assert not admission.is_trusted("not an address")
+
+
+def test_batch_cost_is_capped_at_the_burst():
+    ips = MemoryRateLimiter(rate=1, burst=20, clock=Clock())
+    admission = Admission({"ip": ips})
+    admission.acquire(100, ip="198.51.100.1")
+    admission.release()
+    with pytest.raises(RateLimited) as refused:
+        admission.acquire(5, ip="198.51.100.1")
+    assert refused.value.retry_after == pytest.approx(5)
+
+
+def test_limit_applies_rate_limits_without_a_slot():
+    users = MemoryRateLimiter(rate=0.1, burst=1, clock=Clock())
+    admission = Admission({"user": users}, max_in_flight=1)
+    admission.limit(user="alice")
+    assert admission.in_flight == 0
+    with pytest.raises(RateLimited):
+        admission.limit(user="alice")
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from dvpn.subscription_audit import find_lapsed_peers, is_eth_address
+
+ACTIVE = "0x" + "1" * 40
+LAPSED = "0x" + "2" * 40
+UNKNOWN = "0x" + "3" * 40
+
+
+def test_is_eth_address():
+    assert is_eth_address(ACTIVE)
+    assert not is_eth_address("alice")
+    assert not is_eth_address("0x1234")
+    assert not is_eth_address(None)
+
+
+def test_find_lapsed_peers_only_returns_definite_lapses():
+    checked = []
+
+    def check(user_ids):
+        checked.extend(user_ids)
+        return {ACTIVE: True, LAPSED: False, UNKNOWN: None}
+
+    peers = [(ACTIVE, {}), (LAPSED, {}), (UNKNOWN, {}), ("alice", {})]
+    assert find_lapsed_peers(peers, check) == [LAPSED]
+    # Non-address user ids are never sent to the chain
+    assert checked == [ACTIVE, LAPSED, UNKNOWN]
+
+
+# Against a Hardhat node with VPNSubscription deployed (see vpn-node/README.md)
+HARDHAT_RPC_URL = os.getenv("HARDHAT_RPC_URL")
+SUBSCRIPTION_CONTRACT_ADDRESS = os.getenv("SUBSCRIPTION_CONTRACT_ADDRESS")
+
+SUBSCRIBE_ABI = [{
+    "inputs": [], "name": "subscribe",
+    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+    "stateMutability": "payable", "type": "function",
+}]
+
+
+@pytest.fixture
+def chain():
+    if not HARDHAT_RPC_URL or not SUBSCRIPTION_CONTRACT_ADDRESS:
+        pytest.skip("HARDHAT_RPC_URL and SUBSCRIPTION_CONTRACT_ADDRESS are not set")
+    web3 = pytest.importorskip("web3")
+    w3 = web3.Web3(web3.Web3.HTTPProvider(HARDHAT_RPC_URL))
+    # Every change made by a test is undone afterwards
+    snapshot = w3.provider.make_request("evm_snapshot", [])["result"]
+    yield w3
+    w3.provider.make_request("evm_revert", [snapshot])
+
+
+@pytest.mark.parametrize("multicall", [False, True])
+def test_reconcile_against_hardhat(chain, multicall):
+    from eth_account import Account
+    from dvpn.abi import MULTICALL3_ADDRESS
+    from dvpn.subscription_audit import check_subscriptions
+
+    subscriber = chain.eth.accounts[1]
+    contract = chain.eth.contract(address=chain.to_checksum_address(SUBSCRIPTION_CONTRACT_ADDRESS),
+                                  abi=SUBSCRIBE_ABI)
+    tx = contract.functions.subscribe().transact({"from": subscriber, "value": 10 ** 13})
+    chain.eth.wait_for_transaction_receipt(tx)
+    never_subscribed = Account.create().address
+
+    def check(user_ids):
+        # Without Multicall3 deployed this falls back to one call per address
+        return check_subscriptions(chain, SUBSCRIPTION_CONTRACT_ADDRESS, user_ids,
+                                   batch_size=1,
+                                   multicall_address=MULTICALL3_ADDRESS if multicall else None)
+
+    peers = [(subscriber, {}), (never_subscribed, {}), ("alice", {})]
+    assert check([subscriber, never_subscribed]) == {subscriber: True, never_subscribed: False}
+    assert find_lapsed_peers(peers, check) == [never_subscribed]
+
+    # Past the 30-day subscription the subscriber lapses too
+    chain.provider.make_request("evm_increaseTime", [31 * 24 * 3600])
+    chain.provider.make_request("evm_mine", [])
+    assert sorted(find_lapsed_peers(peers, check)) == sorted([subscriber, never_subscribed])
@@ -0,0 +1,132 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+from dvpn.keys import generate_keypair
+from dvpn.wgctl import (AsyncWireGuard, CommandBackend, FakeBackend, WireGuardBackend,
+                        create_backend, iter_allowed_ips, iter_dump, parse_dump)
+
+DUMP = (
+    "privkey\tpubkey\t51820\toff\n"
+    "KEY1\t(none)\t198.51.100.7:40000\t10.0.0.2/32,fd00::2/128\t1700000000\t100\t200\t25\n"
+    "KEY2\t(none)\t(none)\t(none)\t0\t0\t0\toff\n"
+    "truncated line\n"
+)
+
+
+def test_parse_dump():
+    peers = parse_dump(DUMP)
+    assert [peer["public_key"] for peer in peers] == ["KEY1", "KEY2"]
+    assert peers[0]["endpoint"] == "198.51.100.7:40000"
+    assert peers[0]["allowed_ips"] == ["10.0.0.2/32", "fd00::2/128"]
+    assert peers[0]["latest_handshake"] == 1700000000
+    assert (peers[0]["rx_bytes"], peers[0]["tx_bytes"]) == (100, 200)
+    assert peers[1]["endpoint"] is None
+    assert peers[1]["allowed_ips"] == []
+
+
+def test_streaming_parsers_match_parse_dump():
+    assert list(iter_dump(io.StringIO(DUMP))) == parse_dump(DUMP)
+    assert list(iter_allowed_ips(io.StringIO(DUMP))) == [
+        ("KEY1", ["10.0.0.2/32", "fd00::2/128"]), ("KEY2", [])]
+
+
+def test_backend_base_is_abstract():
+    with pytest.raises(TypeError):
+        WireGuardBackend("wg0")
+
+
+def test_fake_backend_moves_allowed_ips_like_the_kernel():
+    backend = FakeBackend()
+    backend.add_peers([("A", ["10.0.0.2/32"]), ("B", ["10.0.0.3/32"])])
+    backend.add_peer("C", ["10.0.0.2/32"])
+    peers = {peer["public_key"]: peer["allowed_ips"] for peer in backend.list_peers()}
+    assert peers == {"A": [], "B": ["10.0.0.3/32"], "C": ["10.0.0.2/32"]}
+    backend.remove_peers(["A", "unknown"])
+    assert dict(backend.allowed_ips()) == {"B": ["10.0.0.3/32"], "C": ["10.0.0.2/32"]}
+    # One call per batch
+    assert backend.calls == 3
+
+
+def test_create_backend_fake(monkeypatch):
+    monkeypatch.setenv("WG_BACKEND", "fake")
+    assert isinstance(create_backend("wg1"), FakeBackend)
+    with pytest.raises(ValueError):
+        create_backend("wg1", "bogus")
+
+
+def test_command_backend_folds_batches():
+    backend = CommandBackend("wg0", chunk_size=2)
+    commands = backend._add_commands([("A", ["10.0.0.2/32"]), ("B", ["10.0.0.3/32", "fd00::3/128"]),
+                                      ("C", ["10.0.0.4/32"])])
+    assert commands == [
+        ["set", "wg0", "peer", "A", "allowed-ips", "10.0.0.2/32",
+         "peer", "B", "allowed-ips", "10.0.0.3/32,fd00::3/128"],
+        ["set", "wg0", "peer", "C", "allowed-ips", "10.0.0.4/32"],
+    ]
+    assert backend._remove_commands(["A"]) == [["set", "wg0", "peer", "A", "remove"]]
+
+
+def test_async_wireguard_on_fake_backend():
+    backend = FakeBackend()
+    wg = AsyncWireGuard(backend)
+
+    async def run():
+        await wg.add_peers([("A", ["10.0.0.2/32"])])
+        peers = await wg.list_peers()
+        await wg.remove_peers(["A"])
+        return peers
+
+    peers = asyncio.run(run())
+    assert [peer["public_key"] for peer in peers] == ["A"]
+    assert backend.list_peers() == []
+
+
+class RecordingSocket:
+    prid = 30
+    pid = 1234
+
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append(data)
+
+    def get(self):
+        return [{"header": {"error": None}}]
+
+
+def test_netlink_backend_sends_one_message_per_chunk():
+    pytest.importorskip("pyroute2")
+    from pyroute2.netlink.generic.wireguard import wgmsg
+    from dvpn.wgctl import NetlinkBackend
+
+    # Skip __init__, which opens a real generic netlink socket
+    backend = object.__new__(NetlinkBackend)
+    backend.interface = "wg0"
+    backend.chunk_size = 2
+    backend._lock = threading.Lock()
+    backend._wg = RecordingSocket()
+
+    keys = [generate_keypair()[1] for _ in range(3)]
+    backend.add_peers([(keys[0], ["10.0.0.2/32", "fd00::2/128"]), (keys[1], ["10.0.0.3/32"]),
+                       (keys[2], ["10.0.0.4/32"])])
+    backend.remove_peers(keys)
+
+    decoded = []
+    for data in backend._wg.sent:
+        msg = wgmsg(data)
+        msg.decode()
+        assert msg.get_attr("WGDEVICE_A_IFNAME") == "wg0"
+        decoded.append([(peer.get_attr("WGPEER_A_PUBLIC_KEY").decode(),
+                         peer.get_attr("WGPEER_A_FLAGS"),
+                         [ip["addr"] for ip in peer.get_attr("WGPEER_A_ALLOWEDIPS") or []])
+                        for peer in msg.get_attr("WGDEVICE_A_PEERS")])
+    assert decoded == [
+        [(keys[0], 2, ["10.0.0.2/32", "fd00::2/128"]), (keys[1], 2, ["10.0.0.3/32"])],
+        [(keys[2], 2, ["10.0.0.4/32"])],
+        [(keys[0], 1, []), (keys[1], 1, [])],
+        [(keys[2], 1, [])],
+    ]
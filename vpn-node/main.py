@@ -1,13 +1,40 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
+import asyncio
+import hashlib
+import hmac
+import io
+import json
 import os
-import subprocess
+import re
+import secrets
+import sys
+import time
+import zipfile
 from pathlib import Path
 import uuid
-from typing import Dict
-import json
 import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+# Shared helpers live in the repository-level dvpn package
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.activation import ActivationPolicy
+from dvpn.keys import KeyPool
+from dvpn.peer_store import PeerStore
+from dvpn.ip_allocator import AddressPoolExhausted, IPAllocator, host_prefix
+from dvpn.node_identity import NodeIdentity
+from dvpn.abi import MULTICALL3_ADDRESS
+from dvpn.chain import get_client
+from dvpn.ratelimit import RateLimited, admission_from_env
+from dvpn.reaper import PeerReaper, leader_lock
+from dvpn.subscription_audit import (check_subscriptions, fetch_expiries, find_lapsed_peers,
+                                     is_eth_address)
+from dvpn.metrics import instrument_fastapi, stage, timed
+from dvpn.telemetry import TelemetryCollector
+from dvpn.wgctl import AsyncWireGuard, create_backend
 
 app = FastAPI()
 
@@ -20,113 +47,705 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency histograms and GET /metrics
+instrument_fastapi(app)
+
 # WireGuard configuration
 WG_CONFIG_DIR = Path("/etc/wireguard")
 WG_INTERFACE = "wg0"
 SERVER_PRIVATE_KEY_PATH = WG_CONFIG_DIR / "private.key"
 SERVER_PUBLIC_KEY_PATH = WG_CONFIG_DIR / "public.key"
 PEERS_FILE = WG_CONFIG_DIR / "peers.json"
+PEERS_JOURNAL = WG_CONFIG_DIR / "peers.journal"
+PEERS_LOCK = WG_CONFIG_DIR / "peers.lock"
+PEERS_COMPACT_EVERY = int(os.getenv("PEERS_COMPACT_EVERY", "1000"))
+
+# Comma-separated CIDRs peers are addressed from, e.g. "10.0.0.0/16,fd00:10::/112"
+PEER_NETWORKS = os.getenv("PEER_NETWORKS", "10.0.0.0/24")
+
+# How long a discovered public IP is trusted before it is looked up again
+PUBLIC_IP_TTL = int(os.getenv("PUBLIC_IP_TTL", "3600"))
+
+# Subscription reconcile: peers keyed by an Ethereum address are removed once it lapses
+ETH_RPC_URL = os.getenv("ETH_RPC_URL")
+SUBSCRIPTION_CONTRACT_ADDRESS = os.getenv("SUBSCRIPTION_CONTRACT_ADDRESS",
+                                          "0x516Fa3Ea215c372696e6D291F00f251f49904439")
+MULTICALL_ADDRESS = os.getenv("MULTICALL_ADDRESS", MULTICALL3_ADDRESS)
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "0"))  # seconds, 0 disables
+
+# Reaper: peers are removed once their stored subscription expiry passes, or after
+# IDLE_PEER_TIMEOUT seconds without a handshake (0 disables the idle check)
+IDLE_PEER_TIMEOUT = float(os.getenv("IDLE_PEER_TIMEOUT", "0"))
+REAPER_TICK = float(os.getenv("REAPER_TICK", "5"))
+REAPER_LOCK = WG_CONFIG_DIR / "reaper.lock"
+
+# Seconds between `wg show dump` samples behind /peer-status and /peers/stats; 0 disables
+TELEMETRY_INTERVAL = float(os.getenv("TELEMETRY_INTERVAL", "10"))
+
+# Lazy mode keeps only recently active peers on wg0; the rest wait in the peer store
+# until a client calls /activate
+LAZY_PEERS = os.getenv("LAZY_PEERS", "0") == "1"
+MAX_ACTIVE_PEERS = int(os.getenv("MAX_ACTIVE_PEERS", "0"))  # 0 means no cap
+LAZY_IDLE_TIMEOUT = float(os.getenv("LAZY_IDLE_TIMEOUT", "900"))
+LAZY_EVICT_INTERVAL = float(os.getenv("LAZY_EVICT_INTERVAL", "60"))
+
+# uvicorn worker processes; peer state is coordinated between them through PEERS_LOCK
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+# Threads for blocking disk and kernel work, so handlers never stall the event loop
+IO_WORKERS = int(os.getenv("IO_WORKERS", "8"))
+
+# Largest number of peers a single /generate-peers call may create
+MAX_BATCH_PEERS = int(os.getenv("MAX_BATCH_PEERS", "1000"))
+
+# Pre-generated keypair pool
+KEYPOOL_SIZE = int(os.getenv("KEYPOOL_SIZE", "64"))
+KEYPOOL_LOW_WATER = int(os.getenv("KEYPOOL_LOW_WATER", "16"))
+
+key_pool = KeyPool(size=KEYPOOL_SIZE, low_water=KEYPOOL_LOW_WATER)
+peer_store = PeerStore(PEERS_FILE, PEERS_JOURNAL, compact_every=PEERS_COMPACT_EVERY,
+                       lock_path=PEERS_LOCK)
+ip_allocator = IPAllocator.from_env_value(PEER_NETWORKS)
+ip_allocator.follow(peer_store)
+node_identity = NodeIdentity(env_var="SERVER_ENDPOINT", ttl=PUBLIC_IP_TTL)
+io_executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="peer-io")
+# Netlink when available, `wg set` otherwise; WG_BACKEND=fake runs without WireGuard
+wg_backend = create_backend(WG_INTERFACE)
+wg = AsyncWireGuard(wg_backend, executor=io_executor)
+telemetry = TelemetryCollector(wg_backend, interval=TELEMETRY_INTERVAL)
+# Per-user and per-address token buckets plus a cap on peer requests in flight
+admission = admission_from_env()
+activation = ActivationPolicy(max_active=MAX_ACTIVE_PEERS, idle_timeout=LAZY_IDLE_TIMEOUT)
+# Created at startup in the one worker that holds REAPER_LOCK, which also evicts in lazy mode
+reaper = None
+reaper_lock = None
 
 class PeerRequest(BaseModel):
     user_id: str
 
-def load_peers() -> Dict:
-    if PEERS_FILE.exists():
-        with open(PEERS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+class BatchPeerRequest(BaseModel):
+    user_ids: List[str]
+    format: str = "ndjson"  # "ndjson" or "zip"
 
-def save_peers(peers: Dict):
-    with open(PEERS_FILE, 'w') as f:
-        json.dump(peers, f)
+async def run_io(func, *args):
+    return await asyncio.get_event_loop().run_in_executor(io_executor, func, *args)
 
 def generate_keys():
-    private_key = subprocess.check_output(["wg", "genkey"]).decode().strip()
-    public_key = subprocess.run(["wg", "pubkey"], input=private_key.encode(), 
-                              capture_output=True).stdout.decode().strip()
-    return private_key, public_key
+    with stage("keygen"):
+        return key_pool.get()
 
-@app.post("/generate-peer")
-async def generate_peer(request: PeerRequest):
-    try:
-        peers = load_peers()
-        
-        # Generate WireGuard keys for the new peer
-        private_key, public_key = generate_keys()
-        
-        # Generate unique IP for the peer (assuming 10.0.0.0/24 network)
-        used_ips = set(peer['ip'] for peer in peers.values())
-        for i in range(2, 255):
-            ip = f"10.0.0.{i}"
-            if ip not in used_ips:
-                peer_ip = ip
-                break
-        else:
-            raise HTTPException(status_code=500, detail="No available IP addresses")
+async def public_endpoint():
+    # Only blocks if the cached address has expired
+    with stage("public_ip_lookup"):
+        return await run_io(node_identity.get)
 
-        # Create peer configuration
-        peer_config = f"""[Interface]
+def render_peer_config(private_key: str, peer_ip: str, endpoint: str) -> str:
+    return f"""[Interface]
 PrivateKey = {private_key}
-Address = {peer_ip}/24
+Address = {peer_ip}/{ip_allocator.prefixlen(peer_ip)}
 DNS = 8.8.8.8, 8.8.4.4
 
 [Peer]
 PublicKey = {os.getenv('SERVER_PUBLIC_KEY')}
-Endpoint = {os.getenv('SERVER_ENDPOINT')}:51820
+Endpoint = {endpoint}:51820
 AllowedIPs = 0.0.0.0/0
 PersistentKeepalive = 25
 """
 
-        # Save peer information
-        peer_id = str(uuid.uuid4())
-        peers[request.user_id] = {
-            "id": peer_id,
-            "public_key": public_key,
-            "ip": peer_ip,
-            "created_at": str(datetime.datetime.now())
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def new_config_token():
+    """A secret handed out once with a new config; only its hash is stored"""
+    token = secrets.token_urlsafe(32)
+    return token, token_hash(token)
+
+def token_matches(stored_hash: Optional[str], token: Optional[str]) -> bool:
+    if not stored_hash or not token:
+        return False
+    return hmac.compare_digest(stored_hash, token_hash(token))
+
+def new_peer_record(private_key: str, public_key: str, peer_ip: str,
+                    config_token_hash: str) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "public_key": public_key,
+        # Kept so a repeated request can be answered with the same config, but only
+        # to a caller holding the config token returned when the peer was created
+        "private_key": private_key,
+        "config_token_hash": config_token_hash,
+        "ip": peer_ip,
+        # Subscription expiry (unix time) when the user id is a subscribed address;
+        # looked up by the reaper after the peer is created
+        "expires_at": None,
+        "created_at": str(datetime.datetime.now())
+    }
+
+# Rendered client configs by user_id; any change to a peer record (from any worker) drops its entry
+rendered_configs = {}
+peer_store.subscribe(lambda user_id, old, new: rendered_configs.pop(user_id, None))
+
+def peer_config(user_id: str, peer: dict, endpoint: str) -> Optional[str]:
+    """Config for a stored peer, or None for peers recorded without their private key"""
+    cached = rendered_configs.get(user_id)
+    if cached is not None and cached[0] == endpoint:
+        return cached[1]
+    if not peer.get("private_key"):
+        return None
+    config = render_peer_config(peer["private_key"], peer["ip"], endpoint)
+    rendered_configs[user_id] = (endpoint, config)
+    return config
+
+def reserve_peers(user_ids):
+    """Allocate keys and addresses and record new peers in one cross-worker transaction.
+
+    Returns a (peer, config_token) pair per user; users that already have a peer keep
+    it and get None as their token.
+    """
+    with peer_store.transaction():
+        existing = [peer_store.get(user_id) for user_id in user_ids]
+        new_ids = [user_id for user_id, peer in zip(user_ids, existing) if peer is None]
+        with stage("keygen"):
+            new = list(zip(new_ids, key_pool.get_many(len(new_ids))))
+        peer_ips = []
+        try:
+            with stage("ip_allocation"):
+                for _ in new:
+                    peer_ips.append(str(ip_allocator.allocate()))
+            tokens = [new_config_token() for _ in new]
+            records = [new_peer_record(private_key, public_key, peer_ip, hashed)
+                       for (_, (private_key, public_key)), peer_ip, (_, hashed)
+                       in zip(new, peer_ips, tokens)]
+            with stage("peer_store_commit"):
+                peer_store.put_many((user_id, peer) for (user_id, _), peer in zip(new, records))
+        except Exception:
+            for peer_ip in peer_ips:
+                ip_allocator.release(peer_ip)
+            raise
+    created = iter(zip(records, (token for token, _ in tokens)))
+    return [(peer, None) if peer is not None else next(created) for peer in existing]
+
+def rotate_peer_keys(user_id, keypair, idempotency_key=None):
+    """Give an existing peer a new keypair, keeping its address.
+
+    Returns (old, new, config_token), all None for an unknown user. A retry carrying the
+    idempotency key of the last rotation keeps the current keys and only gets a new
+    config token.
+    """
+    private_key, public_key = keypair
+    config_token, config_token_hash = new_config_token()
+    with peer_store.transaction():
+        old = peer_store.get(user_id)
+        if old is None:
+            return None, None, None
+        if token_matches(old.get("idempotency_key_hash"), idempotency_key):
+            peer = dict(old, config_token_hash=config_token_hash)
+        else:
+            peer = dict(old, public_key=public_key, private_key=private_key,
+                        config_token_hash=config_token_hash,
+                        idempotency_key_hash=idempotency_key and token_hash(idempotency_key),
+                        rotated_at=str(datetime.datetime.now()))
+        with stage("peer_store_commit"):
+            peer_store.put(user_id, peer)
+    return old, peer, config_token
+
+def forget_peers(user_ids):
+    """Drop peer records; their addresses return to the allocator"""
+    with stage("peer_store_commit"), peer_store.transaction():
+        return [peer_store.remove(user_id) for user_id in user_ids]
+
+def forget_peer_key(user_id, public_key):
+    """Drop a peer record unless it has been given another key in the meantime"""
+    with stage("peer_store_commit"), peer_store.transaction():
+        peer = peer_store.get(user_id)
+        if peer is not None and peer["public_key"] == public_key:
+            peer_store.remove(user_id)
+
+@timed("subscription_check")
+def check_peer_subscriptions(addresses):
+    return check_subscriptions(get_client(ETH_RPC_URL).w3, SUBSCRIPTION_CONTRACT_ADDRESS, addresses,
+                               multicall_address=MULTICALL_ADDRESS)
+
+@timed("subscription_check")
+def fetch_peer_expiries(user_ids):
+    """Subscription expiry per user id that is an Ethereum address (empty without ETH_RPC_URL)"""
+    addresses = [user_id for user_id in user_ids if is_eth_address(user_id)]
+    if not ETH_RPC_URL or not addresses:
+        return {}
+    return fetch_expiries(get_client(ETH_RPC_URL).w3, SUBSCRIPTION_CONTRACT_ADDRESS, addresses,
+                          multicall_address=MULTICALL_ADDRESS)
+
+# New peers whose subscription expiry is still to be looked up. Filled by a store
+# listener in the reaper worker, which sees every worker's peers, and drained each tick
+# so a slow RPC endpoint never delays peer creation. A peer missed here (e.g. across a
+# restart) is still caught by /reconcile.
+pending_expiries = set()
+
+def queue_expiry_lookup(user_id, old, new):
+    if old is None and new is not None and not new.get("expires_at") and is_eth_address(user_id):
+        pending_expiries.add(user_id)
+
+def fill_expiries(user_ids):
+    """Store the subscription expiry of peers created without one"""
+    expiries = fetch_peer_expiries(user_ids)
+    with stage("peer_store_commit"), peer_store.transaction():
+        updates = []
+        for user_id in user_ids:
+            peer = peer_store.get(user_id)
+            if peer is not None and not peer.get("expires_at") and expiries.get(user_id):
+                updates.append((user_id, dict(peer, expires_at=expiries[user_id])))
+        # The reaper schedules the new deadlines from the change notifications
+        peer_store.put_many(updates)
+
+def last_handshake(public_key):
+    """Latest handshake from telemetry: 0 if never, None before the first sample"""
+    status = telemetry.peer_status(public_key)
+    if status["status"] == "unknown":
+        return None
+    handshake = status.get("latest_handshake", 0)
+    if LAZY_PEERS:
+        # Evicted peers are absent from wg0 but not gone; their activity is on the record
+        found = peer_store.get_by_public_key(public_key)
+        if found is not None:
+            handshake = max(handshake, found[1].get("last_active") or 0)
+    return handshake
+
+def touch_peers(activity):
+    """Record last activity times from a {user_id: timestamp} mapping"""
+    with stage("peer_store_commit"), peer_store.transaction():
+        updates = []
+        for user_id, last_active in activity.items():
+            peer = peer_store.get(user_id)
+            if peer is not None and (peer.get("last_active") or 0) < last_active:
+                updates.append((user_id, dict(peer, last_active=last_active)))
+        peer_store.put_many(updates)
+
+async def revoke_peers(peers):
+    """Remove (user_id, peer) pairs from the kernel in one batch, then from the store"""
+    if not peers:
+        return
+    with stage("kernel_apply"):
+        await wg.remove_peers([peer["public_key"] for _, peer in peers])
+    await run_io(forget_peers, [user_id for user_id, _ in peers])
+
+async def reconcile_subscriptions(dry_run: bool = False):
+    # The chain checks run off the event loop
+    loop = asyncio.get_event_loop()
+    await run_io(peer_store.refresh)
+    lapsed = await loop.run_in_executor(
+        None, find_lapsed_peers, peer_store.items(), check_peer_subscriptions)
+    if dry_run:
+        return lapsed
+
+    peers = [(user_id, peer_store.get(user_id)) for user_id in lapsed]
+    peers = [(user_id, peer) for user_id, peer in peers if peer is not None]
+    await revoke_peers(peers)
+    return [user_id for user_id, _ in peers]
+
+async def reconcile_loop():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL)
+        try:
+            removed = await reconcile_subscriptions()
+            if removed:
+                print(f"Removed {len(removed)} peers with lapsed subscriptions")
+        except Exception as e:
+            print(f"Subscription reconcile failed: {e}")
+
+async def lookup_pending_expiries():
+    user_ids = [pending_expiries.pop() for _ in range(len(pending_expiries))]
+    try:
+        # Chain calls stay off the peer I/O pool, as in reconcile
+        await asyncio.get_event_loop().run_in_executor(None, fill_expiries, user_ids)
+    except Exception as e:
+        pending_expiries.update(user_ids)
+        print(f"Subscription expiry lookup failed, will retry: {e}")
+
+async def reaper_loop():
+    while True:
+        await asyncio.sleep(REAPER_TICK)
+        try:
+            # Pick up peers other workers added, then look only at timers that fell due
+            await run_io(peer_store.refresh)
+            if pending_expiries:
+                await lookup_pending_expiries()
+            doomed = await run_io(reaper.collect)
+        except Exception as e:
+            print(f"Peer reaper failed: {e}")
+            continue
+        if not doomed:
+            continue
+        try:
+            await revoke_peers([(user_id, peer) for user_id, peer, _ in doomed])
+            print(f"Reaped {len(doomed)} expired or idle peers")
+        except Exception as e:
+            reaper.defer([user_id for user_id, _, _ in doomed])
+            print(f"Removing reaped peers failed, will retry: {e}")
+
+async def evict_idle_peers():
+    """Take idle peers off wg0 in one batch, keeping their records"""
+    # A fresh sample, so nothing activated since the last one is mistaken for idle
+    table = await run_io(telemetry.poll)
+    await run_io(peer_store.refresh)
+    evictions = activation.select(table, peer_store.get_by_public_key)
+    if not evictions:
+        return 0
+    keys = [key for key, _ in evictions]
+    with stage("kernel_apply"):
+        await wg.remove_peers(keys)
+    activation.evicted(keys)
+    activity = {}
+    for key, last_active in evictions:
+        found = peer_store.get_by_public_key(key)
+        if found is not None:
+            activity[found[0]] = last_active
+    await run_io(touch_peers, activity)
+    return len(keys)
+
+async def eviction_loop():
+    while True:
+        await asyncio.sleep(LAZY_EVICT_INTERVAL)
+        try:
+            evicted = await evict_idle_peers()
+            if evicted:
+                print(f"Evicted {evicted} idle peers from {WG_INTERFACE}")
+        except Exception as e:
+            print(f"Idle peer eviction failed: {e}")
+
+@app.on_event("startup")
+async def startup():
+    # Loading notifies the allocator of every recorded address
+    peer_store.load()
+    key_pool.start()
+    node_identity.start()
+    telemetry.start()
+
+    # One reaper and reconcile job per node, however many workers are running
+    global reaper, reaper_lock
+    reaper_lock = leader_lock(REAPER_LOCK)
+    if reaper_lock is not None:
+        if RECONCILE_INTERVAL and ETH_RPC_URL:
+            asyncio.ensure_future(reconcile_loop())
+        reaper = PeerReaper(peer_store, idle_timeout=IDLE_PEER_TIMEOUT,
+                            last_handshake=last_handshake,
+                            refresh_expiry=fetch_peer_expiries if ETH_RPC_URL else None,
+                            tick=REAPER_TICK)
+        if ETH_RPC_URL:
+            peer_store.subscribe(queue_expiry_lookup)
+        asyncio.ensure_future(reaper_loop())
+        if LAZY_PEERS:
+            asyncio.ensure_future(eviction_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    telemetry.stop()
+    node_identity.stop()
+    key_pool.stop()
+    peer_store.close()
+    io_executor.shutdown(wait=True)
+
+def too_many_requests(e: RateLimited) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e),
+                         headers={"Retry-After": e.retry_after_header})
+
+def admit_peer_request(http_request: Request, cost: int = 1):
+    """Take an admission slot for the client address (release it when done), or answer 429.
+
+    The user_id in the body is not authenticated, so it is not charged here: anyone could
+    drain another user's bucket with it.
+    """
+    host = http_request.client.host if http_request.client else None
+    try:
+        admission.acquire(cost, ip=host)
+    except RateLimited as e:
+        raise too_many_requests(e)
+
+def limit_user(user_id: str):
+    """Per-user rate limit, for callers that have shown the peer's config token"""
+    try:
+        admission.limit(user=user_id)
+    except RateLimited as e:
+        raise too_many_requests(e)
+
+def existing_peer_response(user_id: str, peer: dict, endpoint: str,
+                           config_token: Optional[str]) -> dict:
+    """The stored config, for callers holding the token handed out with it"""
+    config = peer_config(user_id, peer, endpoint)
+    if config is None:
+        raise HTTPException(status_code=409,
+                            detail="Peer exists but its config was not kept; use /rotate-peer")
+    if not token_matches(peer.get("config_token_hash"), config_token):
+        raise HTTPException(status_code=409,
+                            detail="Peer exists; send its X-Config-Token or use /rotate-peer")
+    limit_user(user_id)
+    return {"config": config, "peer_id": peer["id"], "created": False}
+
+@app.post("/generate-peer")
+async def generate_peer(request: PeerRequest, http_request: Request,
+                        x_config_token: Optional[str] = Header(None)):
+    admit_peer_request(http_request)
+    try:
+        endpoint = await public_endpoint()
+
+        # Repeated requests for a known user get the same config back with its token
+        peer = peer_store.get(request.user_id)
+        if peer is not None:
+            return existing_peer_response(request.user_id, peer, endpoint, x_config_token)
+
+        # Generate keys, allocate a unique IP and record the peer, atomically across
+        # workers; another worker may have created it in the meantime
+        try:
+            peer, config_token = (await run_io(reserve_peers, [request.user_id]))[0]
+        except AddressPoolExhausted:
+            raise HTTPException(status_code=500, detail="No available IP addresses")
+        if config_token is None:
+            return existing_peer_response(request.user_id, peer, endpoint, x_config_token)
+
+        try:
+            # Update WireGuard configuration; like batches, lazy nodes wait for /activate
+            if not LAZY_PEERS:
+                with stage("kernel_apply"):
+                    await wg.add_peer(peer["public_key"], [host_prefix(peer["ip"])])
+        except Exception:
+            await run_io(forget_peers, [request.user_id])
+            raise
+
+        return {
+            "config": peer_config(request.user_id, peer, endpoint),
+            "peer_id": peer["id"],
+            "config_token": config_token,
+            "created": True
         }
-        save_peers(peers)
 
-        # Update WireGuard configuration
-        subprocess.run(["wg", "set", WG_INTERFACE, "peer", public_key,
-                       "allowed-ips", f"{peer_ip}/32"])
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release()
+
+@app.post("/rotate-peer")
+async def rotate_peer(request: PeerRequest, http_request: Request,
+                      idempotency_key: Optional[str] = Header(None),
+                      x_config_token: Optional[str] = Header(None)):
+    # A retry of a rotation that already happened (perhaps in another worker) only takes
+    # a slot: charging it would turn a client's retries into 429s instead of its result
+    if idempotency_key:
+        await run_io(peer_store.refresh)
+    current = peer_store.get(request.user_id)
+    replay = current is not None and token_matches(current.get("idempotency_key_hash"),
+                                                   idempotency_key)
+    admit_peer_request(http_request, cost=0 if replay else 1)
+    try:
+        if not replay and current is not None and token_matches(
+                current.get("config_token_hash"), x_config_token):
+            limit_user(request.user_id)
+        endpoint = await public_endpoint()
+        old, peer, config_token = await run_io(rotate_peer_keys, request.user_id,
+                                               generate_keys(), idempotency_key)
+        if peer is None:
+            raise HTTPException(status_code=404, detail="Peer not found")
+
+        rotated = peer["public_key"] != old["public_key"]
+        if rotated:
+            added = False
+            try:
+                # The address moves to the new key as soon as it is added
+                with stage("kernel_apply"):
+                    await wg.add_peer(peer["public_key"], [host_prefix(peer["ip"])])
+                    added = True
+                    await wg.remove_peer(old["public_key"])
+            except Exception:
+                if added:
+                    # Hand the address back to the old key so the kernel matches the store
+                    try:
+                        with stage("kernel_apply"):
+                            await wg.remove_peer(peer["public_key"])
+                            await wg.add_peer(old["public_key"], [host_prefix(old["ip"])])
+                    except Exception as e:
+                        print(f"Error rolling back key rotation for {request.user_id}: {e}")
+                await run_io(peer_store.put, request.user_id, old)
+                raise
 
         return {
-            "config": peer_config,
-            "peer_id": peer_id
+            "config": peer_config(request.user_id, peer, endpoint),
+            "peer_id": peer["id"],
+            "config_token": config_token,
+            "rotated": rotated
         }
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release()
+
+@app.post("/generate-peers")
+async def generate_peers(request: BatchPeerRequest, http_request: Request):
+    # A batch costs one request per peer from the caller's address bucket
+    admit_peer_request(http_request, cost=max(1, len(set(request.user_ids))))
+    try:
+        return await create_peers(request)
+    finally:
+        admission.release()
+
+def config_filenames(user_ids):
+    """Zip entry name per user id; ids that sanitize to the same name get a numeric suffix"""
+    filenames, used = {}, {"peers.json"}
+    for user_id in user_ids:
+        base = re.sub(r"[^A-Za-z0-9._-]", "_", user_id)
+        filename, n = f"{base}.conf", 1
+        while filename in used:
+            n += 1
+            filename = f"{base}-{n}.conf"
+        used.add(filename)
+        filenames[user_id] = filename
+    return filenames
+
+async def create_peers(request: BatchPeerRequest):
+    user_ids = list(dict.fromkeys(request.user_ids))
+    if not user_ids:
+        raise HTTPException(status_code=400, detail="user_ids must not be empty")
+    if len(user_ids) > MAX_BATCH_PEERS:
+        raise HTTPException(status_code=400,
+                            detail=f"At most {MAX_BATCH_PEERS} peers per request")
+    if request.format not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'zip'")
+
+    # Every address is allocated in one transaction, so a short pool fails the whole batch;
+    # users that already have a peer keep it, but their config is not sent again
+    try:
+        results = await run_io(reserve_peers, user_ids)
+    except AddressPoolExhausted:
+        raise HTTPException(status_code=500, detail="Not enough available IP addresses")
+    created = [(user_id, peer) for user_id, (peer, token) in zip(user_ids, results) if token]
+
+    try:
+        endpoint = await public_endpoint()
+        # One batched kernel update for the new peers; lazy nodes wait for /activate
+        if created and not LAZY_PEERS:
+            with stage("kernel_apply"):
+                await wg.add_peers([(peer["public_key"], [host_prefix(peer["ip"])])
+                                    for _, peer in created])
     except Exception as e:
+        await run_io(forget_peers, [user_id for user_id, _ in created])
         raise HTTPException(status_code=500, detail=str(e))
 
+    configs = [(user_id, peer, token, token and peer_config(user_id, peer, endpoint))
+               for user_id, (peer, token) in zip(user_ids, results)]
+
+    if request.format == "zip":
+        buffer = io.BytesIO()
+        filenames = config_filenames([user_id for user_id, _, _, config in configs if config])
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for user_id, peer, _, config in configs:
+                if config is not None:
+                    archive.writestr(filenames[user_id], config)
+            archive.writestr("peers.json", json.dumps(
+                {user_id: {"peer_id": peer["id"], "ip": peer["ip"],
+                           "file": filenames.get(user_id), "config_token": token}
+                 for user_id, peer, token, _ in configs}))
+        return Response(buffer.getvalue(), media_type="application/zip",
+                        headers={"Content-Disposition": "attachment; filename=peers.zip"})
+
+    def ndjson_lines():
+        for user_id, peer, token, config in configs:
+            yield json.dumps({"user_id": user_id, "peer_id": peer["id"], "ip": peer["ip"],
+                              "config": config, "config_token": token}) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
 @app.post("/delete-peer")
 async def delete_peer(request: PeerRequest):
     try:
-        peers = load_peers()
-        
-        # Check if the peer exists
-        if request.user_id not in peers:
+        await run_io(peer_store.refresh)
+        peer = peer_store.get(request.user_id)
+        if peer is None:
             raise HTTPException(status_code=404, detail="Peer not found")
-            
-        peer = peers[request.user_id]
-        public_key = peer["public_key"]
-        
-        # Remove peer from WireGuard
-        subprocess.run(["wg", "set", WG_INTERFACE, "peer", public_key, "remove"])
         
-        # Remove peer from our records
-        del peers[request.user_id]
-        save_peers(peers)
+        # Remove peer from WireGuard first: if that fails the record, and so its
+        # address, stays taken rather than going to a new key while the old one works
+        with stage("kernel_apply"):
+            await wg.remove_peer(peer["public_key"])
+
+        # Remove peer from our records; its address goes back to the pool
+        await run_io(forget_peer_key, request.user_id, peer["public_key"])
         
         return {"status": "success", "message": "Peer deleted successfully"}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def find_peer(user_id: str) -> Optional[dict]:
+    """A stored peer, looking again on a miss in case another worker created it"""
+    peer = peer_store.get(user_id)
+    if peer is None:
+        await run_io(peer_store.refresh)
+        peer = peer_store.get(user_id)
+    return peer
+
+@app.post("/activate")
+async def activate_peer(request: PeerRequest):
+    """Make sure a stored peer is on wg0 before its client connects"""
+    peer = await find_peer(request.user_id)
+    if peer is None:
+        raise HTTPException(status_code=404, detail="Peer not found")
+    # Fast path: installed and recently active in the latest sample, so no kernel call
+    if activation.is_warm(telemetry.snapshot(), peer):
+        return {"status": "active", "ip": peer["ip"]}
+
+    try:
+        # Recorded first so the evictor gives the client time to connect
+        await run_io(touch_peers, {request.user_id: time.time()})
+        with stage("kernel_apply"):
+            await wg.add_peer(peer["public_key"], [host_prefix(peer["ip"])])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    activation.activations += 1
+    return {"status": "activated", "ip": peer["ip"]}
+
+@app.post("/reconcile")
+async def reconcile(dry_run: bool = False):
+    if not ETH_RPC_URL:
+        raise HTTPException(status_code=503, detail="ETH_RPC_URL is not configured")
+    try:
+        lapsed = await reconcile_subscriptions(dry_run)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"dry_run": dry_run, "lapsed": lapsed}
+
+def peer_status_entry(user_id: str, peer: dict) -> dict:
+    return {"user_id": user_id, "peer_id": peer.get("id"), "ip": peer["ip"],
+            **telemetry.peer_status(peer.get("public_key"))}
+
+@app.get("/peer-status")
+async def peer_status(user_id: str):
+    # Served from the latest telemetry sample; nothing here runs `wg`
+    peer = await find_peer(user_id)
+    if peer is None:
+        raise HTTPException(status_code=404, detail="Peer not found")
+    return peer_status_entry(user_id, peer)
+
+@app.get("/peers/stats")
+async def peers_stats(connected_only: bool = False):
+    # Include the peers other workers have added or removed since this one last wrote
+    await run_io(peer_store.refresh)
+    peers = [peer_status_entry(user_id, peer) for user_id, peer in peer_store.items()]
+    if connected_only:
+        peers = [peer for peer in peers if peer["status"] == "connected"]
+    return {"summary": telemetry.stats(), "peers": peers}
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "keypool": key_pool.stats(),
+            "load": {"peers": len(peer_store), "connected": telemetry.stats().get("connected", 0)},
+            "reaper": reaper.stats() if reaper is not None else None,
+            "lazy_peers": activation.stats() if LAZY_PEERS else None,
+            "admission": admission.stats()}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS) 
\ No newline at end of file
@@ -5,6 +5,9 @@ if [ ! -f "/etc/wireguard/private.key" ]; then
     wg genkey | tee /etc/wireguard/private.key | wg pubkey > /etc/wireguard/public.key
 fi
 
+# Server tunnel address; its subnet should cover PEER_NETWORKS used by main.py
+SERVER_ADDRESS=${SERVER_ADDRESS:-10.0.0.1/24}
+
 # Read the keys
 PRIVATE_KEY=$(cat /etc/wireguard/private.key)
 PUBLIC_KEY=$(cat /etc/wireguard/public.key)
@@ -13,7 +16,7 @@ PUBLIC_KEY=$(cat /etc/wireguard/public.key)
 cat > /etc/wireguard/wg0.conf << EOF
 [Interface]
 PrivateKey = ${PRIVATE_KEY}
-Address = 10.0.0.1/24
+Address = ${SERVER_ADDRESS}
 ListenPort = 51820
 PostUp = iptables -A FORWARD -i wg0 -j ACCEPT; iptables -t nat -A POSTROUTING -o eth0 -j MASQUERADE
 PostDown = iptables -D FORWARD -i wg0 -j ACCEPT; iptables -t nat -D POSTROUTING -o eth0 -j MASQUERADE
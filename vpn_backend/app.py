@@ -1,23 +1,82 @@
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 from functools import wraps
+import io
 import jwt
 import os
+import sys
+import time
+from pathlib import Path
 from dotenv import load_dotenv
 from services.vpn_service import VPNService
 from services.auth_service import AuthService
 from services.ethereum_service import EthereumService
+from services.node_directory import NodeDirectory
+
+# Shared helpers live in the repository-level dvpn package
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.abi import REGISTRY_ABI
+from dvpn.metrics import instrument_flask, stage
+from dvpn.ratelimit import Admission, MemoryRateLimiter, admission_from_env, flask_admitted
+from dvpn.subscription_audit import is_eth_address
 
 load_dotenv()
 
 app = Flask(__name__)
-CORS(app)
+# Browsers only let scripts read response headers that are exposed
+CORS(app, expose_headers=['X-Config-Token', 'X-VPN-Node'])
+
+# Request latency histograms and GET /metrics
+instrument_flask(app)
+
+# Seconds a login token's subscription claim is trusted without asking the chain
+SUBSCRIPTION_CLAIM_TTL = int(os.getenv('SUBSCRIPTION_CLAIM_TTL', '3600'))
 
 # Initialize services
 vpn_service = VPNService()
 auth_service = AuthService()
 eth_service = EthereumService()
 
+# Per-user token buckets and a cap on peer generations in flight
+admission = admission_from_env()
+
+# Login challenges are unauthenticated, so each client address gets a few per minute
+# (0 disables the limit)
+LOGIN_CHALLENGES_PER_MINUTE = float(os.getenv('LOGIN_CHALLENGES_PER_MINUTE', '10'))
+challenge_admission = Admission({'ip': MemoryRateLimiter(
+    LOGIN_CHALLENGES_PER_MINUTE / 60, float(os.getenv('LOGIN_CHALLENGE_BURST', '5')))}
+    if LOGIN_CHALLENGES_PER_MINUTE > 0 else {})
+
+# Registry nodes and their health, used when a request does not name a node
+node_directory = NodeDirectory(
+    eth_service.chain.contract(
+        os.getenv('VPN_REGISTRY_ADDRESS', '0x103F744c4d064223AA0c6986d2465396F4F3e394'),
+        REGISTRY_ABI
+    ),
+    vpn_service,
+    top_nodes=int(os.getenv('NODE_DIRECTORY_TOP', '0')),
+    refresh_interval=float(os.getenv('NODE_REFRESH_INTERVAL', '300')),
+    health_interval=float(os.getenv('NODE_HEALTH_INTERVAL', '30')),
+    capacity=int(os.getenv('NODE_CAPACITY', '250'))
+)
+node_directory.start()
+
+def resolve_node(node_ip, user_address):
+    """The requested node, else the directory's pick for this user (None if none is up)"""
+    if node_ip:
+        return node_ip
+    # Registry reads happen in the directory's thread; this only consults what it has loaded
+    with stage('node_selection'):
+        node = node_directory.pick(user_address)
+    return node.ip if node is not None else None
+
+def subscription_active(user):
+    """Authorise from the token's subscription expiry, asking the chain only when it has none
+    or it has passed (e.g. the subscription was renewed after login)"""
+    if user.get('sub_exp', 0) > time.time():
+        return True
+    return eth_service.verify_subscription(user['address'])
+
 def require_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -29,40 +88,87 @@ def require_auth(f):
             return jsonify({'error': 'Authentication token is missing'}), 401
 
         try:
-            # Verify JWT token
+            # Verify JWT token (claims of recently seen tokens come from a cache)
             data = auth_service.verify_token(token)
             # Store user data for the route handler
             request.user = data
+            request.token = token
         except:
             return jsonify({'error': 'Invalid authentication token'}), 401
 
         return f(*args, **kwargs)
     return decorated
 
+@app.route('/api/auth/challenge', methods=['POST'])
+@flask_admitted(challenge_admission)
+def login_challenge():
+    address = (request.get_json(silent=True) or {}).get('address')
+    if not address or not is_eth_address(address):
+        return jsonify({'error': 'A valid address is required'}), 400
+    return jsonify({'message': auth_service.create_challenge(address)})
+
+@app.route('/api/auth/verify', methods=['POST'])
+def login_verify():
+    data = request.get_json(silent=True) or {}
+    try:
+        # The signature is checked locally; no RPC is involved
+        address = auth_service.verify_login(data.get('message', ''), data.get('signature', ''))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 401
+
+    # One chain read at login; protected routes then authorise from the token
+    try:
+        with stage('subscription_check'):
+            expires_at = eth_service.get_subscription_expiry(address)
+    except Exception:
+        expires_at = 0
+    # Trusted for at most SUBSCRIPTION_CLAIM_TTL, so a cancelled subscription is noticed
+    sub_exp = int(min(expires_at, time.time() + SUBSCRIPTION_CLAIM_TTL)) if expires_at else 0
+    token = auth_service.generate_token({'address': address, 'sub_exp': sub_exp})
+    return jsonify({'token': token, 'address': address, 'subscription_expires_at': int(expires_at)})
+
+@app.route('/api/auth/logout', methods=['POST'])
+@require_auth
+def logout():
+    auth_service.revoke_token(request.token)
+    return jsonify({'status': 'success'})
+
 @app.route('/api/vpn/generate-peer', methods=['POST'])
 @require_auth
+@flask_admitted(admission, lambda: request.user['address'])
 def generate_peer():
     try:
         user_address = request.user['address']
-        node_ip = request.json.get('nodeIP')
+        node_ip = resolve_node(request.json.get('nodeIP'), user_address)
 
         if not node_ip:
-            return jsonify({'error': 'Node IP is required'}), 400
+            return jsonify({'error': 'No healthy VPN node available'}), 503
 
         # Verify subscription status using Ethereum service
-        if not eth_service.verify_subscription(user_address):
+        with stage('subscription_check'):
+            active = subscription_active(request.user)
+        if not active:
             return jsonify({'error': 'No active subscription found'}), 403
 
         # Generate peer configuration
-        config_path = vpn_service.generate_peer(node_ip, user_address)
+        with stage('node_request'):
+            result = vpn_service.generate_peer_config(user_address, node_ip)
+        if not result['success']:
+            return jsonify({'error': result['error']}), 502
         
         # Send configuration file
-        return send_file(
-            config_path,
+        response = send_file(
+            io.BytesIO(result['config']),
             mimetype='application/x-wireguard-config',
             as_attachment=True,
-            download_name='wg0-client.conf'
+            download_name=result['filename']
         )
+        if result.get('config_token'):
+            response.headers['X-Config-Token'] = result['config_token']
+        # Clients send this back to /status so it asks the node holding their peer
+        response.headers['X-VPN-Node'] = node_ip
+        node_directory.remember(user_address, node_ip)
+        return response
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -72,16 +178,25 @@ def generate_peer():
 def get_vpn_status():
     try:
         user_address = request.user['address']
-        node_ip = request.args.get('nodeIP')
+        # The node that generated the config: as named by the client (nodeIP or the
+        # X-VPN-Node it was given), else as remembered here. Only without either is a
+        # node picked, which may differ if node health has changed since.
+        node_ip = resolve_node(request.args.get('nodeIP') or request.headers.get('X-VPN-Node')
+                               or node_directory.assigned(user_address), user_address)
 
         if not node_ip:
-            return jsonify({'error': 'Node IP is required'}), 400
+            return jsonify({'error': 'No healthy VPN node available'}), 503
 
-        status = vpn_service.get_peer_status(node_ip, user_address)
+        with stage('node_request'):
+            status = vpn_service.get_peer_status(user_address, node_ip)
         return jsonify(status)
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/vpn/nodes', methods=['GET'])
+def list_nodes():
+    return jsonify({'nodes': node_directory.snapshot()})
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000) 
\ No newline at end of file
@@ -1,25 +1,215 @@
 import jwt
 import os
+import re
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from eth_account import Account
+from eth_account.messages import encode_defunct
+
+def load_signing_keys():
+    """Signing keys by kid from JWT_SIGNING_KEYS ("kid:secret,kid:secret", newest first).
+
+    The legacy JWT_SECRET_KEY, when set, stays valid for tokens issued without a kid.
+    """
+    keys = OrderedDict()
+    for item in os.getenv('JWT_SIGNING_KEYS', '').split(','):
+        kid, _, secret = item.strip().partition(':')
+        if kid and secret:
+            keys[kid] = secret
+    return keys
 
 class AuthService:
+    """JWT issue and verification, plus wallet-signature login challenges.
+
+    Verified claims, revocations and login challenges are kept in this
+    process's memory: with several workers a logout only takes effect in the
+    worker that handled it, and a login must verify in the worker that issued
+    its challenge (run one worker, or route by client, until they are shared).
+    """
+
     def __init__(self):
-        self.secret_key = os.getenv('JWT_SECRET_KEY', 'your-secret-key')
+        # No default: the old 'your-secret-key' fallback let anyone mint kid-less tokens
+        self.secret_key = os.getenv('JWT_SECRET_KEY') or None
+        # New tokens are signed with the active key; every listed key still verifies,
+        # so rotating means putting a new key first and dropping the old one later
+        self.signing_keys = load_signing_keys()
+        if not self.signing_keys and self.secret_key is None:
+            # Nothing configured: tokens only last as long as this process
+            print('JWT_SIGNING_KEYS and JWT_SECRET_KEY are unset; using a random signing key')
+            self.signing_keys['ephemeral'] = secrets.token_hex(32)
+        self.active_kid = os.getenv('JWT_ACTIVE_KID') or next(iter(self.signing_keys), None)
+        if self.active_kid is not None and self.active_kid not in self.signing_keys:
+            raise ValueError(f'JWT_ACTIVE_KID {self.active_kid!r} is not in JWT_SIGNING_KEYS')
+
+        # Verified claims by token digest, kept until the token expires
+        self.cache_size = int(os.getenv('JWT_CACHE_SIZE', '10000'))
+        self._verified = OrderedDict()
+        # Revoked token ids (jti, or digest prefix for tokens without one) -> exp
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # Outstanding login challenges: nonce -> (address, message, expires_at), single use.
+        # One per address (a new one replaces it), so a flood for other addresses is the
+        # only way to push out a pending login; the route rate-limits that per client.
+        self.login_domain = os.getenv('LOGIN_DOMAIN', 'localhost:3000')
+        self.chain_id = int(os.getenv('LOGIN_CHAIN_ID', '11155111'))
+        self.challenge_ttl = int(os.getenv('LOGIN_CHALLENGE_TTL', '300'))
+        self.max_challenges = int(os.getenv('LOGIN_MAX_CHALLENGES', '100000'))
+        self._challenges = OrderedDict()
+        self._challenge_nonces = {}
+
+    @staticmethod
+    def _digest(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    @staticmethod
+    def _token_id(claims, digest):
+        return claims.get('jti') or digest[:16].hex()
+
+    def _key_for(self, token):
+        kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            if self.secret_key is None:
+                raise jwt.InvalidTokenError('Tokens without a key id are not accepted')
+            return self.secret_key
+        if kid not in self.signing_keys:
+            raise jwt.InvalidTokenError(f'Unknown signing key {kid}')
+        return self.signing_keys[kid]
 
     def verify_token(self, token):
         """Verify JWT token and return user data"""
+        digest = self._digest(token)
+        now = time.time()
+        with self._lock:
+            entry = self._verified.get(digest)
+            if entry is not None:
+                claims, expires_at = entry
+                if expires_at is not None and expires_at <= now:
+                    del self._verified[digest]
+                    raise Exception('Token has expired')
+                if self._token_id(claims, digest) in self._revoked:
+                    raise Exception('Token has been revoked')
+                self._verified.move_to_end(digest)
+                self.hits += 1
+                return dict(claims)
+            self.misses += 1
+
         try:
-            data = jwt.decode(token, self.secret_key, algorithms=['HS256'])
-            return data
+            data = jwt.decode(token, self._key_for(token), algorithms=['HS256'])
         except jwt.ExpiredSignatureError:
             raise Exception('Token has expired')
         except jwt.InvalidTokenError:
             raise Exception('Invalid token')
 
+        with self._lock:
+            if self._token_id(data, digest) in self._revoked:
+                raise Exception('Token has been revoked')
+            self._verified[digest] = (data, data.get('exp'))
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+        return dict(data)
+
+    def revoke_token(self, token):
+        """Reject a token from now on, however long it has left (in this process only)"""
+        data = self.verify_token(token)
+        digest = self._digest(token)
+        now = time.time()
+        with self._lock:
+            # Entries are only needed until the token would have expired anyway
+            self._revoked = {token_id: exp for token_id, exp in self._revoked.items()
+                             if exp is None or exp > now}
+            self._revoked[self._token_id(data, digest)] = data.get('exp')
+            self._verified.pop(digest, None)
+
+    def retire_key(self, kid):
+        """Stop accepting tokens signed with `kid`"""
+        with self._lock:
+            self.signing_keys.pop(kid, None)
+            if self.active_kid == kid:
+                self.active_kid = next(iter(self.signing_keys), None)
+            # Cached claims do not record their key, so start over
+            self._verified.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._verified), 'revoked': len(self._revoked),
+                    'hits': self.hits, 'misses': self.misses,
+                    'keys': list(self.signing_keys), 'active_kid': self.active_kid}
+
+    def create_challenge(self, address):
+        """Sign-In with Ethereum (EIP-4361) message for the wallet to sign"""
+        nonce = secrets.token_hex(16)
+        issued_at = datetime.utcnow()
+        expires_at = issued_at + timedelta(seconds=self.challenge_ttl)
+        message = (
+            f"{self.login_domain} wants you to sign in with your Ethereum account:\n"
+            f"{address}\n\n"
+            f"Sign in to the dVPN backend.\n\n"
+            f"URI: https://{self.login_domain}\n"
+            f"Version: 1\n"
+            f"Chain ID: {self.chain_id}\n"
+            f"Nonce: {nonce}\n"
+            f"Issued At: {issued_at.isoformat(timespec='seconds')}Z\n"
+            f"Expiration Time: {expires_at.isoformat(timespec='seconds')}Z"
+        )
+        now = time.time()
+        with self._lock:
+            previous = self._challenge_nonces.get(address.lower())
+            if previous is not None:
+                self._drop_challenge(previous)
+            # Challenges are issued in order, so the expired ones are at the front
+            while self._challenges and (len(self._challenges) >= self.max_challenges
+                                        or next(iter(self._challenges.values()))[2] <= now):
+                self._drop_challenge(next(iter(self._challenges)))
+            self._challenges[nonce] = (address.lower(), message, now + self.challenge_ttl)
+            self._challenge_nonces[address.lower()] = nonce
+        return message
+
+    def _drop_challenge(self, nonce):
+        """Forget a challenge (called with the lock held); returns it, or None if unknown"""
+        challenge = self._challenges.pop(nonce, None)
+        if challenge is not None and self._challenge_nonces.get(challenge[0]) == nonce:
+            del self._challenge_nonces[challenge[0]]
+        return challenge
+
+    def verify_login(self, message, signature):
+        """Check a signed challenge locally and return the signing address"""
+        match = re.search(r'^Nonce: (\w+)$', message, re.MULTILINE)
+        with self._lock:
+            challenge = self._challenges.get(match.group(1)) if match else None
+        if challenge is None:
+            raise Exception('Unknown or already used challenge')
+        address, expected, expires_at = challenge
+        if message != expected or expires_at <= time.time():
+            raise Exception('Challenge has expired or was altered')
+        try:
+            signer = Account.recover_message(encode_defunct(text=message), signature=signature)
+        except Exception:
+            raise Exception('Invalid signature')
+        if signer.lower() != address:
+            raise Exception('Signature does not match the address')
+        # Consumed only once the signature checks out, so a bad attempt cannot burn it
+        with self._lock:
+            if self._drop_challenge(match.group(1)) is None:
+                raise Exception('Unknown or already used challenge')
+        return signer
+
     def generate_token(self, user_data):
         """Generate a new JWT token"""
         payload = {
             **user_data,
+            'jti': secrets.token_hex(8),
             'exp': datetime.utcnow() + timedelta(days=1)
         }
-        return jwt.encode(payload, self.secret_key, algorithm='HS256') 
\ No newline at end of file
+        if self.active_kid is None:
+            if self.secret_key is None:
+                raise Exception('No JWT signing key is configured')
+            return jwt.encode(payload, self.secret_key, algorithm='HS256')
+        return jwt.encode(payload, self.signing_keys[self.active_kid], algorithm='HS256',
+                          headers={'kid': self.active_kid})
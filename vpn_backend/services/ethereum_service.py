@@ -1,11 +1,21 @@
 from web3 import Web3
 import os
+import sys
 import json
+from pathlib import Path
+
+# Shared helpers live in the repository-level dvpn package
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from dvpn.abi import MULTICALL3_ADDRESS
+from dvpn.chain import get_client
+from dvpn.subscription_audit import check_subscriptions, fetch_expiries
+from dvpn.subscription_cache import SubscriptionCache
 
 class EthereumService:
     def __init__(self):
-        # Initialize Web3 with Sepolia provider
-        self.w3 = Web3(Web3.HTTPProvider(os.getenv('ETH_RPC_URL')))
+        # Share one pooled, retrying Sepolia connection across the process
+        self.chain = get_client(os.getenv('ETH_RPC_URL'))
+        self.w3 = self.chain.w3
         
         # Load contract ABI and address
         self.contract_address = os.getenv('SUBSCRIPTION_CONTRACT_ADDRESS')
@@ -14,23 +24,41 @@ class EthereumService:
             self.contract_abi = contract_json['abi']
         
         # Initialize contract
-        self.contract = self.w3.eth.contract(
-            address=self.contract_address,
-            abi=self.contract_abi
-        )
+        self.contract = self.chain.contract(self.contract_address, self.contract_abi)
+
+        # Answer repeat checks locally until the subscription expires
+        self.subscription_cache = SubscriptionCache(self.w3, self.contract_address)
+        self.subscription_cache.start()
 
     def verify_subscription(self, user_address):
         """Verify if user has an active subscription"""
         try:
-            # Call your existing subscription check function
-            has_subscription = self.contract.functions.hasActiveSubscription(
-                user_address
-            ).call()
-            
-            return has_subscription
+            return self.subscription_cache.is_active(user_address)
         except Exception as e:
             raise Exception(f"Failed to verify subscription: {str(e)}")
 
+    def verify_subscriptions(self, user_addresses, batch_size=500, max_workers=4):
+        """Verify many addresses at once; maps each to True/False, or None if its check failed"""
+        try:
+            return check_subscriptions(
+                self.w3,
+                self.contract_address,
+                user_addresses,
+                batch_size=batch_size,
+                max_workers=max_workers,
+                multicall_address=os.getenv('MULTICALL_ADDRESS', MULTICALL3_ADDRESS)
+            )
+        except Exception as e:
+            raise Exception(f"Failed to verify subscriptions: {str(e)}")
+
+    def get_subscription_expiry(self, user_address):
+        """Unix time the user's subscription ends, or 0 without one"""
+        expiry = fetch_expiries(self.w3, self.contract_address, [user_address],
+                                multicall_address=None).get(user_address)
+        if expiry is None:
+            raise Exception('Failed to read subscription expiry')
+        return expiry
+
     def get_subscription_details(self, user_address):
         """Get detailed subscription information"""
         try:
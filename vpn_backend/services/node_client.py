@@ -0,0 +1,255 @@
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+try:
+    import aiohttp
+except ImportError:  # only the async client needs it (web3 installs it)
+    aiohttp = None
+
+# Gateway errors from a node behind a proxy are worth another try
+RETRY_STATUSES = {502, 503, 504}
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+
+def backoff(attempt: int, base: float, cap: float = 2.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def is_idempotent(method: str, headers: Optional[Dict]) -> bool:
+    """Reads, and writes carrying an Idempotency-Key, can be sent more than once"""
+    return method.upper() in SAFE_METHODS or bool(headers and headers.get('Idempotency-Key'))
+
+
+class NodeClient:
+    """Keep-alive HTTP sessions to VPN nodes with one bounded pool per node.
+
+    A node gets at most `max_connections` connections; further requests wait
+    for one to free up. Every request has a (connect, read) `timeout`.
+    Transport failures and gateway errors are retried with jittered backoff,
+    except that a non-idempotent request is only retried when it never
+    reached the node (connect timeout). `get(..., hedge=True)` sends a second
+    copy of a read that has not answered within `hedge_after` seconds and
+    returns whichever answers first.
+    """
+
+    def __init__(self, max_connections: int = 10, timeout: Tuple[float, float] = (3.05, 10),
+                 retries: int = 2, backoff: float = 0.2, hedge_after: float = 0.3,
+                 verify=True, headers: Optional[Dict] = None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.verify = verify
+        self.headers = dict(headers or {})
+        self._sessions: Dict[str, requests.Session] = {}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=4 * max_connections,
+                                              thread_name_prefix='node-hedge')
+        # Updated from request threads and the hedge pool
+        self._counters_lock = threading.Lock()
+        self.counters = {'requests': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    def _count(self, name: str):
+        with self._counters_lock:
+            self.counters[name] += 1
+
+    def session(self, url: str) -> requests.Session:
+        """The pooled session for the node serving `url`"""
+        key = origin(url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                session.verify = self.verify
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_connections,
+                                      pool_block=True, max_retries=0)
+                session.mount(key, adapter)
+                self._sessions[key] = session
+            return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = is_idempotent(method, kwargs.get('headers'))
+        session = self.session(url)
+        attempt = 0
+        while True:
+            self._count('requests')
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                reason = getattr(e.args[0], 'reason', None) if e.args else None
+                never_sent = (isinstance(e, requests.exceptions.ConnectTimeout)
+                              or isinstance(reason, NewConnectionError))
+                if attempt >= self.retries or not (idempotent or never_sent):
+                    raise
+            else:
+                if (response.status_code not in RETRY_STATUSES or not idempotent
+                        or attempt >= self.retries):
+                    return response
+                response.close()
+            time.sleep(backoff(attempt, self.backoff))
+            attempt += 1
+            self._count('retries')
+
+    def get(self, url: str, hedge: bool = False, **kwargs) -> requests.Response:
+        if not hedge or not self.hedge_after:
+            return self.request('GET', url, **kwargs)
+        first = self._hedge_pool.submit(self.request, 'GET', url, **kwargs)
+        done, _ = wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        self._count('hedges')
+        second = self._hedge_pool.submit(self.request, 'GET', url, **kwargs)
+        pending, error = {first, second}, None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if future is second:
+                    self._count('hedge_wins')
+                return response
+        raise error
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+        self._hedge_pool.shutdown(wait=False)
+
+
+class NodeResponse:
+    """Status, headers and body of a completed async request"""
+
+    def __init__(self, status_code: int, headers, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise NodeRequestError(f"Node returned HTTP {self.status_code}", self)
+
+
+class NodeRequestError(Exception):
+    def __init__(self, message: str, response: Optional[NodeResponse] = None):
+        super().__init__(message)
+        self.response = response
+
+
+class AsyncNodeClient:
+    """asyncio counterpart of NodeClient on one aiohttp session.
+
+    The connector allows `max_connections` per node; the session is created
+    on first use inside the running event loop.
+    """
+
+    def __init__(self, max_connections: int = 10, timeout: Tuple[float, float] = (3.05, 10),
+                 retries: int = 2, backoff: float = 0.2, hedge_after: float = 0.3,
+                 verify=True, headers: Optional[Dict] = None):
+        if aiohttp is None:
+            raise RuntimeError('aiohttp is required for the async node client')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.verify = verify
+        self.headers = dict(headers or {})
+        self._session = None
+        # Only touched from the event loop, so no lock
+        self.counters = {'requests': 0, 'retries': 0, 'hedges': 0, 'hedge_wins': 0}
+
+    def session(self):
+        if self._session is None or self._session.closed:
+            connect, read = self.timeout
+            connector = aiohttp.TCPConnector(limit_per_host=self.max_connections,
+                                             ssl=None if self.verify else False)
+            self._session = aiohttp.ClientSession(
+                connector=connector, headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read))
+        return self._session
+
+    async def request(self, method: str, url: str, **kwargs) -> NodeResponse:
+        idempotent = is_idempotent(method, kwargs.get('headers'))
+        attempt = 0
+        while True:
+            self.counters['requests'] += 1
+            try:
+                async with self.session().request(method, url, **kwargs) as response:
+                    result = NodeResponse(response.status, response.headers,
+                                          await response.read())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                never_sent = isinstance(e, aiohttp.ClientConnectorError)
+                if attempt >= self.retries or not (idempotent or never_sent):
+                    raise
+            else:
+                if (result.status_code not in RETRY_STATUSES or not idempotent
+                        or attempt >= self.retries):
+                    return result
+            await asyncio.sleep(backoff(attempt, self.backoff))
+            attempt += 1
+            self.counters['retries'] += 1
+
+    async def get(self, url: str, hedge: bool = False, **kwargs) -> NodeResponse:
+        if not hedge or not self.hedge_after:
+            return await self.request('GET', url, **kwargs)
+        first = asyncio.ensure_future(self.request('GET', url, **kwargs))
+        done, _ = await asyncio.wait([first], timeout=self.hedge_after)
+        if done:
+            return first.result()
+
+        self.counters['hedges'] += 1
+        second = asyncio.ensure_future(self.request('GET', url, **kwargs))
+        pending, error = {first, second}, None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        error = future.exception()
+                        continue
+                    if future is second:
+                        self.counters['hedge_wins'] += 1
+                    return future.result()
+            raise error
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def post(self, url: str, **kwargs) -> NodeResponse:
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
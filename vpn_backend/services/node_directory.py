@@ -0,0 +1,193 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def rendezvous_weight(user_address: str, node_address: str) -> int:
+    """Highest-random-weight hash: each user ranks the nodes in a fixed, user-specific order"""
+    digest = hashlib.blake2b(f"{user_address.lower()}:{node_address.lower()}".encode(),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class Node:
+    """A registry node and what the health checks have seen of it"""
+
+    def __init__(self, address: str, ip: str, score: int):
+        self.address = address
+        self.ip = ip
+        self.score = score
+        self.healthy: Optional[bool] = None  # None until the first check
+        self.latency: Optional[float] = None  # smoothed seconds
+        self.connected = 0
+        self.failures = 0
+        self.error: Optional[str] = None
+        self.checked_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        return {'address': self.address, 'ip': self.ip, 'score': self.score,
+                'healthy': self.healthy, 'latency_ms': None if self.latency is None
+                else round(self.latency * 1000, 1), 'connected': self.connected,
+                'failures': self.failures, 'error': self.error}
+
+
+class NodeDirectory:
+    """Active VPNRegistry nodes with live health, and which node a user should get.
+
+    The node list comes from `getTopNodes(top_nodes)` (or `getActiveNodes`
+    when `top_nodes` is 0) and is re-read every `refresh_interval` seconds.
+    Every `health_interval` seconds all nodes are probed concurrently on
+    GET /health, keeping a smoothed latency and the connected-peer load they
+    report. `pick()` takes the healthy nodes whose cost (latency scaled by
+    load) is within `slack` (or 25 ms) of the best and chooses among them by
+    rendezvous hashing of the user address, so users spread over the good
+    nodes and keep landing on the same one while it stays healthy.
+
+    `pick()` never talks to the chain: until the background thread has
+    loaded the registry it returns None. The node that generated a user's
+    config is remembered with `remember()`; like the health data this is
+    per process.
+    """
+
+    def __init__(self, registry, vpn_service, top_nodes: int = 0,
+                 refresh_interval: float = 300, health_interval: float = 30,
+                 capacity: int = 250, slack: float = 1.5, probe_timeout: float = 2,
+                 max_workers: int = 16):
+        self.registry = registry
+        self.vpn_service = vpn_service
+        self.top_nodes = top_nodes
+        self.refresh_interval = refresh_interval
+        self.health_interval = health_interval
+        self.capacity = capacity
+        self.slack = slack
+        self.probe_timeout = probe_timeout
+        self._nodes: Dict[str, Node] = {}
+        self._loaded_at: Optional[float] = None
+        # user address -> IP of the node that generated their config
+        self._assignments: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='node-health')
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Re-read the node list from the registry, keeping the health of known nodes"""
+        functions = self.registry.functions
+        scores = {}
+        if self.top_nodes:
+            try:
+                addresses, top_scores = functions.getTopNodes(self.top_nodes).call()
+                scores = dict(zip(addresses, top_scores))
+            except Exception as e:
+                # getTopNodes reverts when no node is active
+                logger.info("getTopNodes failed (%s), reading all active nodes", e)
+                addresses = functions.getActiveNodes().call()
+        else:
+            addresses = functions.getActiveNodes().call()
+        details = list(self._pool.map(lambda address: functions.getNodeDetails(address).call(),
+                                      addresses))
+
+        with self._lock:
+            nodes = {}
+            for address, (ip, _, score, *_) in zip(addresses, details):
+                node = self._nodes.get(address) or Node(address, ip, score)
+                node.ip, node.score = ip, scores.get(address, score)
+                nodes[address] = node
+            self._nodes = nodes
+            self._loaded_at = time.monotonic()
+        logger.info("Loaded %d VPN nodes from the registry", len(nodes))
+
+    def check_health(self):
+        """Probe every node at once"""
+        list(self._pool.map(self._probe, self.nodes()))
+
+    def _probe(self, node: Node):
+        url = f"{self.vpn_service.node_url(node.ip)}/health"
+        started = time.perf_counter()
+        try:
+            response = self.vpn_service.client.get(url, timeout=self.probe_timeout)
+            response.raise_for_status()
+            load = response.json().get('load') or {}
+        except Exception as e:
+            with self._lock:
+                node.healthy = False
+                node.failures += 1
+                node.error = str(e)
+                node.checked_at = time.monotonic()
+            return
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            node.latency = elapsed if node.latency is None else 0.7 * node.latency + 0.3 * elapsed
+            node.connected = load.get('connected', 0)
+            node.healthy = True
+            node.failures = 0
+            node.error = None
+            node.checked_at = time.monotonic()
+
+    def cost(self, node: Node) -> float:
+        return (node.latency or 0) * (1 + node.connected / self.capacity)
+
+    def nodes(self) -> List[Node]:
+        with self._lock:
+            return list(self._nodes.values())
+
+    def remember(self, user_address: str, node_ip: str):
+        """Record the node that now holds `user_address`'s peer"""
+        with self._lock:
+            self._assignments[user_address.lower()] = node_ip
+
+    def assigned(self, user_address: str) -> Optional[str]:
+        """IP of the node that generated `user_address`'s config, if this process saw it"""
+        with self._lock:
+            return self._assignments.get(user_address.lower())
+
+    def pick(self, user_address: str) -> Optional[Node]:
+        """The node to serve `user_address`, or None if no node is usable
+        (including before the first registry load has finished)"""
+        with self._lock:
+            candidates = [node for node in self._nodes.values() if node.healthy]
+            if not candidates:
+                # Nothing checked yet: every node not known to be down is fair game
+                candidates = [node for node in self._nodes.values() if node.healthy is None]
+            if not candidates:
+                return None
+            costs = {node.address: self.cost(node) for node in candidates}
+        best = min(costs.values())
+        # The absolute margin keeps a few ms of jitter from moving users between fast nodes
+        limit = max(best * self.slack, best + 0.025)
+        candidates = [node for node in candidates if costs[node.address] <= limit]
+        return max(candidates, key=lambda node: rendezvous_weight(user_address, node.address))
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            return [node.to_dict() for node in self._nodes.values()]
+
+    def start(self):
+        """Refresh and health-check in the background"""
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='node-directory', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if (self._loaded_at is None
+                        or time.monotonic() - self._loaded_at >= self.refresh_interval):
+                    self.refresh()
+                self.check_health()
+            except Exception as e:
+                logger.warning("Node directory update failed: %s", e)
+            self._stopped.wait(self.health_interval)
@@ -1,6 +1,10 @@
+import asyncio
 import os
 import requests
 from typing import Optional, Dict, Any
+from urllib.parse import urlsplit
+
+from .node_client import AsyncNodeClient, NodeClient, NodeRequestError, aiohttp
 
 class VPNService:
     def __init__(self):
@@ -9,35 +13,66 @@ class VPNService:
         self.headers = {'X-API-Key': self.api_key}
         self.verify_ssl = False  # For development. In production, use proper SSL certificates
 
-    def generate_peer_config(self, user_address: str) -> Dict[str, Any]:
+        # Keep-alive connections shared by all requests, bounded per node
+        options = dict(
+            max_connections=int(os.getenv('NODE_MAX_CONNECTIONS', '10')),
+            timeout=(float(os.getenv('NODE_CONNECT_TIMEOUT', '3.05')),
+                     float(os.getenv('NODE_READ_TIMEOUT', '10'))),
+            retries=int(os.getenv('NODE_RETRIES', '2')),
+            hedge_after=float(os.getenv('NODE_HEDGE_AFTER', '0.3')),
+            verify=self.verify_ssl,
+            headers=self.headers
+        )
+        self.client = NodeClient(**options)
+        self.async_client = AsyncNodeClient(**options) if aiohttp is not None else None
+
+    def node_url(self, node: Optional[str] = None) -> str:
+        """Base URL of a node given by IP/host (scheme and port from VPN_NODE_API_URL) or URL"""
+        if not node:
+            return self.vpn_api_url
+        if '://' in node:
+            return node.rstrip('/')
+        default = urlsplit(self.vpn_api_url)
+        port = f":{default.port}" if default.port else ''
+        return f"{default.scheme}://{node}{port}"
+
+    def _generate_request(self, user_address: str, node: Optional[str]):
+        # No Idempotency-Key: the node does not deduplicate on it, so a retried POST
+        # could create a second peer. It is only retried when it never reached the node.
+        return (f"{self.node_url(node)}/generate-peer",
+                {'json': {'eth_address': user_address}})
+
+    @staticmethod
+    def _config_result(response) -> Dict[str, Any]:
+        return {
+            'success': True,
+            'config': response.content,
+            'filename': 'wg0-client.conf',
+            # Needed to download the config again from the node
+            'config_token': response.headers.get('X-Config-Token')
+        }
+
+    def generate_peer_config(self, user_address: str, node: Optional[str] = None) -> Dict[str, Any]:
         """Generate a new WireGuard peer configuration for a user."""
         try:
-            response = requests.post(
-                f"{self.vpn_api_url}/generate-peer",
-                json={'user_address': user_address},
-                headers=self.headers,
-                verify=self.verify_ssl
-            )
+            url, kwargs = self._generate_request(user_address, node)
+            response = self.client.post(url, **kwargs)
             response.raise_for_status()
-            return {
-                'success': True,
-                'config': response.content,
-                'filename': 'wg0-client.conf'
-            }
+            return self._config_result(response)
         except requests.RequestException as e:
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    def get_peer_status(self, user_address: str) -> Dict[str, Any]:
+    def get_peer_status(self, user_address: str, node: Optional[str] = None) -> Dict[str, Any]:
         """Get the connection status of a peer."""
         try:
-            response = requests.get(
-                f"{self.vpn_api_url}/peer-status",
+            # Status reads are hedged: a slow first attempt gets a second one in parallel
+            response = self.client.get(
+                f"{self.node_url(node)}/peer-status",
                 params={'user_address': user_address},
-                headers=self.headers,
-                verify=self.verify_ssl
+                hedge=True
             )
             response.raise_for_status()
             return response.json()
@@ -45,4 +80,35 @@ class VPNService:
             return {
                 'status': 'error',
                 'error': str(e)
-            } 
\ No newline at end of file
+            }
+
+    async def generate_peer_config_async(self, user_address: str,
+                                         node: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of generate_peer_config."""
+        try:
+            url, kwargs = self._generate_request(user_address, node)
+            response = await self.async_client.post(url, **kwargs)
+            response.raise_for_status()
+            return self._config_result(response)
+        except (NodeRequestError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {
+                'success': False,
+                'error': str(e) or type(e).__name__
+            }
+
+    async def get_peer_status_async(self, user_address: str,
+                                    node: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of get_peer_status."""
+        try:
+            response = await self.async_client.get(
+                f"{self.node_url(node)}/peer-status",
+                params={'user_address': user_address},
+                hedge=True
+            )
+            response.raise_for_status()
+            return response.json()
+        except (NodeRequestError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return {
+                'status': 'error',
+                'error': str(e) or type(e).__name__
+            }
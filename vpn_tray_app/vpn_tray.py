@@ -5,6 +5,7 @@ import asyncio
 import logging
 import re
 import subprocess
+import urllib.request
 from pathlib import Path
 from typing import Optional, Dict
 
@@ -69,7 +70,8 @@ class VPNTrayApp:
                         config = data.get('config')
                         filename = data.get('filename')
                         if config and filename:
-                            await self.handle_connect(websocket, config, filename)
+                            await self.handle_connect(websocket, config, filename,
+                                                      data.get('node_url'), data.get('user_id'))
                     
                     elif command == 'disconnect':
                         await self.handle_disconnect(websocket)
@@ -89,9 +91,26 @@ class VPNTrayApp:
         except websockets.exceptions.ConnectionClosed:
             logger.info("WebSocket connection closed")
 
-    async def handle_connect(self, websocket: WebSocketServerProtocol, config: str, filename: str):
+    def activate_peer(self, node_url: str, user_id: str) -> Dict:
+        """Ask a lazy node to install our peer before the tunnel comes up"""
+        request = urllib.request.Request(
+            f"{node_url.rstrip('/')}/activate",
+            data=json.dumps({'user_id': user_id}).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return json.loads(response.read())
+
+    async def handle_connect(self, websocket: WebSocketServerProtocol, config: str, filename: str,
+                             node_url: Optional[str] = None, user_id: Optional[str] = None):
         """Handle VPN connection request"""
         try:
+            if node_url and user_id:
+                result = await asyncio.get_event_loop().run_in_executor(
+                    None, self.activate_peer, node_url, user_id)
+                logger.info(f"Peer activation on {node_url}: {result.get('status')}")
+
             # Sanitize the filename
             base_name = Path(filename).stem
             sanitized_name = self.sanitize_tunnel_name(base_name)
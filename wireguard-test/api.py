@@ -1,31 +1,24 @@
 from flask import Flask, send_file, jsonify
-import subprocess
-import os
-from pathlib import Path
+
+# Peer generation runs in this process rather than through `python3 generate_peer.py`
+from generate_peer import create_peer, load_peer_index
 
 app = Flask(__name__)
 
+# Build the address index now rather than on the first request
+try:
+    load_peer_index()
+except Exception as e:
+    print(f"Failed to load peer index: {e}")
+
 @app.route('/generate-peer', methods=['POST'])
 def generate_peer():
     try:
-        # Run the generate_peer.py script
-        result = subprocess.run(['python3', 'generate_peer.py'], 
-                             capture_output=True, 
-                             text=True)
-        
-        if result.returncode != 0:
-            return jsonify({'error': result.stderr}), 500
-
-        # Parse output to find the config file path
-        for line in result.stdout.split('\n'):
-            if 'Configuration saved to:' in line:
-                config_path = line.split('Configuration saved to:')[1].strip()
-                return send_file(config_path, 
-                               mimetype='application/x-wireguard-config',
-                               as_attachment=True,
-                               download_name='wg0-client.conf')
-        
-        return jsonify({'error': 'Config file not found'}), 500
+        peer = create_peer()
+        return send_file(str(peer['config_path'].resolve()),
+                         mimetype='application/x-wireguard-config',
+                         as_attachment=True,
+                         download_name='wg0-client.conf')
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
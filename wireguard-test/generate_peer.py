@@ -2,69 +2,298 @@
 
 import os
 import sys
-import subprocess
-import json
 import argparse
+import ipaddress
+import re
+import threading
+import time
 from pathlib import Path
-import random
 
-def run_command(command):
-    """Run a shell command and return its output"""
-    try:
-        result = subprocess.run(command, shell=True, check=True, capture_output=True, text=True)
-        return result.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"Error running command: {command}")
-        print(f"Error output: {e.stderr}")
-        sys.exit(1)
+# Shared helpers live in the repository-level dvpn package
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from dvpn.ip_allocator import AddressPoolExhausted, IPAllocator, host_prefix
+from dvpn.keys import generate_keypair
+from dvpn.node_identity import NodeIdentity
+from dvpn.peer_store import PeerStore
+from dvpn.wgctl import create_backend
+
+SERVER_PUBLIC_KEY_PATH = Path("/etc/wireguard/public.key")
+# Next to this script, wherever the CLI or api.py is started from
+OUTPUT_DIR = Path(__file__).resolve().parent / "output"
+
+# --user ends up in a file name, so only plain identifiers (e.g. an eth address) are allowed
+USER_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,128}")
+
+# Peer address pools (IPv4 and/or IPv6 CIDRs); the first host of each is the server
+PEER_NETWORKS = os.getenv("PEER_NETWORKS", "10.0.0.0/24")
+# Seconds before the address index is rebuilt in the background from `wg show dump`,
+# to see peers added to wg0 by anything other than this script
+PEER_INDEX_MAX_AGE = float(os.getenv("PEER_INDEX_MAX_AGE", "300"))
+# Addresses this script hands out, shared (under a file lock) by the CLI and every
+# api.py worker so none of them can give out an address another one just took
+PEER_STORE_PATH = Path(os.getenv("PEER_STORE_PATH", "/etc/wireguard/test-peers.json"))
+
+# Cache the discovered public IP between runs instead of asking ifconfig.me each time
+node_identity = NodeIdentity(cache_path=OUTPUT_DIR / ".public_ip")
+
+# Netlink when pyroute2 is installed, otherwise `wg` (WG_BACKEND overrides)
+backend = create_backend("wg0")
+
+# Choosing an address and adding the peer must not interleave between threads
+_lock = threading.Lock()
+_server_public_key = None
+_peer_store = None
+_peer_index = None
+# An index being rebuilt; store changes are applied to it as well until it is swapped in
+_pending_index = None
+_peer_index_loaded_at = 0.0
+_refresh_lock = threading.Lock()
+
+class PeerGenerationError(Exception):
+    """Raised when a peer cannot be created"""
 
 def get_server_info():
     """Get server's public key and public IP"""
-    public_key = run_command("cat /etc/wireguard/public.key")
-    public_ip = run_command("curl -s ifconfig.me")
-    return public_key, public_ip
+    global _server_public_key
+    if _server_public_key is None:
+        try:
+            _server_public_key = SERVER_PUBLIC_KEY_PATH.read_text().strip()
+        except OSError as e:
+            raise PeerGenerationError(f"Could not read the server public key: {e}")
+    public_ip = node_identity.get()
+    if not public_ip:
+        raise PeerGenerationError("Could not determine the server's public IP; set SERVER_ENDPOINT")
+    return _server_public_key, public_ip
 
 def generate_peer_keys():
     """Generate private and public keys for a peer"""
-    private_key = run_command("wg genkey")
-    public_key = run_command(f"echo '{private_key}' | wg pubkey")
-    return private_key, public_key
+    return generate_keypair()
+
+def build_peer_index(peers, index=None):
+    """Address index over PEER_NETWORKS with every allowed IP in `peers` marked used.
+
+    `peers` yields (public_key, allowed_ips) pairs, e.g. `backend.allowed_ips()`.
+    """
+    if index is None:
+        index = IPAllocator.from_env_value(PEER_NETWORKS)
+    for _, allowed_ips in peers:
+        for allowed_ip in allowed_ips:
+            ip, _, prefix = allowed_ip.partition('/')
+            if not prefix or prefix in ("32", "128"):
+                index.mark_used(ip)
+                continue
+            # A routed subnet takes every address it shares with the pools
+            network = ipaddress.ip_network(allowed_ip, strict=False)
+            for pool in index.pools:
+                if pool.version != network.version or not pool.overlaps(network):
+                    continue
+                overlap = network if network.prefixlen >= pool.prefixlen else pool
+                if overlap.num_addresses > 65536:
+                    print(f"Ignoring allowed IP {allowed_ip}: too large to index")
+                    continue
+                for address in overlap:
+                    index.mark_used(address)
+    # So the first allocation does not walk past every address in use
+    index.skip_used()
+    return index
+
+def _on_peer_store_change(public_key, old, new):
+    # Runs under the store's lock, for this process's changes and other processes' alike
+    for index in (_peer_index, _pending_index):
+        if index is None:
+            continue
+        if old and (not new or old["ip"] != new["ip"]):
+            index.release(old["ip"])
+        if new:
+            index.mark_used(new["ip"])
+
+def get_peer_store():
+    global _peer_store
+    if _peer_store is None:
+        store = PeerStore(PEER_STORE_PATH, lock_path=PEER_STORE_PATH.with_suffix(".lock"))
+        store.subscribe(_on_peer_store_change)
+        _peer_store = store.load()
+    return _peer_store
+
+def forget_removed_peers(store, recorded, on_wg0):
+    """Drop recorded peers that have since been taken off wg0, freeing their addresses.
+
+    Only keys recorded before the dump was read are considered: every one of them was
+    on wg0 before it was recorded, so missing from the dump means removed.
+    """
+    gone = [public_key for public_key in recorded if public_key not in on_wg0]
+    if not gone:
+        return []
+    with store.transaction():
+        return [peer for peer in map(store.remove, gone) if peer is not None]
+
+def refresh_peer_index():
+    """Rebuild the index from one streamed `wg show dump` plus the peer store, then swap it in.
+
+    Allocation carries on from the old index meanwhile: only the swap takes `_lock`.
+    """
+    global _peer_index, _pending_index, _peer_index_loaded_at
+    store = get_peer_store()
+    index = IPAllocator.from_env_value(PEER_NETWORKS)
+    with _lock:
+        _pending_index = index
+    try:
+        store.refresh()
+        recorded = [public_key for public_key, _ in store.items()]
+        for _, peer in store.items():
+            index.mark_used(peer["ip"])
+        on_wg0, routed = set(), set()
+
+        def dump():
+            for public_key, allowed_ips in backend.allowed_ips():
+                on_wg0.add(public_key)
+                routed.update(allowed_ips)
+                yield public_key, allowed_ips
+
+        build_peer_index(dump(), index)
+        # Peers taken off wg0 by other tools or an interface restart would otherwise
+        # keep their addresses forever
+        for peer in forget_removed_peers(store, recorded, on_wg0):
+            if host_prefix(peer["ip"]) in routed:
+                # Now routed to a peer this script did not record
+                index.mark_used(peer["ip"])
+        with _lock:
+            _peer_index, _pending_index = index, None
+            _peer_index_loaded_at = time.monotonic()
+    except Exception:
+        with _lock:
+            _pending_index = None
+        raise
+
+def _refresh_in_background():
+    try:
+        refresh_peer_index()
+    except Exception as e:
+        print(f"Failed to rebuild the peer address index: {e}")
+    finally:
+        _refresh_lock.release()
+
+def load_peer_index():
+    """Build the index on first use; later, rebuild it in the background once it is stale"""
+    if _peer_index is None:
+        with _refresh_lock:
+            if _peer_index is None:
+                refresh_peer_index()
+    elif (time.monotonic() - _peer_index_loaded_at > PEER_INDEX_MAX_AGE
+          and _refresh_lock.acquire(blocking=False)):
+        threading.Thread(target=_refresh_in_background, name="peer-index", daemon=True).start()
 
 def get_next_peer_ip():
-    """Get the next available peer IP"""
-    # Get list of existing peers
-    wg_show = run_command("wg show wg0 dump")
-    used_ips = set()
-    
-    # Skip first line (server info)
-    for line in wg_show.split('\n')[1:]:
-        if line:
-            parts = line.split('\t')
-            if len(parts) >= 4:
-                peer_ip = parts[3].split('/')[0]  # Extract IP without subnet
-                last_octet = int(peer_ip.split('.')[-1])
-                used_ips.add(last_octet)
-    
-    # Find next available IP in range 2-254
-    for i in range(2, 255):
-        if i not in used_ips:
-            return f"10.0.0.{i}"
-    
-    raise Exception("No available IP addresses")
+    """Get the next available peer IP (call with `_lock` and the store's transaction held)"""
+    try:
+        return str(_peer_index.allocate())
+    except AddressPoolExhausted:
+        raise PeerGenerationError("No available IP addresses")
 
 def create_peer_config(peer_private_key, server_public_key, server_public_ip, peer_ip):
     """Create peer configuration"""
+    allowed_ips = "0.0.0.0/0, ::/0" if ":" in peer_ip else "0.0.0.0/0"
     return f"""[Interface]
 PrivateKey = {peer_private_key}
-Address = {peer_ip}/32
+Address = {host_prefix(peer_ip)}
 DNS = 8.8.8.8, 8.8.4.4
 
 [Peer]
 PublicKey = {server_public_key}
-AllowedIPs = 0.0.0.0/0
+AllowedIPs = {allowed_ips}
 Endpoint = {server_public_ip}:51820
 PersistentKeepalive = 25"""
 
+def save_peer_config(output_dir, user, peer_config):
+    """Write a client config and return its path.
+
+    Without a user the next free peer_N.conf is claimed with O_EXCL, so concurrent
+    callers never write the same file.
+    """
+    # Use user address as identifier if provided
+    if user:
+        config_path = output_dir / f"peer_{user}.conf"
+        with open(config_path, "w") as f:
+            f.write(peer_config)
+        return config_path
+
+    # Find next available peer number for backward compatibility
+    peer_num = 1
+    while True:
+        config_path = output_dir / f"peer_{peer_num}.conf"
+        try:
+            fd = os.open(config_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            break
+        except FileExistsError:
+            peer_num += 1
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(peer_config)
+    except OSError:
+        config_path.unlink()
+        raise
+    return config_path
+
+def create_peer(user=None, output_dir=OUTPUT_DIR):
+    """Create a peer, add it to wg0 and save its client config.
+
+    Returns a dict with the config, where it was saved, the peer IP and the
+    peer public key. Nothing is forked: keys are generated in-process and
+    the peer goes to the kernel through the WireGuard backend.
+    """
+    if user and not USER_PATTERN.fullmatch(user):
+        raise PeerGenerationError("user may only contain letters, digits, '.', '_' and '-'")
+
+    server_public_key, server_public_ip = get_server_info()
+    peer_private_key, peer_public_key = generate_peer_keys()
+    load_peer_index()
+    peer_store = get_peer_store()
+    
+    # Create output directory if it doesn't exist
+    output_dir = Path(output_dir)
+    output_dir.mkdir(exist_ok=True)
+    
+    with _lock:
+        # The transaction first replays what other processes recorded, so their
+        # addresses are marked used before this one picks
+        with peer_store.transaction():
+            # Get next available IP
+            peer_ip = get_next_peer_ip()
+            
+            # Add peer to WireGuard server, then record its address for everyone else
+            try:
+                backend.add_peer(peer_public_key, [host_prefix(peer_ip)])
+            except Exception:
+                _peer_index.release(peer_ip)
+                raise
+            try:
+                peer_store.put(peer_public_key, {"public_key": peer_public_key, "ip": peer_ip,
+                                                 "user": user})
+            except Exception:
+                backend.remove_peer(peer_public_key)
+                _peer_index.release(peer_ip)
+                raise
+
+    # Create peer configuration
+    peer_config = create_peer_config(peer_private_key, server_public_key, server_public_ip, peer_ip)
+
+    # Save peer configuration only once the peer exists, and undo the peer if that fails;
+    # outside _lock, so finding a free file name does not hold up other requests
+    try:
+        config_path = save_peer_config(output_dir, user, peer_config)
+    except OSError as e:
+        backend.remove_peer(peer_public_key)
+        # Releases the address in every process's index
+        peer_store.remove(peer_public_key)
+        raise PeerGenerationError(f"Could not save the peer config: {e}")
+    
+    return {
+        "config": peer_config,
+        "config_path": config_path,
+        "peer_ip": peer_ip,
+        "public_key": peer_public_key,
+    }
+
 def main():
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Generate WireGuard peer configuration')
@@ -78,45 +307,16 @@ def main():
 
     print("Generating new peer configuration...")
     
-    # Get server information
-    server_public_key, server_public_ip = get_server_info()
-    
-    # Generate peer keys
-    peer_private_key, peer_public_key = generate_peer_keys()
-    
-    # Get next available IP
-    peer_ip = get_next_peer_ip()
-    
-    # Create output directory if it doesn't exist
-    output_dir = Path("output")
-    output_dir.mkdir(exist_ok=True)
-    
-    # Use user address as identifier if provided
-    if args.user:
-        config_name = f"peer_{args.user}.conf"
-    else:
-        # Find next available peer number for backward compatibility
-        peer_num = 1
-        while (output_dir / f"peer_{peer_num}.conf").exists():
-            peer_num += 1
-        config_name = f"peer_{peer_num}.conf"
-    
-    # Create peer configuration
-    peer_config = create_peer_config(peer_private_key, server_public_key, server_public_ip, peer_ip)
-    
-    # Save peer configuration
-    config_path = output_dir / config_name
-    with open(config_path, "w") as f:
-        f.write(peer_config)
-    
-    # Add peer to WireGuard server
-    add_peer_cmd = f"wg set wg0 peer {peer_public_key} allowed-ips {peer_ip}/32"
-    run_command(add_peer_cmd)
+    try:
+        peer = create_peer(args.user)
+    except Exception as e:
+        print(f"Error: {e}")
+        sys.exit(1)
     
     print(f"\nPeer configuration generated successfully!")
-    print(f"Configuration saved to: {config_path}")
-    print(f"Peer IP: {peer_ip}")
-    print(f"Peer Public Key: {peer_public_key}")
+    print(f"Configuration saved to: {peer['config_path']}")
+    print(f"Peer IP: {peer['peer_ip']}")
+    print(f"Peer Public Key: {peer['public_key']}")
     print("\nImport the configuration file into your WireGuard client to connect.")
 
 if __name__ == "__main__":